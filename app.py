@@ -3,12 +3,13 @@
 Food Scanner - Streamlit Web Interface
 Interfaz visual para escanear productos alimenticios
 """
+import hashlib
 import os
 import sys
+from io import BytesIO
 from pathlib import Path
-import tempfile
-import shutil
 
+import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
 
@@ -16,7 +17,19 @@ from dotenv import load_dotenv
 sys.path.insert(0, str(Path(__file__).parent))
 
 import config
-from modules import OCRProcessor, OpenFoodFactsClient, DataHandler
+from modules import (
+    OCRProcessor,
+    OCRCache,
+    OpenFoodFactsClient,
+    OpenFoodFactsCache,
+    OpenFoodFactsIndex,
+    DataHandler,
+    ImageHashIndex,
+    ProductDeduplicator,
+    SessionImageStore,
+    ScanPipeline,
+)
+from modules.result_store import IMAGES_SEPARATOR
 
 # Load environment variables
 load_dotenv()
@@ -32,17 +45,130 @@ st.set_page_config(
 
 def init_session_state():
     """Initialize Streamlit session state variables."""
-    if 'results' not in st.session_state:
-        st.session_state.results = []
     if 'processing' not in st.session_state:
         st.session_state.processing = False
     if 'images_uploaded' not in st.session_state:
         st.session_state.images_uploaded = []
     if 'data_handler' not in st.session_state:
         st.session_state.data_handler = DataHandler()
+    if 'image_store' not in st.session_state:
+        st.session_state.image_store = SessionImageStore()
+
+
+@st.cache_resource(show_spinner=False)
+def get_ocr_processor(key_id=None, _api_key=None, demo_mode=False, use_cache=True, hedge=False):
+    """
+    Get the OCR processor for a set of settings, shared by every rerun and session.
+    
+    Sharing it keeps the Gemini clients, key pool and its learned concurrency
+    limits, and the OCR cache connection, alive between runs. Its statistics
+    are running totals and bounded windows, so they do not grow with use.
+    
+    Args:
+        key_id: Hash of the API key; the cache is keyed by it instead of the key itself
+        _api_key: Gemini API key (leading underscore: Streamlit does not hash or store it)
+        demo_mode: Whether to use demo mode
+        use_cache: Whether to reuse cached OCR results
+        hedge: Whether unusually slow Gemini calls get a duplicate request
+    
+    Raises:
+        ValueError: If no Gemini API key is configured (not cached, so fixing it takes effect)
+    """
+    return OCRProcessor(
+        api_key=_api_key,
+        demo_mode=demo_mode,
+        cache=OCRCache() if use_cache and not demo_mode else None,
+        hedge=hedge
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_off_cache():
+    """Get the Open Food Facts lookup cache connection, shared by every rerun and session."""
+    return OpenFoodFactsCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_local_index(built_at):
+    """
+    Get the offline Open Food Facts index, shared by every rerun and session.
+    
+    Args:
+        built_at: Modification time of the index file, so a rebuilt index is reopened
+    """
+    return OpenFoodFactsIndex()
+
+
+def get_api_client(use_cache=True):
+    """
+    Build the Open Food Facts client for one processing run.
+    
+    The client remembers every lookup it made (see OpenFoodFactsClient._lookup),
+    so it lives for a single run; only the SQLite cache and index are shared.
+    An index built while the app is running is used from the next run on.
+    """
+    index_path = Path(config.OFF_INDEX_PATH)
+    local_index = get_local_index(index_path.stat().st_mtime) if index_path.exists() else None
+    return OpenFoodFactsClient(
+        cache=get_off_cache() if use_cache else None,
+        local_index=local_index
+    )
+
+
+def get_results_frame(data_handler):
+    """
+    Get the grid DataFrame for the current results.
+    
+    It is rebuilt only when the results change (their fingerprint), not on
+    every rerun caused by a click in the grid.
+    
+    Args:
+        data_handler: DataHandler with the results
+    
+    Returns:
+        Results DataFrame with the 'Seleccionar' column; treat it as read-only
+    """
+    cached = st.session_state.get("results_frame")
+    if cached is None or cached[0] != data_handler.fingerprint:
+        df = data_handler.get_dataframe()
+        df.insert(0, "Seleccionar", False)
+        cached = (data_handler.fingerprint, df)
+        st.session_state.results_frame = cached
+    return cached[1]
+
+
+def frame_hash(df) -> str:
+    """Hash a DataFrame's columns and values (grid edits included), for export caching."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def export_csv(content_hash, _df) -> bytes:
+    """CSV export of a results frame, cached by its content hash."""
+    return _df.to_csv(index=False).encode('utf-8')
+
 
+@st.cache_data(max_entries=8, show_spinner=False)
+def export_excel(content_hash, _df) -> bytes:
+    """Excel export of a results frame, cached by its content hash."""
+    excel_buffer = BytesIO()
+    _df.to_excel(excel_buffer, sheet_name="Productos", index=False, engine="openpyxl")
+    return excel_buffer.getvalue()
 
-def process_images(uploaded_files, demo_mode=False, api_key=None):
+
+def process_images(
+    uploaded_files,
+    demo_mode=False,
+    api_key=None,
+    use_cache=True,
+    dedup=True,
+    fuzzy_dedup=False,
+    skip_near_duplicates=True,
+    hedge=False
+):
     """
     Process uploaded images and extract product data.
     
@@ -50,51 +176,92 @@ def process_images(uploaded_files, demo_mode=False, api_key=None):
         uploaded_files: List of uploaded file objects
         demo_mode: Whether to use demo mode (no API key required)
         api_key: Gemini API key for OCR
+        use_cache: Whether to reuse cached OCR results and Open Food Facts lookups
+        dedup: Whether to merge the same product seen in several images into one row
+        fuzzy_dedup: Whether to also merge products with similar names
+        skip_near_duplicates: Whether near-identical photos reuse the OCR result
+            of the first one instead of being sent to Gemini
+        hedge: Whether unusually slow Gemini calls get a duplicate request
     
     Returns:
-        List of processed results
+        DataHandler with the processed results, or None on failure
     """
-    results = []
     data_handler = DataHandler()
-    
-    # Create temporary directory for images
-    temp_dir = Path(tempfile.mkdtemp())
+    deduplicator = ProductDeduplicator(fuzzy=fuzzy_dedup) if dedup else None
+    api_client = None
     
     try:
-        # Save uploaded files to temp directory and session state
-        image_paths = []
-        if 'uploaded_images_dict' not in st.session_state:
-            st.session_state.uploaded_images_dict = {}
-            
+        # Uploads are analyzed straight from memory, without writing them to disk
+        images = []  # (image name, encoded bytes)
+        image_store = st.session_state.image_store
+        
         for uploaded_file in uploaded_files:
-            # Save raw bytes to session state for later visualization
+            # Keep a preview in memory and the original on disk for the "Evidencia Visual" panel
             file_bytes = uploaded_file.getvalue()
-            st.session_state.uploaded_images_dict[uploaded_file.name] = file_bytes
-            
-            temp_path = temp_dir / uploaded_file.name
-            with open(temp_path, "wb") as f:
-                f.write(file_bytes)
-            image_paths.append(temp_path)
+            image_store.add(uploaded_file.name, file_bytes)
+            images.append((uploaded_file.name, file_bytes))
         
-        # Initialize OCR processor
+        # Burst shots and repeated photos reuse the OCR result of the first one
+        hash_index = None
+        if skip_near_duplicates:
+            hash_index = ImageHashIndex()
+            hash_index.add_images(images)
+            for representative, duplicate_names in hash_index.report().items():
+                st.info(f"📸 Fotos casi iguales a {representative} (no se envían a Gemini): {', '.join(duplicate_names)}")
+        
+        # OCR processor is shared across runs (see get_ocr_processor), the API client is not
         try:
-            ocr_processor = OCRProcessor(api_key=api_key if api_key else None, demo_mode=demo_mode)
+            ocr_processor = get_ocr_processor(
+                key_id=hashlib.sha256(api_key.encode()).hexdigest() if api_key else None,
+                _api_key=api_key if api_key else None,
+                demo_mode=demo_mode,
+                use_cache=use_cache,
+                hedge=hedge
+            )
         except ValueError as e:
             st.error(f"Error de configuración: {str(e)}")
-            return []
+            return None
+        
+        api_client = get_api_client(use_cache=use_cache)
         
-        # Initialize API client
-        api_client = OpenFoodFactsClient()
+        # Rows are added once every image is done, so each product lists all of its source images
+        rows = []
+        
+        # OCR result per image name, reused by its near duplicates
+        ocr_results = {}
         
         # Process each image
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        for idx, image_path in enumerate(image_paths):
-            status_text.text(f"Procesando imagen {idx + 1}/{len(image_paths)}: {image_path.name}")
+        # Products appear here as Gemini streams them, before the lookups run
+        live_grid = st.empty()
+        live_table = None
+        
+        for idx, (image_name, image_bytes) in enumerate(images):
+            status_text.text(f"Procesando imagen {idx + 1}/{len(images)}: {image_name}")
             
             # OCR - Extract product names (now returns list of dicts)
-            product_list = ocr_processor.process_image(image_path)
+            representative = hash_index.representative(image_name) if hash_index is not None else None
+            if representative is not None and not OCRProcessor.is_error(ocr_results.get(representative, ["ERROR"])):
+                product_list = ocr_results[representative]
+            else:
+                product_list = []
+                for product in ocr_processor.iter_products(image_bytes, image_name=image_name):
+                    product_list.append(product)
+                    if isinstance(product, dict) and product.get("nombre") not in (None, "ERROR", "NO_DETECTADO"):
+                        live_row = pd.DataFrame([{
+                            "imagen": image_name,
+                            "nombre": product.get("nombre", ""),
+                            "detalle": product.get("detalle", ""),
+                            "proveedor": product.get("proveedor", ""),
+                        }])
+                        if live_table is None:
+                            live_table = live_grid.dataframe(live_row, use_container_width=True, hide_index=True)
+                        else:
+                            # Only the new row is sent, not the whole grid again
+                            live_table.add_rows(live_row)
+            ocr_results[image_name] = product_list
             
             # Handle empty or error cases
             if not product_list:
@@ -104,63 +271,60 @@ def process_images(uploaded_files, demo_mode=False, api_key=None):
             
             if first_prod_name == "ERROR" or product_list[0] == "ERROR":
                 err_msg = product_list[0].get("error", "Error desconocido") if isinstance(product_list[0], dict) else "Error procesando imagen"
-                st.error(f"Error procesando {image_path.name}: {err_msg}")
-                data_handler.add_result_with_source(
-                    image_path.name, 
-                    {"nombre": "ERROR", "detalle": err_msg}, 
-                    None
-                )
+                st.error(f"Error procesando {image_name}: {err_msg}")
+                rows.append((image_name, {"nombre": "ERROR", "detalle": err_msg}, None))
                 continue
             
             if first_prod_name == "NO_DETECTADO":
-                data_handler.add_result_with_source(
-                    image_path.name,
-                    {"nombre": "NO_DETECTADO"},
-                    None
-                )
+                rows.append((image_name, {"nombre": "NO_DETECTADO"}, None))
                 continue
             
-            # Search each product in Open Food Facts
-            for product_dict in product_list:
-                product_name = product_dict.get("nombre", "")
-                if product_name:
-                    product_data = api_client.search_product(product_name)
-                    data_handler.add_result_with_source(
-                        image_path.name,
-                        product_dict,
-                        product_data
-                    )
+            # Demo mode returns plain names
+            named_products = [ScanPipeline.as_product_dict(p) for p in product_list]
+            named_products = [p for p in named_products if p.get("nombre", "")]
+            
+            # Products already seen in an earlier image are merged, not searched again
+            if deduplicator is not None:
+                named_products = [deduplicator.add(image_name, p) for p in named_products]
+                named_products = [p for p in named_products if p is not None]
+            
+            # Search the image's products in Open Food Facts concurrently
+            product_data_list = api_client.search_many([p["nombre"] for p in named_products])
+            for product_dict, product_data in zip(named_products, product_data_list):
+                rows.append((image_name, product_dict, product_data))
             
-            progress_bar.progress((idx + 1) / len(image_paths))
+            progress_bar.progress((idx + 1) / len(images))
         
+        for image_name, product_dict, product_data in rows:
+            data_handler.add_result_with_source(image_name, product_dict, product_data)
+        
+        if deduplicator is not None and deduplicator.duplicates:
+            st.info(f"🔁 {deduplicator.duplicates} apariciones repetidas unidas en {len(deduplicator)} productos únicos")
+        
+        live_grid.empty()
         status_text.text("¡Procesamiento completado!")
-        api_client.close()
         
-        return data_handler.results
+        return data_handler
         
     except Exception as e:
         st.error(f"Error durante el procesamiento: {str(e)}")
-        return []
+        return None
     finally:
-        # Cleanup temp directory
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        if api_client is not None:
+            api_client.close()
 
 
-def display_erp_grid(results):
+def display_erp_grid(df):
     """
     Display results in ERP grid format.
     
     Args:
-        results: List of result dictionaries
+        df: Results DataFrame (get_results_frame)
     """
-    if not results:
+    if df.empty:
         st.info("No hay resultados para mostrar")
         return
     
-    # Create DataFrame
-    import pandas as pd
-    df = pd.DataFrame(results)
-    
     # Add 'Seleccionar' column for selection
     if "Seleccionar" not in df.columns:
         df.insert(0, "Seleccionar", False)
@@ -211,18 +375,44 @@ def display_erp_grid(results):
         if not selected_rows.empty:
             # Get the first selected row
             first_selected = selected_rows.iloc[0]
-            selected_image_name = first_selected["imagen"]
-            st.info(f"Mostrando: **{selected_image_name}**")
             
-            # Retrieve from session_state
-            if "uploaded_images_dict" in st.session_state and selected_image_name in st.session_state.uploaded_images_dict:
+            # All images the product was seen in (rows added in the grid only have "imagen")
+            image_names = [first_selected["imagen"]]
+            if first_selected.name in df.index and df.at[first_selected.name, "imagenes"]:
+                image_names = df.at[first_selected.name, "imagenes"].split(IMAGES_SEPARATOR)
+            
+            if len(image_names) > 1:
+                st.info(f"Mostrando: **{image_names[0]}** (+{len(image_names) - 1} imágenes más)")
+            else:
+                st.info(f"Mostrando: **{image_names[0]}**")
+            
+            # Previews are in memory; originals are read from disk only when asked for
+            image_store = st.session_state.image_store
+            for image_name in image_names:
+                preview = image_store.preview(image_name)
+                if preview is None:
+                    st.warning(f"Imagen {image_name} no encontrada en memoria. Re-sube las fotos.")
+                    continue
+                
                 st.image(
-                    st.session_state.uploaded_images_dict[selected_image_name], 
+                    preview,
                     use_container_width=True,
-                    caption=f"Producto referenciado: {first_selected['nombre']}"
+                    caption=f"Producto referenciado: {first_selected['nombre']} ({image_name})"
                 )
-            else:
-                st.warning("Imagen no encontrada en memoria. Re-sube las fotos.")
+                if st.toggle("Ver en resolución completa", key=f"original_{image_name}"):
+                    original = image_store.original(image_name)
+                    if original is not None:
+                        st.image(original, use_container_width=True)
+                    else:
+                        st.warning(f"El original de {image_name} ya no está guardado; se muestra la vista previa.")
+            
+            store_stats = image_store.stats()
+            st.caption(
+                f"Imágenes de la sesión: {store_stats['imagenes']} · "
+                f"vistas previas {store_stats['memoria_bytes'] / 1024 / 1024:.1f} MB en memoria · "
+                f"originales {store_stats['disco_bytes'] / 1024 / 1024:.0f}/"
+                f"{store_stats['disco_max_bytes'] / 1024 / 1024:.0f} MB en disco"
+            )
         else:
             st.info("👈 Marca la casilla 'Seleccionar' en la grilla para verificar su imagen de origen.")
 
@@ -254,6 +444,40 @@ def main():
             help="Usa datos simulados sin necesidad de API key"
         )
         
+        # Cache toggle
+        use_cache = st.toggle(
+            "Usar caché",
+            value=True,
+            help="Reutiliza imágenes ya analizadas y productos ya buscados sin volver a llamar a Gemini ni a Open Food Facts"
+        )
+        
+        # Near-duplicate photo toggle
+        skip_near_duplicates = st.toggle(
+            "Omitir fotos casi iguales",
+            value=True,
+            help="Las ráfagas y fotos repetidas reutilizan el análisis de la primera en vez de enviarse a Gemini"
+        )
+        
+        # Deduplication toggles
+        dedup = st.toggle(
+            "Unir duplicados",
+            value=True,
+            help="Une el mismo producto visto en varias imágenes en una sola fila y lo busca una sola vez"
+        )
+        fuzzy_dedup = st.toggle(
+            "Coincidencia aproximada",
+            value=False,
+            disabled=not dedup,
+            help="Une también productos con nombres muy parecidos (errores de lectura)"
+        )
+        
+        # Hedged requests toggle
+        hedge = st.toggle(
+            "Duplicar peticiones lentas",
+            value=config.OCR_HEDGE,
+            help="Si Gemini tarda mucho más de lo habitual con una imagen, envía una segunda petición y usa la primera respuesta"
+        )
+        
         st.divider()
         
         st.header("ℹ️ Acerca de")
@@ -285,32 +509,36 @@ def main():
             st.session_state.processing = True
             
             with st.spinner("Procesando imágenes..."):
-                results = process_images(uploaded_files, demo_mode=demo_mode, api_key=api_key if api_key else None)
-                st.session_state.results = results
+                data_handler = process_images(
+                    uploaded_files,
+                    demo_mode=demo_mode,
+                    api_key=api_key if api_key else None,
+                    use_cache=use_cache,
+                    dedup=dedup,
+                    fuzzy_dedup=fuzzy_dedup,
+                    skip_near_duplicates=skip_near_duplicates,
+                    hedge=hedge
+                )
+                if data_handler is not None:
+                    st.session_state.data_handler = data_handler
             
             st.session_state.processing = False
     
-    # Display results
-    if st.session_state.results:
+    # Display results (summary counts are kept by the result store as rows are added)
+    summary = st.session_state.data_handler.get_summary()
+    if summary["total"]:
         st.divider()
         
-        # Summary
-        summary = {
-            "total": len(st.session_state.results),
-            "encontrados": sum(1 for r in st.session_state.results if r.get("estado") == "ENCONTRADO"),
-            "no_encontrados": sum(1 for r in st.session_state.results if r.get("estado") == "NO_ENCONTRADO"),
-        }
-        
         # Summary metrics
         m1, m2, m3, m4 = st.columns(4)
         m1.metric("Total Productos", summary["total"])
         m2.metric("✅ Encontrados", summary["encontrados"])
         m3.metric("❌ No Encontrados", summary["no_encontrados"])
-        tasa = (summary["encontrados"] / summary["total"] * 100) if summary["total"] > 0 else 0
-        m4.metric("Tasa de Éxito", f"{tasa:.1f}%")
+        m4.metric("Tasa de Éxito", f"{summary['tasa_exito']:.1f}%")
         
         # Display ERP grid
-        display_erp_grid(st.session_state.results)
+        df_results = get_results_frame(st.session_state.data_handler)
+        display_erp_grid(df_results)
         
         # Export section
         st.divider()
@@ -319,40 +547,32 @@ def main():
         col_exp1, col_exp2 = st.columns(2)
         
         with col_exp1:
-            # Export to Excel (full data)
-            import pandas as pd
-            df_full = pd.DataFrame(st.session_state.results)
-            
             # Reorder columns - EXACTAMENTE COMO SE SOLICITÓ
             erp_cols = ["nombre", "codigoBarras", "detalle", "cantidad", "imagen", "precioCompra", "precioVenta", "stock", "stockMinimo", "proveedor", "categoria", "fechaVencimiento"]
             # To export edits, use the edited_df that was saved in session_state, OR standard results if not edited
             
-            df_export = st.session_state.edited_results if "edited_results" in st.session_state else pd.DataFrame(st.session_state.results)[erp_cols]
+            df_export = st.session_state.edited_results if "edited_results" in st.session_state else df_results[erp_cols]
             
             if "Seleccionar" in df_export.columns:
                 df_export = df_export.drop(columns=["Seleccionar"])
             
-            csv = df_export.to_csv(index=False).encode('utf-8')
+            # Files are built only when a button is clicked, and reused while the data is unchanged
             st.download_button(
                 label="📥 Descargar CSV",
-                data=csv,
+                data=lambda: export_csv(frame_hash(df_export), df_export),
                 file_name="foodscan_erp.csv",
                 mime="text/csv",
+                on_click="ignore",
                 type="primary"
             )
         
         with col_exp2:
-            # Export full Excel using BytesIO
-            from io import BytesIO
-            excel_buffer = BytesIO()
-            df_export.to_excel(excel_buffer, sheet_name="Productos", index=False, engine="openpyxl")
-            excel_data = excel_buffer.getvalue()
-            
             st.download_button(
                 label="📊 Descargar Excel (completo)",
-                data=excel_data,
+                data=lambda: export_excel(frame_hash(df_export), df_export),
                 file_name="foodscan_completo.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore"
             )
 
 
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Food Scanner - Classifier Benchmark
+Compares the previous per-row category/quantity extraction with the
+precompiled classifier, row by row and over whole pandas columns
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pandas as pd
+
+from modules.classifier import classify_categories, classify_category, extract_quantities, extract_quantity
+
+CATEGORY_SAMPLES = [
+    "Plant-based foods and beverages, Beverages, Waters, Spring waters",
+    "Dairies, Fermented foods, Fermented milk products, Yogurts",
+    "Meats, Prepared meats, Hams, White hams",
+    "Snacks, Sweet snacks, Biscuits and cakes, Biscuits",
+    "Frozen foods, Desserts, Frozen desserts, Ice creams and sorbets",
+    "Lácteos, Quesos, Quesos de vaca",
+    "Condimentos, Salsas, Salsas de tomate",
+    "Cereales y derivados, Arroces",
+    "Conservas, Conservas de pescado, Atunes",
+    "",
+]
+
+NAME_SAMPLES = [
+    "Leche entera 1 L",
+    "Galletas de avena 6 unidades",
+    "Yogur natural 125 g",
+    "Atún en aceite",
+    "Arroz grado 1 1kg",
+    "Papas fritas 12 pcs 250g",
+]
+
+
+def legacy_category(categories: str) -> str:
+    """The previous DataHandler._extract_category_from_openfood."""
+    if not categories:
+        return ""
+    
+    categories_lower = categories.lower()
+    
+    category_mappings = {
+        "bebestible": ["bebida", "bebida", "drink", "beverage", "agua", "jugo", "zumo", "jugu", "refresco", "soda", "cerveza", "vino", "licor", "cafe", "te", "leche"],
+        "helado": ["helado", "ice cream", "ice-cream", "gelato", "sorbete"],
+        "fiambre": ["fiambre", "jamón", "jam", "embutido", "salchicha", "chorizo", "tocino", "bacon", "paté"],
+        "lacteo": ["leche", "yogur", "yogurt", "queso", "cheese", "mantequilla", "crema", "nata", "kumis", "kumys"],
+        "comida": ["comida", "food", "pasta", "arroz", "cereal", "galleta", "biscuit", "pan", "bread", "dulce", "confitería", "chocolate", "carne", "pescado", "verdura", "vegetal", "fruta", "sopa", "salsas"]
+    }
+    
+    for erp_category, keywords in category_mappings.items():
+        for keyword in keywords:
+            if keyword in categories_lower:
+                return erp_category
+    
+    return "comida"
+
+
+def legacy_quantity(product_data: dict) -> str:
+    """The previous DataHandler._extract_quantity_from_openfood."""
+    quantity = product_data.get("quantity", "")
+    serving_size = product_data.get("serving_size", "")
+    
+    if quantity:
+        return str(quantity)
+    elif serving_size:
+        return str(serving_size)
+    else:
+        product_name = product_data.get("product_name", "")
+        patterns = [
+            r'(\d+[.,]?\d*)\s*(g|gramos|ml|mililitros|l|litros|kg|kilogramos)',
+            r'(\d+[.,]?\d*)\s*(u|unidades|pcs|pieces)'
+        ]
+        for pattern in patterns:
+            match = re.search(pattern, product_name.lower())
+            if match:
+                return f"{match.group(1)}{match.group(2)}"
+    
+    return ""
+
+
+def build_catalog(rows: int, seed: int = 7) -> pd.DataFrame:
+    """Build a synthetic catalog with repeated category strings and mixed quantity sources."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(rows):
+        source = rng.random()
+        records.append({
+            "categories": rng.choice(CATEGORY_SAMPLES),
+            "quantity": "500 g" if source < 0.5 else "",
+            "serving_size": "30 g" if 0.5 <= source < 0.7 else "",
+            "product_name": f"{rng.choice(NAME_SAMPLES)} #{i}",
+        })
+    return pd.DataFrame(records)
+
+
+def timed(label: str, func):
+    """Run func once, print its duration and return its result."""
+    start = time.perf_counter()
+    result = func()
+    print(f"  {label:<28}{time.perf_counter() - start:>10.3f} s")
+    return result
+
+
+def main():
+    """Run the benchmark for each row count and check that all variants agree."""
+    parser = argparse.ArgumentParser(description="Benchmark del clasificador de categorías y cantidades")
+    parser.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000], help="Cantidades de filas a probar")
+    args = parser.parse_args()
+    
+    for rows in args.rows:
+        catalog = build_catalog(rows)
+        records = catalog.to_dict("records")
+        print(f"{rows} filas")
+        
+        old_categories = timed("categoría (anterior)", lambda: [legacy_category(r["categories"]) for r in records])
+        new_categories = timed("categoría (por fila)", lambda: [classify_category(r["categories"]) for r in records])
+        vec_categories = timed("categoría (Series)", lambda: classify_categories(catalog["categories"]))
+        
+        old_quantities = timed("cantidad (anterior)", lambda: [legacy_quantity(r) for r in records])
+        new_quantities = timed("cantidad (por fila)", lambda: [extract_quantity(r) for r in records])
+        vec_quantities = timed("cantidad (Series)", lambda: extract_quantities(
+            catalog["quantity"], catalog["serving_size"], catalog["product_name"]
+        ))
+        
+        if not (old_categories == new_categories == vec_categories.tolist()):
+            print("  ERROR: las categorías no coinciden")
+            sys.exit(1)
+        if not (old_quantities == new_quantities == vec_quantities.tolist()):
+            print("  ERROR: las cantidades no coinciden")
+            sys.exit(1)
+        print("  resultados idénticos")
+
+
+if __name__ == "__main__":
+    main()
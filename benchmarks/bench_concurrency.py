@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Food Scanner - Concurrency Benchmark
+Runs the Gemini concurrency primitives against a mock quota and checks
+their guarantees: the AIMD limit settles near the quota without dropping
+images, a key pool spreads load over its keys, SingleFlight collapses
+concurrent calls and JSONArrayStream parses an answer cut anywhere
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from modules.key_pool import GeminiKeyPool
+from utils.concurrency import SingleFlight
+from utils.json_stream import JSONArrayStream
+
+# Backoff of the retry loop, scaled down like the mock call latency
+BACKOFF_BASE = 0.02  # segundos
+BACKOFF_MAX = 0.5  # segundos
+
+
+class MockQuota:
+    """
+    Stand-in for one Gemini key: calls beyond `quota` at once are throttled.
+    
+    Every throttle asks for a short Retry-After half of the time, like
+    Gemini does when its error carries a retry delay.
+    """
+    
+    def __init__(self, quota: int, latency: float, seed: int):
+        """
+        Initialize the mock.
+        
+        Args:
+            quota: Concurrent calls accepted
+            latency: Mean seconds per call
+            seed: Random seed for latencies and Retry-After values
+        """
+        self.quota = quota
+        self.latency = latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self.throttles = 0
+    
+    def call(self):
+        """
+        Serve one call.
+        
+        Returns:
+            (accepted, Retry-After seconds of a throttled call or None if it did not say)
+        """
+        with self._lock:
+            self.calls += 1
+            if self._in_flight >= self.quota:
+                self.throttles += 1
+                return False, self._random.choice([None, self.latency * 2])
+            self._in_flight += 1
+            self.peak = max(self.peak, self._in_flight)
+            latency = self._random.uniform(0.5, 1.5) * self.latency
+        
+        time.sleep(latency)
+        with self._lock:
+            self._in_flight -= 1
+        return True, None
+
+
+def run_pool(pool: GeminiKeyPool, quotas: dict, images: int, retries: int, seed: int) -> dict:
+    """
+    Send mock images through a key pool with the OCR retry loop.
+    
+    Args:
+        pool: Key pool whose keys are the names in quotas
+        quotas: API key -> MockQuota
+        images: Number of images (one call each)
+        retries: Retries per throttled image, like OCR_MAX_RETRIES
+        seed: Random seed for backoff jitter
+    
+    Returns:
+        Dictionary with finished / dropped images, elapsed seconds and pool stats
+    """
+    jitter = random.Random(seed)
+    jitter_lock = threading.Lock()
+    
+    def process(_):
+        for attempt in range(retries + 1):
+            key, ticket = pool.acquire()
+            accepted, retry_after = quotas[key.api_key].call()
+            if accepted:
+                pool.release(key, ticket)
+                return True
+            
+            pool.release(key, ticket, throttled=True, retry_after=retry_after)
+            if attempt == retries:
+                return False
+            if len(pool) > 1:
+                continue
+            if retry_after is None:
+                with jitter_lock:
+                    retry_after = jitter.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            time.sleep(retry_after)
+        return False
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=pool.max_concurrency) as executor:
+        outcomes = list(executor.map(process, range(images)))
+    
+    return {
+        "terminadas": sum(outcomes),
+        "abandonadas": outcomes.count(False),
+        "segundos": time.perf_counter() - start,
+        "pool": pool.stats(),
+    }
+
+
+def check_single_flight(callers: int) -> bool:
+    """Concurrent callers of one key share a single call and its result."""
+    flight = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(callers)
+    
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return "resultado"
+    
+    def caller(_):
+        barrier.wait()
+        return flight.do("clave", slow)
+    
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(caller, range(callers)))
+    
+    return len(calls) == 1 and results == ["resultado"] * callers and flight.saved == callers - 1
+
+
+def check_json_stream(seed: int, cuts: int) -> bool:
+    """An answer split at random points yields the same elements as json.loads."""
+    products = [
+        {"n": f'Producto "{index}" [{index % 3}]', "d": "500 g, {lata}", "p": "Marca\\Sur", "c": "comida"}
+        for index in range(20)
+    ]
+    text = "```json\n" + json.dumps(products, ensure_ascii=False, indent=1) + "\n```"
+    rng = random.Random(seed)
+    
+    for _ in range(cuts):
+        points = sorted(rng.sample(range(1, len(text)), rng.randint(1, 40)))
+        parser = JSONArrayStream()
+        parsed = []
+        for begin, end in zip([0] + points, points + [len(text)]):
+            parsed.extend(parser.feed(text[begin:end]))
+        if parsed != products or not parser.closed:
+            return False
+    return True
+
+
+def main():
+    """Run every check, print the results and exit non-zero if one fails."""
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia contra una cuota simulada de Gemini")
+    parser.add_argument("--quota", type=int, default=6, help="Llamadas simultáneas aceptadas por key")
+    parser.add_argument("--images", type=int, default=120, help="Imágenes simuladas")
+    parser.add_argument("--keys", type=int, default=3, help="Keys del pool en la prueba con varias keys")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos medios por llamada simulada")
+    parser.add_argument("--retries", type=int, default=config.OCR_MAX_RETRIES, help="Reintentos por imagen limitada")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla aleatoria")
+    args = parser.parse_args()
+    
+    # The pool logs every benched key; only the totals matter here
+    logging.disable(logging.WARNING)
+    failures = []
+    
+    # One key: AIMD has to find the quota on its own
+    quotas = {"clave-unica-0000": MockQuota(args.quota, args.latency, args.seed)}
+    pool = GeminiKeyPool(list(quotas), lambda api_key: None, adaptive=True, concurrency=2, max_concurrency=4 * args.quota)
+    result = run_pool(pool, quotas, args.images, args.retries, args.seed)
+    key = result["pool"]["claves"][0]
+    print(
+        f"1 key, cuota {args.quota}: {result['terminadas']}/{args.images} imágenes en {result['segundos']:.2f} s, "
+        f"límite final {key['limite']} (máx. {key['limite_max']}), {key['limitaciones']} limitaciones, "
+        f"{result['abandonadas']} abandonadas"
+    )
+    if result["abandonadas"]:
+        failures.append("imágenes abandonadas con una key")
+    if not args.quota // 2 <= key["limite"] <= 2 * args.quota:
+        failures.append(f"el límite no se asentó cerca de la cuota ({key['limite']})")
+    
+    # Several keys: throttled keys are benched and the others take their traffic
+    quotas = {
+        f"clave-{index}-{index:04d}": MockQuota(args.quota, args.latency, args.seed + index)
+        for index in range(args.keys)
+    }
+    pool = GeminiKeyPool(
+        list(quotas), lambda api_key: None, adaptive=True, concurrency=2,
+        max_concurrency=4 * args.quota, bench_seconds=args.latency * 4
+    )
+    result = run_pool(pool, quotas, args.images * args.keys, args.retries, args.seed)
+    served = [quota.calls - quota.throttles for quota in quotas.values()]
+    print(
+        f"{args.keys} keys, cuota {args.quota} c/u: {result['terminadas']}/{args.images * args.keys} imágenes "
+        f"en {result['segundos']:.2f} s, llamadas aceptadas por key {served}, "
+        f"{result['pool']['limitaciones']} limitaciones, {result['abandonadas']} abandonadas"
+    )
+    if result["abandonadas"]:
+        failures.append("imágenes abandonadas con varias keys")
+    if min(served) < args.images // 2:
+        failures.append(f"carga mal repartida entre keys ({served})")
+    
+    ok = check_single_flight(callers=16)
+    print(f"SingleFlight: 16 llamadas simultáneas -> {'1 llamada real' if ok else 'FALLO'}")
+    if not ok:
+        failures.append("SingleFlight no agrupó las llamadas")
+    
+    ok = check_json_stream(args.seed, cuts=200)
+    print(f"JSONArrayStream: 200 respuestas cortadas al azar -> {'OK' if ok else 'FALLO'}")
+    if not ok:
+        failures.append("JSONArrayStream no reconstruyó la respuesta")
+    
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FALLO: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
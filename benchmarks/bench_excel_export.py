@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Food Scanner - Excel Export Benchmark
+Compares time and peak RSS of the streaming exporter against the previous
+DataFrame + openpyxl exporter for 1k/10k/100k rows
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pandas as pd
+
+import config
+from modules import DataHandler
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+EXPORTERS = ["dataframe", "streaming"]
+
+
+def build_handler(rows: int) -> DataHandler:
+    """Fill a DataHandler with realistic-looking results."""
+    handler = DataHandler()
+    for i in range(rows):
+        handler.add_result(
+            f"gondola_{i // 40:04d}.jpg",
+            {"nombre": f"Producto de prueba {i}", "detalle": "500g", "proveedor": "Marca", "categoria": "comida"},
+            {"code": f"780{i:010d}", "categories": "Lácteos, Leches", "brands": "Soprole, Nestle", "quantity": "1 L"}
+        )
+    return handler
+
+
+def export_dataframe(handler: DataHandler, output_path: Path):
+    """The previous exporter: DataFrame + normal openpyxl workbook + second pass for widths."""
+    df = pd.DataFrame(handler.results)
+    with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+        df.to_excel(writer, sheet_name=config.EXCEL_SHEET_NAME, index=False)
+        worksheet = writer.sheets[config.EXCEL_SHEET_NAME]
+        for column in worksheet.columns:
+            max_length = 0
+            column_letter = column[0].column_letter
+            for cell in column:
+                try:
+                    if len(str(cell.value)) > max_length:
+                        max_length = len(str(cell.value))
+                except:
+                    pass
+            worksheet.column_dimensions[column_letter].width = min(max_length + 2, 50)
+
+
+def run_child(exporter: str, rows: int):
+    """Run one measurement in this process and print it as JSON."""
+    handler = build_handler(rows)
+    # ru_maxrss is in KB on Linux
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = Path(tmp) / "bench.xlsx"
+        start = time.perf_counter()
+        if exporter == "dataframe":
+            export_dataframe(handler, output_path)
+        else:
+            handler.export_to_excel(output_path)
+        elapsed = time.perf_counter() - start
+    
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": rss_after / 1024,
+        "export_rss_mb": (rss_after - rss_before) / 1024,
+    }))
+
+
+def main():
+    """Run every exporter/row-count pair in a fresh process and print a table."""
+    parser = argparse.ArgumentParser(description="Benchmark de exportación a Excel")
+    parser.add_argument("--rows", type=int, nargs="*", default=ROW_COUNTS, help="Cantidades de filas a probar")
+    parser.add_argument("--child", nargs=2, metavar=("EXPORTER", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        run_child(args.child[0], int(args.child[1]))
+        return
+    
+    print(f"{'filas':>8}  {'exportador':<10}{'tiempo (s)':>12}{'RSS pico (MB)':>15}{'RSS export (MB)':>17}")
+    for rows in args.rows:
+        for exporter in EXPORTERS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", exporter, str(rows)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(
+                f"{rows:>8}  {exporter:<10}{result['seconds']:>12.2f}"
+                f"{result['peak_rss_mb']:>15.0f}{result['export_rss_mb']:>17.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
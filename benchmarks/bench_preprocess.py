@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Food Scanner - Preprocessing Benchmark
+Measures preprocessing latency and upload payload size for each setting
+"""
+import argparse
+import statistics
+import sys
+from io import BytesIO
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+from modules import OCRProcessor
+from modules.preprocess import preprocess_image
+
+MAX_DIMENSIONS = [3072, 2048, 1536, 1024]
+FORMATS = ["JPEG", "WEBP"]
+QUALITIES = [95, 85, 75]
+
+
+def synthetic_photo(width: int = 4000, height: int = 3000) -> bytes:
+    """
+    Build a noisy 12 MP JPEG as a stand-in for a phone photo.
+    
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+    
+    Returns:
+        JPEG bytes
+    """
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+def load_samples(input_path: Path) -> list[bytes]:
+    """Load sample images from a folder, or synthesize one if none is given."""
+    if input_path is None:
+        return [synthetic_photo()]
+    return [path.read_bytes() for path in OCRProcessor.get_images_from_folder(input_path)]
+
+
+def main():
+    """Run the benchmark and print one row per setting."""
+    parser = argparse.ArgumentParser(description="Benchmark de preprocesado de imágenes")
+    parser.add_argument("--input", "-i", type=Path, default=None, help="Carpeta con fotos de ejemplo")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="Repeticiones por imagen")
+    args = parser.parse_args()
+    
+    samples = load_samples(args.input)
+    if not samples:
+        print("No se encontraron imágenes")
+        sys.exit(1)
+    
+    original_kb = statistics.mean(len(sample) for sample in samples) / 1024
+    print(f"{len(samples)} imagen(es), tamaño medio original: {original_kb:.0f} KB")
+    print()
+    print(f"{'formato':<8}{'max_dim':>8}{'calidad':>9}{'ms (mediana)':>14}{'KB (media)':>12}{'reducción':>11}")
+    
+    for image_format in FORMATS:
+        for max_dimension in MAX_DIMENSIONS:
+            for quality in QUALITIES:
+                timings = []
+                sizes = []
+                for sample in samples:
+                    for _ in range(args.repeat):
+                        result = preprocess_image(sample, max_dimension, image_format, quality)
+                        timings.append(result["elapsed_ms"])
+                        sizes.append(result["bytes_after"])
+                
+                size_kb = statistics.mean(sizes) / 1024
+                print(
+                    f"{image_format:<8}{max_dimension:>8}{quality:>9}"
+                    f"{statistics.median(timings):>14.1f}{size_kb:>12.0f}"
+                    f"{(1 - size_kb / original_kb) * 100:>10.0f}%"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Food Scanner - Offline Index Builder
+Construye el índice local de Open Food Facts a partir de un volcado de datos
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import config
+from modules import OpenFoodFactsIndex
+from utils import setup_logger
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Food Scanner - Construye el índice local de Open Food Facts",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Volcados soportados (https://world.openfoodfacts.org/data):
+  openfoodfacts-products.jsonl.gz
+  en.openfoodfacts.org.products.csv.gz
+
+Ejemplos de uso:
+  python build_index.py --source openfoodfacts-products.jsonl.gz
+  python build_index.py --source en.openfoodfacts.org.products.csv --output mi_indice.sqlite3
+        """
+    )
+    
+    parser.add_argument(
+        "--source", "-s",
+        type=str,
+        required=True,
+        help="Archivo JSONL o CSV exportado de Open Food Facts (puede estar comprimido en .gz)"
+    )
+    
+    parser.add_argument(
+        "--output", "-o",
+        type=str,
+        default=str(config.OFF_INDEX_PATH),
+        help=f"Archivo del índice (default: {config.OFF_INDEX_PATH})"
+    )
+    
+    parser.add_argument(
+        "--verbose", "-v",
+        action="store_true",
+        help="Modo verbose (muestra mensajes de debug)"
+    )
+    
+    return parser.parse_args()
+
+
+def main():
+    """Build the index."""
+    args = parse_arguments()
+    logger = setup_logger(verbose=args.verbose)
+    
+    source_path = Path(args.source)
+    if not source_path.is_file():
+        logger.error(f"Archivo de origen no encontrado: {source_path}")
+        sys.exit(1)
+    
+    index = OpenFoodFactsIndex(Path(args.output))
+    
+    try:
+        start = time.perf_counter()
+        count = index.build(source_path)
+        logger.info(f"[OK] {count} productos indexados en {time.perf_counter() - start:.0f} s")
+    except KeyboardInterrupt:
+        logger.warning("\nProceso interrumpido por el usuario")
+        sys.exit(130)
+    except Exception as e:
+        logger.error(f"Error construyendo el índice: {str(e)}", exc_info=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
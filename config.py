@@ -14,58 +14,177 @@ BASE_DIR = Path(__file__).parent
 IMAGES_DIR = BASE_DIR / "images"
 OUTPUT_DIR = BASE_DIR / "output"
 LOGS_DIR = BASE_DIR / "logs"
+CACHE_DIR = BASE_DIR / "cache"
 
 # Ensure directories exist
 IMAGES_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(exist_ok=True)
 
 # Gemini API Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_API_KEYS_FILE = os.getenv("GEMINI_API_KEYS_FILE", "")  # Una API key por línea
+GEMINI_KEY_BENCH_SECONDS = float(os.getenv("GEMINI_KEY_BENCH_SECONDS", "30"))  # Pausa de una key limitada
 GEMINI_MODEL = "gemini-2.5-pro"  # Mejor razonamiento para evitar alucinaciones
 GEMINI_MAX_TOKENS = 4096
 GEMINI_TEMPERATURE = 0.0  # Temperatura 0 para asegurar determinismo y 0 alucinaciones
 
+# Model tiers - the fast model answers first; GEMINI_MODEL only redoes answers that
+# are invalid, empty, have products without a name or too many repeats (when streaming,
+# only while none of the fast model's products have been passed on yet)
+OCR_TIERED = os.getenv("OCR_TIERED", "1") != "0"
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash")
+OCR_ESCALATE_DUPLICATE_RATIO = float(os.getenv("OCR_ESCALATE_DUPLICATE_RATIO", "0.2"))  # Fracción de repetidos
+
+# OCR concurrency - Gemini calls are network-bound, so several can run at once
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "4"))
+
+# Adaptive Gemini concurrency (AIMD) - starts at OCR_MAX_WORKERS, grows by one
+# call per window of successes and halves on 429/503, settling at the key's quota
+OCR_ADAPTIVE = os.getenv("OCR_ADAPTIVE", "1") != "0"
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "16"))  # Techo del límite adaptativo
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "5"))  # Reintentos por petición limitada
+OCR_STATS_WINDOW = 1000  # Latencias recientes usadas para los p95 de los resúmenes
+OCR_BACKOFF_BASE = 2.0  # segundos
+OCR_BACKOFF_MAX = 60.0  # segundos
+
+# Hedged requests - a call slower than the recent OCR_HEDGE_PERCENTILE latency gets a
+# duplicate and the first answer wins; duplicates are capped at OCR_HEDGE_MAX_RATIO of calls
+OCR_HEDGE = os.getenv("OCR_HEDGE", "0") != "0"
+OCR_HEDGE_PERCENTILE = int(os.getenv("OCR_HEDGE_PERCENTILE", "95"))  # 1-99
+OCR_HEDGE_MAX_RATIO = float(os.getenv("OCR_HEDGE_MAX_RATIO", "0.1"))
+OCR_HEDGE_MIN_DELAY = 1.0  # segundos; nunca se duplica antes
+OCR_HEDGE_MIN_SAMPLES = 10  # Latencias observadas antes de empezar a duplicar
+OCR_HEDGE_WINDOW = 100  # Latencias recientes consideradas
+OCR_CALL_DEADLINE = float(os.getenv("OCR_CALL_DEADLINE", "120"))  # segundos por llamada; 0 = sin plazo
+
+# Streaming responses - products are parsed as Gemini writes them, so the
+# first ones reach Open Food Facts before the whole answer is finished
+OCR_STREAM = os.getenv("OCR_STREAM", "1") != "0"
+
+# Multi-image packing - several photos per Gemini request in batch mode
+OCR_PACK_SIZE = int(os.getenv("OCR_PACK_SIZE", "1"))  # 1 = una imagen por petición
+OCR_PACK_MAX_BYTES = 15 * 1024 * 1024  # Gemini limita las peticiones inline a 20MB
+
+# Panorama tiling - very wide shelf photos are cut into overlapping tiles that are
+# read in parallel and merged, instead of being shrunk until labels are illegible
+OCR_TILE = os.getenv("OCR_TILE", "1") != "0"
+OCR_TILE_MIN_ASPECT = float(os.getenv("OCR_TILE_MIN_ASPECT", "2.0"))  # Lado mayor / lado menor
+OCR_TILE_OVERLAP = 0.15  # Fracción de cada tesela compartida con su vecina
+OCR_TILE_MAX = int(os.getenv("OCR_TILE_MAX", "8"))  # Teselas máximas por imagen
+
+# Image preprocessing - shrink phone photos before uploading them to Gemini
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))  # Lado mayor en píxeles
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG")  # JPEG o WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Session image store (web app) - previews stay in memory, originals spill to disk
+IMAGE_STORE_DIR = CACHE_DIR / "sesiones"
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", "200")) * 1024 * 1024  # Por sesión
+# Session directories left by a crashed or killed app are removed once untouched this long
+IMAGE_STORE_STALE_SECONDS = float(os.getenv("IMAGE_STORE_STALE_HOURS", "1")) * 3600
+IMAGE_PREVIEW_DIMENSION = int(os.getenv("IMAGE_PREVIEW_DIMENSION", "1024"))  # Lado mayor en píxeles
+IMAGE_PREVIEW_QUALITY = 80
+
+# OCR result cache - keyed by image bytes + model + prompt + upload settings
+OCR_CACHE_PATH = CACHE_DIR / "ocr_cache.sqlite3"
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_MB", "100")) * 1024 * 1024
+
 # Open Food Facts API
 OPEN_FOOD_FACTS_BASE_URL = "https://world.openfoodfacts.org"
 OPEN_FOOD_FACTS_SEARCH_ENDPOINT = "/cgi/search.pl"
 OPEN_FOOD_FACTS_PRODUCT_ENDPOINT = "/api/v0/product"
 OPEN_FOOD_FACTS_USER_AGENT = "FoodScanner/1.0"
+OFF_MAX_WORKERS = int(os.getenv("OFF_MAX_WORKERS", "4"))  # Búsquedas simultáneas
+OFF_REQUEST_TIMEOUT = 30  # segundos
+
+# Open Food Facts published rate limits (requests per minute)
+OFF_SEARCH_RATE_PER_MIN = 10
+OFF_PRODUCT_RATE_PER_MIN = 100
+
+# Retries on 429 / 5xx with jittered exponential backoff
+OFF_MAX_RETRIES = 3
+OFF_BACKOFF_BASE = 1.0  # segundos
+OFF_BACKOFF_MAX = 30.0  # segundos
+
+# Open Food Facts lookup cache - "not found" answers expire sooner than hits
+OFF_CACHE_PATH = CACHE_DIR / "off_cache.sqlite3"
+OFF_CACHE_TTL_HIT = 30 * 24 * 3600  # 30 días
+OFF_CACHE_TTL_MISS = 3 * 24 * 3600  # 3 días
+OFF_CACHE_MAX_ENTRIES = 50000
+
+# Offline Open Food Facts index (built with: python build_index.py --source <dump>)
+OFF_INDEX_PATH = CACHE_DIR / "off_index.sqlite3"
+
+# Near-duplicate photos (burst shots) - perceptual hash compared before OCR.
+# Distance is in bits out of NEAR_DUP_HASH_SIZE ** 2; 0 disables the check.
+# Re-saved or re-exposed copies differ by 0-1 bits, but a 2% handheld shift already
+# gives ~27, so the default only catches true repeats, not overlapping shelf sections
+NEAR_DUP_HASH_SIZE = 16
+NEAR_DUP_THRESHOLD = int(os.getenv("NEAR_DUP_THRESHOLD", "8"))
+
+# Cross-image deduplication - minimum similarity for fuzzy name matches (0-1)
+DEDUP_FUZZY_THRESHOLD = float(os.getenv("DEDUP_FUZZY_THRESHOLD", "0.9"))
+
+# Pipeline - products waiting for enrichment before OCR is paused (backpressure)
+PIPELINE_QUEUE_SIZE = 100
 
 # OCR Configuration - Multiple products detection
-OCR_PROMPT = """Analiza esta imagen (o múltiples imágenes) de una góndola de supermercado o productos alimenticios.
-Tu tarea es extraer TODOS los productos distintos que aparecen en las imágenes proporcionadas y devolver el resultado EXCLUSIVAMENTE en formato JSON.
-
-REGLAS CRÍTICAS Y ESTRICTAS (PENALIZACIÓN POR INCUMPLIMIENTO):
-1. NO INVENTES NADA: Todo dato que extraigas debe ser 100% fidedigno y explícitamente legible en la imagen. Si no estás seguro de un campo, omítelo.
-2. NO DUPLICADOS: Si ves el mismo producto varias veces en las estanterías, DESCARTA los duplicados. Registra el producto una sola vez en el JSON.
-3. NO SUMAR CANTIDADES: Asume `cantidad: 1` para todos los productos únicos detectados. No intentes contar cuántas botellas iguales hay, solo registra que ese producto existe en la góndola.
-4. EXTRACCIÓN DE METADATOS: Para cada producto distinto, extrae los siguientes campos SI Y SOLO SI son visibles fielmente:
-   - "nombre": El nombre del producto exacto. (Obligatorio)
-   - "detalle": Peso, volumen o medida legible (ej: "500g", "1L"). (Opcional, si no es visible envía "")
-   - "proveedor": Marca principal o fabricante (ej: "Nestle", "Coca-Cola"). (Opcional, si no es visible envía "")
-   - "categoria": Deduce la categoría básica ("bebestible", "comida", "helado", "fiambre", "lacteo"). (Opcional, si no es posible envía "")
-
-DEBES devolver el resultado como un ARREGLO JSON válido. No uses markdown ````json ````, devuelve únicamente el texto del JSON puro.
-Ejemplo de salida esperada:
-[
-  {
-    "nombre": "Leche Blanca Descremada",
-    "detalle": "1L",
-    "proveedor": "Soprole",
-    "categoria": "lacteo"
-  },
-  {
-    "nombre": "Galletas Tritón",
-    "detalle": "",
-    "proveedor": "McKay",
-    "categoria": "comida"
-  }
-]
-
-Si no se puede identificar absolutamente ningún producto de manera confiable, devuelve un arreglo JSON vacío: []
+# Gemini answers with compact keys (fewer output tokens on dense shelves), constrained by
+# OCR_RESPONSE_SCHEMA; OCRProcessor maps them back to the result fields
+OCR_FIELDS = {"n": "nombre", "d": "detalle", "p": "proveedor", "c": "categoria"}
+OCR_CATEGORIES = ["bebestible", "comida", "helado", "fiambre", "lacteo"]
+
+OCR_PROMPT = """Analiza la imagen de una góndola de supermercado o de productos alimenticios y lista TODOS los productos distintos que aparecen.
+
+REGLAS ESTRICTAS:
+1. NO INVENTES NADA: registra solo datos 100% legibles en la imagen. Si no estás seguro de un campo, omítelo.
+2. NO DUPLICADOS: un producto que aparece varias veces en la estantería se registra una sola vez. No cuentes unidades.
+3. Campos de cada producto:
+   - "n": nombre exacto del producto (obligatorio)
+   - "d": peso, volumen o medida legible (ej: "500g", "1L")
+   - "p": marca principal o fabricante (ej: "Nestle", "Coca-Cola")
+   - "c": categoría básica deducida: bebestible, comida, helado, fiambre o lacteo
+
+Si no se puede identificar ningún producto de manera confiable, devuelve [].
+"""
+
+# Appended to OCR_PROMPT when several images are sent in one request
+OCR_PACK_PROMPT = """
+Recibirás {count} imágenes, numeradas de 0 a {last} en el orden en que aparecen.
+Agrega a cada producto el campo "i" con el número (entero) de la imagen donde aparece.
+Aplica la regla de NO DUPLICADOS dentro de cada imagen: un producto visto en varias imágenes se registra una vez por imagen.
 """
 
+_OCR_PRODUCT_PROPERTIES = {
+    "n": {"type": "STRING"},
+    "d": {"type": "STRING"},
+    "p": {"type": "STRING"},
+    "c": {"type": "STRING", "enum": OCR_CATEGORIES},
+}
+
+OCR_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": _OCR_PRODUCT_PROPERTIES,
+        "required": ["n"],
+        "propertyOrdering": ["n", "d", "p", "c"],
+    },
+}
+
+OCR_PACK_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"i": {"type": "INTEGER"}, **_OCR_PRODUCT_PROPERTIES},
+        "required": ["i", "n"],
+        "propertyOrdering": ["i", "n", "d", "p", "c"],
+    },
+}
+
 # Excel Export Configuration
 EXCEL_FILENAME = "food_scan_results.xlsx"
 EXCEL_SHEET_NAME = "Productos"
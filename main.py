@@ -8,7 +8,19 @@ import sys
 from pathlib import Path
 
 import config
-from modules import OCRProcessor, OpenFoodFactsClient, DataHandler
+from modules import (
+    OCRProcessor,
+    OCRCache,
+    OpenFoodFactsClient,
+    OpenFoodFactsCache,
+    OpenFoodFactsIndex,
+    DataHandler,
+    ImageHashIndex,
+    ProductDeduplicator,
+    RunJournal,
+    ScanPipeline,
+    load_api_keys,
+)
 from utils import setup_logger
 
 
@@ -22,6 +34,13 @@ Ejemplos de uso:
   python main.py --input images/
   python main.py --input images/ --output resultados.xlsx
   python main.py --input images/ --api-key TU_API_KEY --verbose
+  python main.py --input images/ --workers 8
+  python main.py --input images/ --api-keys-file keys.txt
+  python main.py --input images/ --pack 4
+  python main.py --input images/ --offline
+  python main.py --input images/ --resume
+  python main.py --input images/ --refresh-cache
+  python main.py --input images/ --max-dimension 1536 --image-format WEBP
         """
     )
     
@@ -43,7 +62,182 @@ Ejemplos de uso:
         "--api-key",
         type=str,
         default=None,
-        help="API key de Gemini (también puede usar variable GEMINI_API_KEY o archivo .env)"
+        help="API key de Gemini; usa solo esa key (también puede usar variable GEMINI_API_KEY o archivo .env)"
+    )
+    
+    parser.add_argument(
+        "--api-keys-file",
+        type=str,
+        default=None,
+        help=(
+            "Archivo con varias API keys de Gemini, una por línea; las peticiones se reparten entre ellas "
+            "(también GEMINI_API_KEYS_FILE o GEMINI_API_KEYS separadas por comas)"
+        )
+    )
+    
+    parser.add_argument(
+        "--workers", "-w", "--ocr-workers",
+        dest="workers",
+        type=int,
+        default=config.OCR_MAX_WORKERS,
+        help=(
+            f"Peticiones simultáneas a Gemini; con límite adaptativo es el valor inicial "
+            f"(default: {config.OCR_MAX_WORKERS})"
+        )
+    )
+    
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=config.OCR_MAX_CONCURRENCY,
+        help=f"Máximo de peticiones simultáneas que puede alcanzar el límite adaptativo (default: {config.OCR_MAX_CONCURRENCY})"
+    )
+    
+    parser.add_argument(
+        "--no-adaptive",
+        action="store_true",
+        help="Mantener fija la concurrencia de Gemini en vez de ajustarla a la cuota de la API key"
+    )
+    
+    parser.add_argument(
+        "--off-workers",
+        type=int,
+        default=config.OFF_MAX_WORKERS,
+        help=f"Búsquedas simultáneas en Open Food Facts (default: {config.OFF_MAX_WORKERS})"
+    )
+    
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=config.PIPELINE_QUEUE_SIZE,
+        help=f"Productos en espera de búsqueda antes de pausar el OCR (default: {config.PIPELINE_QUEUE_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=config.OCR_PACK_SIZE,
+        help=f"Imágenes enviadas a Gemini en una misma petición (default: {config.OCR_PACK_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--max-dimension",
+        type=int,
+        default=config.IMAGE_MAX_DIMENSION,
+        help=f"Lado mayor (px) de las imágenes enviadas a Gemini (default: {config.IMAGE_MAX_DIMENSION})"
+    )
+    
+    parser.add_argument(
+        "--image-format",
+        type=str.upper,
+        choices=["JPEG", "WEBP"],
+        default=config.IMAGE_FORMAT,
+        help=f"Formato de re-codificación antes de subir (default: {config.IMAGE_FORMAT})"
+    )
+    
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        default=config.IMAGE_QUALITY,
+        help=f"Calidad de compresión 1-100 (default: {config.IMAGE_QUALITY})"
+    )
+    
+    parser.add_argument(
+        "--no-tiered",
+        action="store_true",
+        help=f"Usar siempre {config.GEMINI_MODEL} en vez de empezar por {config.GEMINI_FAST_MODEL} y escalar solo las respuestas dudosas"
+    )
+    
+    parser.add_argument(
+        "--hedge",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            f"Enviar (o con --no-hedge, no enviar) una petición duplicada cuando una llamada a Gemini supera "
+            f"el percentil {config.OCR_HEDGE_PERCENTILE} de latencia reciente "
+            f"(máx. {config.OCR_HEDGE_MAX_RATIO * 100:.0f}%% extra; default: OCR_HEDGE = {'1' if config.OCR_HEDGE else '0'})"
+        )
+    )
+    
+    parser.add_argument(
+        "--no-tile",
+        action="store_true",
+        help=(
+            f"No dividir en teselas las panorámicas de góndola (proporción >= {config.OCR_TILE_MIN_ASPECT:g}:1); "
+            f"se envían enteras y reducidas"
+        )
+    )
+    
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Esperar la respuesta completa de Gemini en vez de procesar los productos a medida que llegan"
+    )
+    
+    parser.add_argument(
+        "--no-preprocess",
+        action="store_true",
+        help="Enviar las imágenes a Gemini sin reducir ni re-codificar"
+    )
+    
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="No usar las cachés de resultados OCR y de Open Food Facts"
+    )
+    cache_group.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Ignorar las cachés existentes y volver a consultar Gemini y Open Food Facts"
+    )
+    
+    index_group = parser.add_mutually_exclusive_group()
+    index_group.add_argument(
+        "--offline",
+        action="store_true",
+        help="Buscar solo en el índice local de Open Food Facts (ver build_index.py)"
+    )
+    index_group.add_argument(
+        "--no-local-index",
+        action="store_true",
+        help="No usar el índice local aunque exista; consultar siempre la API"
+    )
+    
+    parser.add_argument(
+        "--near-dup-threshold",
+        type=int,
+        default=config.NEAR_DUP_THRESHOLD,
+        help=(
+            "Distancia máxima (bits de hash perceptual, de "
+            f"{config.NEAR_DUP_HASH_SIZE ** 2}) para tratar dos fotos como casi iguales "
+            f"y analizar solo una; 0 desactiva (default: {config.NEAR_DUP_THRESHOLD})"
+        )
+    )
+    
+    dedup_group = parser.add_mutually_exclusive_group()
+    dedup_group.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="No unir el mismo producto visto en varias imágenes (una fila por aparición)"
+    )
+    dedup_group.add_argument(
+        "--fuzzy-dedup",
+        action="store_true",
+        help=f"Unir también productos con nombres parecidos (similitud >= {config.DEDUP_FUZZY_THRESHOLD})"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reanudar una ejecución interrumpida: omite las imágenes ya completadas en el diario"
+    )
+    
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="Archivo de diario de la ejecución (default: <salida>.journal.jsonl)"
     )
     
     parser.add_argument(
@@ -84,28 +278,100 @@ def main():
     
     # Validate output path
     output_path = Path(args.output)
+    journal_path = Path(args.journal) if args.journal else output_path.with_suffix(".journal.jsonl")
+    
+    if args.workers < 1 or args.max_concurrency < 1 or args.off_workers < 1 or args.queue_size < 1:
+        logger.error("--workers, --max-concurrency, --off-workers y --queue-size deben ser mayores o iguales a 1")
+        sys.exit(1)
+    
+    if args.api_key and args.api_keys_file:
+        logger.error("--api-key y --api-keys-file no se pueden usar juntos")
+        sys.exit(1)
+    
+    if args.pack < 1:
+        logger.error("--pack debe ser mayor o igual a 1")
+        sys.exit(1)
+    
+    if args.near_dup_threshold < 0:
+        logger.error("--near-dup-threshold debe ser mayor o igual a 0")
+        sys.exit(1)
+    
+    if not 1 <= args.image_quality <= 100:
+        logger.error("--image-quality debe estar entre 1 y 100")
+        sys.exit(1)
     
     try:
         # Initialize components
         logger.info("Inicializando componentes...")
         
+        # OCR result cache
+        ocr_cache = None if args.no_cache or args.demo else OCRCache()
+        
         # OCR Processor
         try:
-            ocr_processor = OCRProcessor(api_key=args.api_key, demo_mode=args.demo)
+            ocr_processor = OCRProcessor(
+                api_key=args.api_key,
+                api_keys=load_api_keys(Path(args.api_keys_file)) if args.api_keys_file else None,
+                demo_mode=args.demo,
+                cache=ocr_cache,
+                refresh_cache=args.refresh_cache,
+                preprocess=not args.no_preprocess,
+                max_dimension=args.max_dimension,
+                image_format=args.image_format,
+                image_quality=args.image_quality,
+                pack_size=args.pack,
+                stream=False if args.no_stream else None,
+                adaptive=not args.no_adaptive,
+                concurrency=args.workers,
+                max_concurrency=args.max_concurrency,
+                tiered=not args.no_tiered,
+                hedge=args.hedge,
+                tile=False if args.no_tile else None
+            )
         except ValueError as e:
             logger.error(str(e))
             logger.error("Por favor, proporciona una API key usando --api-key, crea un archivo .env, o usa --demo")
             sys.exit(1)
         
-        # API Client
-        api_client = OpenFoodFactsClient()
+        # API Client with its lookup cache
+        off_cache = None if args.no_cache else OpenFoodFactsCache()
+        
+        local_index = None
+        if not args.no_local_index:
+            local_index = OpenFoodFactsIndex()
+            if local_index.exists:
+                logger.info(f"Usando índice local: {local_index.path}")
+            else:
+                local_index = None
+                if args.offline:
+                    logger.error(f"Índice local no encontrado: {config.OFF_INDEX_PATH}")
+                    logger.error("Constrúyelo con: python build_index.py --source <volcado de Open Food Facts>")
+                    sys.exit(1)
+        
+        api_client = OpenFoodFactsClient(
+            cache=off_cache,
+            refresh_cache=args.refresh_cache,
+            local_index=local_index,
+            offline=args.offline,
+            max_workers=args.off_workers
+        )
         
         # Data Handler
         data_handler = DataHandler()
         
+        # Cross-image deduplication - each product is looked up and exported once
+        deduplicator = None if args.no_dedup else ProductDeduplicator(fuzzy=args.fuzzy_dedup)
+        
+        # Run journal - progress survives crashes and can be resumed with --resume
+        journal = RunJournal(journal_path, resume=args.resume)
+        logger.info(f"Diario de ejecución: {journal_path}")
+        
         # Get images from folder
         logger.info(f"Buscando imágenes en: {input_path}")
-        images = OCRProcessor.get_images_from_folder(input_path)
+        hash_index = None
+        if args.near_dup_threshold > 0:
+            hash_index = ImageHashIndex(threshold=args.near_dup_threshold, max_workers=args.workers)
+        images = OCRProcessor.get_images_from_folder(input_path, hash_index=hash_index)
         
         if not images:
             logger.warning("No se encontraron imágenes en la carpeta especificada")
@@ -114,64 +380,61 @@ def main():
         
         logger.info(f"Comenzando análisis de {len(images)} imágenes...")
         
-        # Track total products for progress
-        total_products = 0
+        # Burst shots and repeated photos reuse the OCR result of the first one
+        near_duplicates = hash_index.duplicates if hash_index is not None else {}
+        if near_duplicates:
+            logger.info(f"Fotos casi duplicadas (no se envían a Gemini): {len(near_duplicates)}")
+            for representative, duplicate_paths in hash_index.report().items():
+                names = ", ".join(path.name for path in duplicate_paths)
+                logger.info(f"  {representative.name} <- {names}")
         
-        # First pass: get all products from all images
+        # OCR and Open Food Facts run as one streaming pipeline: products are
+        # queued for enrichment as soon as their image has been analyzed
         logger.info("")
-        logger.info("=== FASE 1: Extrayendo productos de imágenes ===")
-        
-        all_products = []  # List of (image_path, product_name)
-        
-        for image_path in images:
-            logger.info("")
-            logger.info("-" * 50)
-            logger.info(f"Procesando imagen: {image_path.name}")
-            
-            # Step 1: OCR - Extract product NAMES (list)
-            product_list = ocr_processor.process_image(image_path)
-            
-            if not product_list or product_list == ["ERROR"]:
+        logger.info("=== Extrayendo productos y buscando en Open Food Facts ===")
+        
+        def on_image(image_path, product_list):
+            if not product_list or OCRProcessor.is_error(product_list):
                 logger.error(f"Error en OCR para {image_path.name}")
-                continue
-            
-            if product_list == ["NO_DETECTADO"]:
+            elif not ScanPipeline.has_products(product_list):
                 logger.warning(f"No se detectaron productos en {image_path.name}")
-                continue
-            
-            # Add each product with its image source
-            for product_name in product_list:
-                all_products.append((image_path.name, product_name))
-                total_products += 1
-            
-            logger.info(f"  -> {len(product_list)} productos detectados")
+            else:
+                logger.info(f"Imagen procesada: {image_path.name} -> {len(product_list)} productos detectados")
+        
+        def on_product(image_name, product, product_data):
+            if product_data:
+                logger.info(
+                    f"  [OK] {product['nombre']} ({image_name}): {product_data.get('product_name', 'N/A')}, "
+                    f"{product_data.get('energy_kcal_100g', 0)} kcal/100g"
+                )
+            else:
+                logger.warning(f"  [X] {product['nombre']} ({image_name}): no encontrado en base de datos")
+        
+        pipeline = ScanPipeline(
+            ocr_processor,
+            api_client,
+            off_workers=args.off_workers,
+            queue_size=args.queue_size
+        )
+        enriched = pipeline.run(
+            images,
+            on_image=on_image,
+            on_product=on_product,
+            journal=journal,
+            deduplicator=deduplicator,
+            near_duplicates=near_duplicates
+        )
         
         logger.info("")
-        logger.info(f"Total productos detectados: {len(all_products)}")
+        logger.info(f"Total productos detectados: {len(enriched)}")
         
-        if not all_products:
+        if not enriched:
             logger.warning("No se detectaron productos en ninguna imagen")
             sys.exit(0)
         
-        # Second pass: search each product in Open Food Facts
-        logger.info("")
-        logger.info("=== FASE 2: Buscando en Open Food Facts ===")
-        
-        for idx, (image_name, product_name) in enumerate(all_products, 1):
-            logger.info("")
-            logger.info(f"[{idx}/{len(all_products)}] Producto: {product_name}")
-            
-            # Search in Open Food Facts
-            product_data = api_client.search_product(product_name)
-            
-            # Add result with image origin
-            data_handler.add_result_with_source(image_name, product_name, product_data)
-            
-            if product_data:
-                logger.info(f"  [OK] Encontrado: {product_data.get('product_name', 'N/A')}")
-                logger.info(f"      Energia: {product_data.get('energy_kcal_100g', 0)} kcal/100g")
-            else:
-                logger.warning(f"  [X] No encontrado en base de datos")
+        # Add results in deterministic (image, product) order
+        for image_name, product, product_data in enriched:
+            data_handler.add_result_with_source(image_name, product, product_data)
         
         # Export results
         logger.info("")
@@ -196,6 +459,90 @@ def main():
         logger.info(f"Errores OCR: {summary['errores_ocr']}")
         logger.info(f"Tasa de exito: {summary['tasa_exito']:.1f}%")
         
+        preprocess_summary = ocr_processor.get_preprocess_summary()
+        if preprocess_summary["imagenes"]:
+            logger.info(
+                f"Preprocesado: {preprocess_summary['bytes_antes'] / 1024 / 1024:.1f} MB -> "
+                f"{preprocess_summary['bytes_despues'] / 1024 / 1024:.1f} MB "
+                f"(-{preprocess_summary['reduccion']:.0f}%) en {preprocess_summary['tiempo_ms']:.0f} ms, "
+                f"{preprocess_summary['sin_recodificar']} de {preprocess_summary['imagenes']} enviadas sin recodificar"
+            )
+        
+        latency = ocr_processor.get_latency_summary()
+        if latency["peticiones"]:
+            logger.info(
+                f"Latencia Gemini ({latency['peticiones']} peticiones): primer producto "
+                f"{latency['primer_producto_ms']:.0f} ms (p95 {latency['primer_producto_p95_ms']:.0f} ms), "
+                f"total {latency['total_ms']:.0f} ms (p95 {latency['total_p95_ms']:.0f} ms)"
+            )
+        
+        for model, tier in ocr_processor.get_tier_summary().items():
+            if tier["peticiones"]:
+                logger.info(
+                    f"Modelo {model}: {tier['imagenes']} imágenes, {tier['escaladas']} escaladas "
+                    f"({tier['tasa_escalado']:.1f}%), latencia {tier['latencia_ms']:.0f} ms "
+                    f"(p95 {tier['latencia_p95_ms']:.0f} ms), tokens {tier['tokens_entrada']} entrada / "
+                    f"{tier['tokens_salida']} salida"
+                )
+        
+        hedge = ocr_processor.get_hedge_summary()
+        if hedge["duplicadas"] or hedge["plazos_vencidos"]:
+            logger.info(
+                f"Peticiones duplicadas: {hedge['duplicadas']} de {hedge['llamadas']} llamadas "
+                f"({hedge['ganadas']} respondieron antes), {hedge['plazos_vencidos']} plazos vencidos"
+            )
+        
+        tiles = ocr_processor.get_tile_summary()
+        if tiles["imagenes"]:
+            logger.info(
+                f"Panorámicas divididas: {tiles['imagenes']} en {tiles['teselas']} teselas "
+                f"({tiles['fallidas']} fallidas), {tiles['repetidos']} productos repetidos en el solape"
+            )
+        
+        concurrency = ocr_processor.get_concurrency_summary()
+        if concurrency.get("exitos") or concurrency.get("limitaciones"):
+            logger.info(
+                f"Concurrencia Gemini: límite final {concurrency['limite']} (máximo alcanzado "
+                f"{concurrency['limite_max']}), {concurrency['limitaciones']} respuestas 429/503, "
+                f"{concurrency['reintentos']} reintentos, {concurrency['espera_s']:.1f} s en espera"
+            )
+        elif concurrency["reintentos"]:
+            logger.info(f"Gemini: {concurrency['reintentos']} reintentos por límite de peticiones")
+        if len(concurrency.get("claves", [])) > 1:
+            for key_stats in concurrency["claves"]:
+                logger.info(
+                    f"  {key_stats['clave']}: {key_stats['peticiones']} peticiones, "
+                    f"{key_stats['limitaciones']} limitadas, {key_stats['pausas']} pausas, "
+                    f"límite {key_stats['limite']} (máximo {key_stats['limite_max']})"
+                )
+        if concurrency["abandonadas"]:
+            logger.warning(f"Gemini: {concurrency['abandonadas']} peticiones seguían limitadas tras los reintentos")
+        
+        if ocr_cache is not None:
+            cache_stats = ocr_cache.stats()
+            logger.info(
+                f"Caché OCR: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos "
+                f"({cache_stats['tasa_aciertos']:.1f}%)"
+            )
+        
+        if deduplicator is not None and deduplicator.duplicates:
+            dedup_stats = deduplicator.stats()
+            logger.info(
+                f"Duplicados entre imágenes: {dedup_stats['duplicados']} apariciones unidas en "
+                f"{dedup_stats['unicos']} productos únicos ({dedup_stats['aproximados']} por similitud)"
+            )
+        
+        if api_client.coalesced:
+            logger.info(f"Búsquedas repetidas reutilizadas: {api_client.coalesced}")
+        
+        if off_cache is not None:
+            cache_stats = off_cache.stats()
+            logger.info(
+                f"Caché Open Food Facts: {cache_stats['hits'] + cache_stats['negative_hits']} aciertos "
+                f"({cache_stats['negative_hits']} no encontrados), {cache_stats['misses']} fallos "
+                f"({cache_stats['tasa_aciertos']:.1f}%)"
+            )
+        
         logger.info("")
         logger.info("=" * 60)
         logger.info("Food Scanner - Proceso completado")
@@ -203,14 +550,24 @@ def main():
         
     except KeyboardInterrupt:
         logger.warning("\nProceso interrumpido por el usuario")
+        logger.warning("Usa --resume para continuar sin volver a analizar las imágenes ya procesadas")
         sys.exit(130)
     except Exception as e:
         logger.error(f"Error inesperado: {str(e)}", exc_info=True)
+        logger.error("Usa --resume para continuar sin volver a analizar las imágenes ya procesadas")
         sys.exit(1)
     finally:
         # Cleanup
         if 'api_client' in locals():
             api_client.close()
+        if 'journal' in locals():
+            journal.close()
+        if locals().get('ocr_cache') is not None:
+            ocr_cache.close()
+        if locals().get('off_cache') is not None:
+            off_cache.close()
+        if locals().get('local_index') is not None:
+            local_index.close()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,34 @@
 """
 Food Scanner - Modules Package
-Contains OCR, API client, and data handler modules
+Contains OCR, API client, data handler and pipeline modules
 """
 from .ocr import OCRProcessor
+from .image_hash import ImageHashIndex
+from .image_store import SessionImageStore
+from .key_pool import GeminiKeyPool, load_api_keys
+from .ocr_cache import OCRCache
 from .api_client import OpenFoodFactsClient
+from .off_cache import OpenFoodFactsCache
+from .off_index import OpenFoodFactsIndex
+from .result_store import ResultStore
 from .data_handler import DataHandler
+from .dedup import ProductDeduplicator
+from .journal import RunJournal
+from .pipeline import ScanPipeline
 
-__all__ = ["OCRProcessor", "OpenFoodFactsClient", "DataHandler"]
+__all__ = [
+    "OCRProcessor",
+    "ImageHashIndex",
+    "SessionImageStore",
+    "GeminiKeyPool",
+    "load_api_keys",
+    "OCRCache",
+    "OpenFoodFactsClient",
+    "OpenFoodFactsCache",
+    "OpenFoodFactsIndex",
+    "ResultStore",
+    "DataHandler",
+    "ProductDeduplicator",
+    "RunJournal",
+    "ScanPipeline",
+]
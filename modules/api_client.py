@@ -3,10 +3,18 @@ Food Scanner - API Client Module
 Handles communication with Open Food Facts API
 """
 import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
 
 import config
+from utils.concurrency import SingleFlight, TokenBucket
+from .off_cache import OpenFoodFactsCache
+from .off_index import OpenFoodFactsIndex
 
 logger = logging.getLogger(__name__)
 
@@ -14,18 +22,50 @@ logger = logging.getLogger(__name__)
 class OpenFoodFactsClient:
     """Client for interacting with the Open Food Facts API."""
     
-    def __init__(self):
-        """Initialize the API client with configuration."""
+    def __init__(
+        self,
+        cache: Optional[OpenFoodFactsCache] = None,
+        refresh_cache: bool = False,
+        local_index: Optional[OpenFoodFactsIndex] = None,
+        offline: bool = False,
+        max_workers: Optional[int] = None
+    ):
+        """
+        Initialize the API client with configuration.
+        
+        Args:
+            cache: Optional persistent cache of lookups
+            refresh_cache: If True, ignore cached lookups but store fresh ones
+            local_index: Optional offline index consulted before the HTTP API
+            offline: If True, only the local index is used (no HTTP requests)
+            max_workers: Concurrent lookups in search_many / get_many_by_barcode; also
+                sizes the HTTP connection pool (default: config.OFF_MAX_WORKERS)
+        """
         self.base_url = config.OPEN_FOOD_FACTS_BASE_URL
         self.search_endpoint = config.OPEN_FOOD_FACTS_SEARCH_ENDPOINT
         self.product_endpoint = config.OPEN_FOOD_FACTS_PRODUCT_ENDPOINT
         self.user_agent = config.OPEN_FOOD_FACTS_USER_AGENT
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        self.local_index = local_index
+        self.offline = offline
+        self.max_workers = max(1, max_workers or config.OFF_MAX_WORKERS)
         
-        # Setup session with headers
+        # Setup session with headers and a connection pool sized for the workers
         self.session = requests.Session()
         self.session.headers.update({
             "User-Agent": self.user_agent
         })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        # Open Food Facts publishes separate request limits for search and product reads
+        self.search_limiter = TokenBucket(config.OFF_SEARCH_RATE_PER_MIN)
+        self.product_limiter = TokenBucket(config.OFF_PRODUCT_RATE_PER_MIN)
+        
+        # Repeated names/barcodes in a run share one lookup
+        self._inflight = SingleFlight()
         
         logger.info("Open Food Facts API Client inicializado")
     
@@ -39,83 +79,283 @@ class OpenFoodFactsClient:
         Returns:
             Product data dictionary or None if not found
         """
-        try:
-            logger.info("Buscando producto: %s", product_name)
-            
-            # Build search URL
-            search_url = f"{self.base_url}{self.search_endpoint}"
-            
-            # Search parameters
-            params = {
-                "search_terms": product_name,
-                "search_simple": 1,
-                "action": "process",
-                "json": 1,
-                "page_size": 5,
-                "fields": "code,product_name,nutriments,brands,categories,quantity,serving_size"
-            }
-            
-            # Make request
-            response = self.session.get(search_url, params=params, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Check if products found
-            products = data.get("products", [])
-            if not products:
-                logger.warning("No se encontraron productos para: %s", product_name)
-                return None
+        return self._lookup("search", product_name, self._fetch_search)
+    
+    def get_product_by_barcode(self, barcode: str) -> Optional[dict]:
+        """
+        Get product information by barcode.
+        
+        Args:
+            barcode: Product barcode (EAN-13, UPC, etc.)
             
-            # Return first match
-            product = products[0]
-            logger.info("Producto encontrado: %s", product.get("product_name", "Unknown"))
+        Returns:
+            Product data dictionary or None if not found
+        """
+        return self._lookup("barcode", barcode, self._fetch_barcode)
+    
+    def search_many(self, product_names: list[str], max_workers: Optional[int] = None) -> list[Optional[dict]]:
+        """
+        Search several products concurrently.
+        
+        Args:
+            product_names: Names of the products to search for
+            max_workers: Concurrent lookups (default: self.max_workers)
             
-            return self._parse_product_data(product)
+        Returns:
+            Product data (or None) for each name, in input order
+        """
+        return self._map(self.search_product, product_names, max_workers)
+    
+    def get_many_by_barcode(self, barcodes: list[str], max_workers: Optional[int] = None) -> list[Optional[dict]]:
+        """
+        Get several products by barcode concurrently.
+        
+        Args:
+            barcodes: Product barcodes
+            max_workers: Concurrent lookups (default: self.max_workers)
             
+        Returns:
+            Product data (or None) for each barcode, in input order
+        """
+        return self._map(self.get_product_by_barcode, barcodes, max_workers)
+    
+    def _map(self, lookup, queries: list[str], max_workers: Optional[int]) -> list[Optional[dict]]:
+        """Run a lookup over many queries with a bounded worker pool."""
+        workers = max(1, min(max_workers or self.max_workers, len(queries)))
+        if workers == 1:
+            return [lookup(query) for query in queries]
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="off") as executor:
+            return list(executor.map(lookup, queries))
+    
+    def _lookup(self, kind: str, query: str, fetch) -> Optional[dict]:
+        """
+        Resolve a lookup, sharing one request among duplicate lookups in this run.
+        
+        Network and parsing errors return None without being cached or
+        remembered, so the lookup is retried next time.
+        
+        Args:
+            kind: "search" or "barcode"
+            query: Product name or barcode
+            fetch: Function performing the HTTP lookup
+            
+        Returns:
+            Product data dictionary or None
+        """
+        key = OpenFoodFactsCache.make_key(kind, query)
+        try:
+            return self._inflight.do(key, lambda: self._resolve(kind, query, fetch))
         except requests.exceptions.RequestException as e:
-            logger.error("Error en la búsqueda de %s: %s", product_name, str(e))
+            logger.error("Error en la consulta de %s: %s", query, str(e))
             return None
         except Exception as e:
-            logger.error("Error inesperado buscando %s: %s", product_name, str(e))
+            logger.error("Error inesperado consultando %s: %s", query, str(e))
             return None
     
-    def get_product_by_barcode(self, barcode: str) -> Optional[dict]:
+    def _resolve(self, kind: str, query: str, fetch) -> Optional[dict]:
         """
-        Get product information by barcode.
+        Resolve a lookup from the local index, then the cache, then the HTTP API.
         
         Args:
-            barcode: Product barcode (EAN-13, UPC, etc.)
+            kind: "search" or "barcode"
+            query: Product name or barcode
+            fetch: Function performing the HTTP lookup
             
         Returns:
             Product data dictionary or None if not found
+            
+        Raises:
+            requests.exceptions.RequestException: On network or HTTP errors
+        """
+        if self.local_index is not None:
+            product = self._local_lookup(kind, query)
+            if product is not None:
+                return product
+            if self.offline:
+                logger.warning("No encontrado en índice local: %s", query)
+                return None
+        
+        if self.cache is not None and not self.refresh_cache:
+            cached, product = self.cache.get(kind, query)
+            if cached:
+                logger.info("Consulta en caché (%s): %s", kind, query)
+                return product
+        
+        product = fetch(query)
+        
+        if self.cache is not None:
+            self.cache.put(kind, query, product)
+        return product
+    
+    @property
+    def coalesced(self) -> int:
+        """Number of lookups answered by sharing an earlier or in-flight lookup."""
+        return self._inflight.saved
+    
+    def _local_lookup(self, kind: str, query: str) -> Optional[dict]:
+        """
+        Look up a product in the offline index.
+        
+        Args:
+            kind: "search" or "barcode"
+            query: Product name or barcode
+            
+        Returns:
+            Parsed product data or None if not indexed
         """
         try:
-            logger.info("Consultando barcode: %s", barcode)
+            if kind == "barcode":
+                product = self.local_index.get_by_barcode(query)
+            else:
+                product = self.local_index.search(query)
+        except Exception as e:
+            logger.error("Error consultando índice local para %s: %s", query, str(e))
+            return None
+        
+        if product is None:
+            return None
+        
+        logger.info("Encontrado en índice local: %s", product.get("product_name", "Unknown"))
+        return self._parse_product_data(product)
+    
+    def _fetch_search(self, product_name: str) -> Optional[dict]:
+        """
+        Search the API for a product by name.
+        
+        Args:
+            product_name: Name of the product to search for
             
-            # Build API URL
-            api_url = f"{self.base_url}{self.product_endpoint}/{barcode}.json"
+        Returns:
+            Parsed data of the first match, or None if nothing matched
             
-            # Make request
-            response = self.session.get(api_url, timeout=30)
-            response.raise_for_status()
+        Raises:
+            requests.exceptions.RequestException: On network or HTTP errors
+        """
+        logger.info("Buscando producto: %s", product_name)
+        
+        # Build search URL
+        search_url = f"{self.base_url}{self.search_endpoint}"
+        
+        # Search parameters
+        params = {
+            "search_terms": product_name,
+            "search_simple": 1,
+            "action": "process",
+            "json": 1,
+            "page_size": 5,
+            "fields": "code,product_name,nutriments,brands,categories,quantity,serving_size"
+        }
+        
+        # Make request
+        response = self._get(search_url, self.search_limiter, params=params)
+        
+        data = response.json()
+        
+        # Check if products found
+        products = data.get("products", [])
+        if not products:
+            logger.warning("No se encontraron productos para: %s", product_name)
+            return None
+        
+        # Return first match
+        product = products[0]
+        logger.info("Producto encontrado: %s", product.get("product_name", "Unknown"))
+        
+        return self._parse_product_data(product)
+    
+    def _fetch_barcode(self, barcode: str) -> Optional[dict]:
+        """
+        Fetch a product from the API by barcode.
+        
+        Args:
+            barcode: Product barcode (EAN-13, UPC, etc.)
             
-            data = response.json()
+        Returns:
+            Parsed product data, or None if the barcode is unknown
             
-            # Check if product found
-            if data.get("status") != 1:
-                logger.warning("Producto no encontrado para barcode: %s", barcode)
-                return None
+        Raises:
+            requests.exceptions.RequestException: On network or HTTP errors
+        """
+        logger.info("Consultando barcode: %s", barcode)
+        
+        # Build API URL
+        api_url = f"{self.base_url}{self.product_endpoint}/{barcode}.json"
+        
+        # Make request
+        response = self._get(api_url, self.product_limiter)
+        
+        data = response.json()
+        
+        # Check if product found
+        if data.get("status") != 1:
+            logger.warning("Producto no encontrado para barcode: %s", barcode)
+            return None
+        
+        product = data.get("product", {})
+        return self._parse_product_data(product)
+    
+    def _get(self, url: str, limiter: TokenBucket, params: Optional[dict] = None) -> requests.Response:
+        """
+        Rate-limited GET with jittered exponential backoff on 429 and 5xx.
+        
+        Args:
+            url: Request URL
+            limiter: Token bucket for this endpoint family
+            params: Query parameters
             
-            product = data.get("product", {})
-            return self._parse_product_data(product)
+        Returns:
+            Successful response
             
-        except requests.exceptions.RequestException as e:
-            logger.error("Error consultando barcode %s: %s", barcode, str(e))
+        Raises:
+            requests.exceptions.RequestException: If the request still fails after retries
+        """
+        for attempt in range(config.OFF_MAX_RETRIES + 1):
+            limiter.acquire()
+            response = self.session.get(url, params=params, timeout=config.OFF_REQUEST_TIMEOUT)
+            
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt == config.OFF_MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            
+            # Full jitter: random delay up to the exponential cap, unless the server says otherwise
+            delay = self._retry_after(response)
+            if delay is None:
+                delay = random.uniform(0, min(config.OFF_BACKOFF_MAX, config.OFF_BACKOFF_BASE * 2 ** attempt))
+            
+            logger.warning(
+                "Open Food Facts respondió %d, reintento %d/%d en %.1f s",
+                response.status_code, attempt + 1, config.OFF_MAX_RETRIES, delay
+            )
+            response.close()
+            time.sleep(delay)
+    
+    @staticmethod
+    def _retry_after(response: requests.Response) -> Optional[float]:
+        """
+        Read the Retry-After header, in seconds or as an HTTP date.
+        
+        Args:
+            response: Throttled response
+            
+        Returns:
+            Seconds to wait, or None if the header is missing or invalid
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
             return None
-        except Exception as e:
-            logger.error("Error inesperado consultando %s: %s", barcode, str(e))
+        
+        try:
+            return min(max(float(value), 0.0), config.OFF_BACKOFF_MAX)
+        except ValueError:
+            pass
+        
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
             return None
+        return min(max(delay, 0.0), config.OFF_BACKOFF_MAX)
     
     def _parse_product_data(self, product: dict) -> dict:
         """
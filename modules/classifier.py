@@ -0,0 +1,158 @@
+"""
+Food Scanner - Classifier Module
+Precompiled ERP category and quantity classification of Open Food Facts data
+"""
+import re
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Open Food Facts keywords per ERP category, in priority order: a string
+# containing keywords of several categories gets the first one listed
+CATEGORY_KEYWORDS = {
+    "bebestible": ["bebida", "bebida", "drink", "beverage", "agua", "jugo", "zumo", "jugu", "refresco", "soda", "cerveza", "vino", "licor", "cafe", "te", "leche"],
+    "helado": ["helado", "ice cream", "ice-cream", "gelato", "sorbete"],
+    "fiambre": ["fiambre", "jamón", "jam", "embutido", "salchicha", "chorizo", "tocino", "bacon", "paté"],
+    "lacteo": ["leche", "yogur", "yogurt", "queso", "cheese", "mantequilla", "crema", "nata", "kumis", "kumys"],
+    "comida": ["comida", "food", "pasta", "arroz", "cereal", "galleta", "biscuit", "pan", "bread", "dulce", "confitería", "chocolate", "carne", "pescado", "verdura", "vegetal", "fruta", "sopa", "salsas"]
+}
+
+# Category for strings that match no keyword
+DEFAULT_CATEGORY = "comida"
+
+# Keyword table flattened once: (category, keywords) pairs in priority order
+_CATEGORY_TABLE = tuple((category, tuple(keywords)) for category, keywords in CATEGORY_KEYWORDS.items())
+
+# Distinct categories strings remembered by classify_category
+CATEGORY_CACHE_SIZE = 8192
+
+# Quantity patterns searched in the product name, in priority order. The lazy
+# prefix makes the second pattern apply only when the first matches nowhere.
+_QUANTITY_PATTERN = re.compile(
+    r"^(?:.*?(\d+[.,]?\d*)\s*(g|gramos|ml|mililitros|l|litros|kg|kilogramos)"
+    r"|.*?(\d+[.,]?\d*)\s*(u|unidades|pcs|pieces))",
+    re.DOTALL
+)
+
+
+@lru_cache(maxsize=CATEGORY_CACHE_SIZE)
+def classify_category(categories: str) -> str:
+    """
+    Map an Open Food Facts categories string to an ERP category.
+    
+    Results are memoized: catalogs repeat the same categories strings, so most
+    calls are a cache hit.
+    
+    Args:
+        categories: Comma-separated categories from Open Food Facts
+    
+    Returns:
+        bebestible, helado, fiambre, lacteo or comida; "" if categories is empty
+    """
+    if not categories:
+        return ""
+    
+    categories_lower = categories.lower()
+    for category, keywords in _CATEGORY_TABLE:
+        for keyword in keywords:
+            if keyword in categories_lower:
+                return category
+    
+    return DEFAULT_CATEGORY
+
+
+def classify_categories(categories: pd.Series) -> pd.Series:
+    """
+    Classify a whole column of Open Food Facts categories strings.
+    
+    Catalog columns repeat the same strings many times, so each distinct value
+    is classified once and the result is broadcast back by position.
+    
+    Args:
+        categories: Series of categories strings (missing values allowed)
+    
+    Returns:
+        Series of ERP categories with the same index
+    """
+    codes, uniques = pd.factorize(categories.fillna(""), sort=False)
+    labels = np.array([classify_category(value) for value in uniques] + [""], dtype=object)
+    # factorize marks values it could not encode with -1, which picks the trailing ""
+    return pd.Series(labels[codes], index=categories.index, dtype=object)
+
+
+def extract_quantity(product_data: dict) -> str:
+    """
+    Extract quantity details from Open Food Facts product data.
+    
+    Uses quantity, then serving_size, then a quantity found in the product name.
+    
+    Args:
+        product_data: Parsed product data
+    
+    Returns:
+        Formatted string like "500g", "1L", "200ml", or "" if unknown
+    """
+    quantity = product_data.get("quantity", "")
+    if quantity:
+        return str(quantity)
+    
+    serving_size = product_data.get("serving_size", "")
+    if serving_size:
+        return str(serving_size)
+    
+    return _quantity_from_name(product_data.get("product_name", ""))
+
+
+def _quantity_from_name(product_name: Optional[str]) -> str:
+    """Find a quantity such as "500 g" or "6 unidades" in a product name."""
+    if not product_name:
+        return ""
+    
+    match = _QUANTITY_PATTERN.match(product_name.lower())
+    if match is None:
+        return ""
+    if match.group(1) is not None:
+        return f"{match.group(1)}{match.group(2)}"
+    return f"{match.group(3)}{match.group(4)}"
+
+
+def extract_quantities(
+    quantity: pd.Series,
+    serving_size: Optional[pd.Series] = None,
+    product_name: Optional[pd.Series] = None
+) -> pd.Series:
+    """
+    Extract quantities for a whole column of products.
+    
+    Same precedence as extract_quantity; product names are only parsed for
+    rows that have neither quantity nor serving size.
+    
+    Args:
+        quantity: Series of quantity values
+        serving_size: Series of serving sizes, aligned with quantity (optional)
+        product_name: Series of product names, aligned with quantity (optional)
+    
+    Returns:
+        Series of quantity strings with the same index as quantity
+    """
+    size = len(quantity)
+    quantities = quantity.to_numpy(dtype=object)
+    serving_sizes = serving_size.to_numpy(dtype=object) if serving_size is not None else [None] * size
+    product_names = product_name.to_numpy(dtype=object) if product_name is not None else [None] * size
+    
+    values = [
+        _first_quantity(q, s, name)
+        for q, s, name in zip(quantities, serving_sizes, product_names)
+    ]
+    return pd.Series(values, index=quantity.index, dtype=object)
+
+
+def _first_quantity(quantity, serving_size, product_name) -> str:
+    """extract_quantity over loose values, treating NaN like a missing field."""
+    if quantity and quantity == quantity:
+        return str(quantity)
+    if serving_size and serving_size == serving_size:
+        return str(serving_size)
+    return _quantity_from_name(product_name) if isinstance(product_name, str) else ""
@@ -3,79 +3,80 @@ Food Scanner - Data Handler Module
 Handles data processing and Excel export using Pandas
 """
 import logging
-import re
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
 import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
 
 import config
+from .classifier import classify_category, extract_quantity
+from .result_store import EXPORT_COLUMNS, IMAGES_SEPARATOR, ResultStore
 
 logger = logging.getLogger(__name__)
 
+# Maximum Excel column width (characters)
+MAX_COLUMN_WIDTH = 50
+
+
+def write_excel_stream(
+    output,
+    columns: list[str],
+    rows,
+    column_widths: dict[str, int],
+    sheet_name: str = config.EXCEL_SHEET_NAME
+):
+    """
+    Write rows to an .xlsx file with a constant-memory (write-only) workbook.
+    
+    Write-only sheets emit column widths before the first row, so the widths
+    must be known up front.
+    
+    Args:
+        output: Destination path or binary file-like object
+        columns: Header names
+        rows: Iterable of row sequences, in column order
+        column_widths: Longest value length per column (header included)
+        sheet_name: Worksheet name
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    
+    for index, column in enumerate(columns, 1):
+        width = min(column_widths.get(column, len(column)) + 2, MAX_COLUMN_WIDTH)
+        worksheet.column_dimensions[get_column_letter(index)].width = width
+    
+    worksheet.append(columns)
+    for row in rows:
+        worksheet.append(row)
+    
+    workbook.save(output)
+
 
 class DataHandler:
     """Handles data processing and Excel export operations."""
     
     def __init__(self):
         """Initialize the data handler."""
-        self.results = []
+        self.store = ResultStore()
         logger.info("Data Handler inicializado")
     
-    def _extract_category_from_openfood(self, categories: str) -> str:
-        """
-        Extract the main category from Open Food Facts categories string.
-        Maps to ERP categories: bebestible, comida, helado, fiambre, lacteo, etc.
-        """
-        if not categories:
-            return ""
-        
-        categories_lower = categories.lower()
-        
-        # Category mapping from Open Food Facts to ERP categories
-        category_mappings = {
-            "bebestible": ["bebida", "bebida", "drink", "beverage", "agua", "jugo", "zumo", "jugu", "refresco", "soda", "cerveza", "vino", "licor", "cafe", "te", "leche"],
-            "helado": ["helado", "ice cream", "ice-cream", "gelato", "sorbete"],
-            "fiambre": ["fiambre", "jamón", "jam", "embutido", "salchicha", "chorizo", "tocino", "bacon", "paté"],
-            "lacteo": ["leche", "yogur", "yogurt", "queso", "cheese", "mantequilla", "crema", "nata", "kumis", "kumys"],
-            "comida": ["comida", "food", "pasta", "arroz", "cereal", "galleta", "biscuit", "pan", "bread", "dulce", "confitería", "chocolate", "carne", "pescado", "verdura", "vegetal", "fruta", "sopa", "salsas"]
-        }
-        
-        for erp_category, keywords in category_mappings.items():
-            for keyword in keywords:
-                if keyword in categories_lower:
-                    return erp_category
-        
-        return "comida"  # Default
+    @property
+    def results(self) -> list[dict]:
+        """Results as a list of row dictionaries (built on each access)."""
+        return list(self.store)
     
-    def _extract_quantity_from_openfood(self, product_data: dict) -> str:
-        """
-        Extract quantity details from Open Food Facts product data.
-        Returns formatted string like "500g", "1L", "200ml", etc.
-        """
-        quantity = product_data.get("quantity", "")
-        serving_size = product_data.get("serving_size", "")
-        
-        if quantity:
-            return str(quantity)
-        elif serving_size:
-            return str(serving_size)
-        else:
-            # Try to extract from other fields
-            product_name = product_data.get("product_name", "")
-            # Common patterns
-            import re
-            patterns = [
-                r'(\d+[.,]?\d*)\s*(g|gramos|ml|mililitros|l|litros|kg|kilogramos)',
-                r'(\d+[.,]?\d*)\s*(u|unidades|pcs|pieces)'
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, product_name.lower())
-                if match:
-                    return f"{match.group(1)}{match.group(2)}"
-        
-        return ""
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the current results, for caching work derived from them."""
+        return self.store.fingerprint
+    
+    @property
+    def column_widths(self) -> dict[str, int]:
+        """Longest value length per column, tracked as results are added."""
+        return self.store.column_widths
     
     def _extract_brand_as_proveedor(self, brands: str) -> str:
         """
@@ -114,21 +115,23 @@ class DataHandler:
             estado = "ENCONTRADO"
         
         # Initialize default values
-        codigo_barra = ""
+        codigo_barra = product_data_ocr.get("codigoBarras", "")
         detalle = product_data_ocr.get("detalle", "")
         cantidad = product_data_ocr.get("cantidad", 1)
         proveedor = product_data_ocr.get("proveedor", "")
         categoria = product_data_ocr.get("categoria", "")
         imagen_ref = image_name
+        # Every image the product was seen in (set by ProductDeduplicator)
+        imagenes = product_data_ocr.get("imagenes") or [image_name]
         
         # Override with API details if available
         if product_data_api:
             raw_categories = product_data_api.get("categories", "")
             raw_brands = product_data_api.get("brands", "")
             
-            api_categoria = self._extract_category_from_openfood(raw_categories)
+            api_categoria = classify_category(raw_categories)
             api_proveedor = self._extract_brand_as_proveedor(raw_brands)
-            api_detalle = self._extract_quantity_from_openfood(product_data_api)
+            api_detalle = extract_quantity(product_data_api)
             
             if not categoria and api_categoria:
                 categoria = api_categoria
@@ -137,7 +140,7 @@ class DataHandler:
             if not detalle and api_detalle:
                 detalle = api_detalle
                 
-            codigo_barra = product_data_api.get("code", "")
+            codigo_barra = product_data_api.get("code", "") or codigo_barra
         
         # Structuring exactly the requested fields
         result = {
@@ -153,10 +156,11 @@ class DataHandler:
             "proveedor": proveedor,
             "categoria": categoria,
             "fechaVencimiento": None, # Empty for user to fill
-            "estado": estado          # Internal use for UI summary
+            "estado": estado,         # Internal use for UI summary
+            "imagenes": IMAGES_SEPARATOR.join(imagenes)
         }
         
-        self.results.append(result)
+        self.store.append(result)
         logger.debug("Resultado añadido: %s - %s", image_name, nombre)
     
     def add_result_with_source(
@@ -187,43 +191,15 @@ class DataHandler:
             True if export successful, False otherwise
         """
         try:
-            if not self.results:
+            if not self.store:
                 logger.warning("No hay resultados para exportar")
                 return False
             
-            # Create DataFrame
-            df = pd.DataFrame(self.results)
-            
             # Ensure output directory exists
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # Export to Excel with formatting
-            with pd.ExcelWriter(
-                output_path,
-                engine="openpyxl"
-            ) as writer:
-                df.to_excel(
-                    writer,
-                    sheet_name=config.EXCEL_SHEET_NAME,
-                    index=False
-                )
-                
-                # Get workbook and worksheet
-                workbook = writer.book
-                worksheet = writer.sheets[config.EXCEL_SHEET_NAME]
-                
-                # Auto-adjust column widths
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            # Stream rows into a write-only workbook; widths were tracked as results were added
+            write_excel_stream(output_path, EXPORT_COLUMNS, self.store.iter_rows(EXPORT_COLUMNS), self.column_widths)
             
             logger.info("Resultados exportados a: %s", output_path)
             return True
@@ -239,22 +215,11 @@ class DataHandler:
         Returns:
             Dictionary with summary statistics
         """
-        total = len(self.results)
-        found = sum(1 for r in self.results if r.get("estado") == "ENCONTRADO")
-        not_found = sum(1 for r in self.results if r.get("estado") == "NO_ENCONTRADO")
-        errors = sum(1 for r in self.results if r.get("estado") == "ERROR_OCR")
-        
-        return {
-            "total": total,
-            "encontrados": found,
-            "no_encontrados": not_found,
-            "errores_ocr": errors,
-            "tasa_exito": (found / total * 100) if total > 0 else 0
-        }
+        return self.store.summary()
     
     def clear(self):
         """Clear all stored results."""
-        self.results.clear()
+        self.store.clear()
         logger.debug("Resultados清除")
     
     def get_dataframe(self) -> pd.DataFrame:
@@ -264,4 +229,4 @@ class DataHandler:
         Returns:
             DataFrame containing all results
         """
-        return pd.DataFrame(self.results)
+        return self.store.to_dataframe()
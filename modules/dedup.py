@@ -0,0 +1,163 @@
+"""
+Food Scanner - Deduplication Module
+Merges the same product seen on several images before it is looked up
+"""
+import difflib
+import logging
+import re
+from typing import Optional
+
+import config
+from utils.text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# OCR fields filled in from duplicates when the first sighting left them empty
+MERGE_FIELDS = ["detalle", "proveedor", "categoria"]
+
+
+class ProductDeduplicator:
+    """
+    Streaming product deduplication across images.
+    
+    Products are keyed by barcode when OCR read one, otherwise by normalized
+    nombre + detalle + proveedor. The first sighting of a product is kept and
+    returned by add(); later sightings only add their image to its
+    "imagenes" list and fill in fields it was missing.
+    """
+    
+    def __init__(self, fuzzy: bool = False, fuzzy_threshold: Optional[float] = None):
+        """
+        Initialize the deduplicator.
+        
+        Args:
+            fuzzy: Also merge products whose keys are similar but not identical
+            fuzzy_threshold: Minimum similarity (0-1) for a fuzzy match
+                (default: config.DEDUP_FUZZY_THRESHOLD)
+        """
+        self.fuzzy = fuzzy
+        self.fuzzy_threshold = fuzzy_threshold or config.DEDUP_FUZZY_THRESHOLD
+        
+        self._products = {}  # key -> kept product dict
+        self._name_keys = []  # name keys in insertion order, for fuzzy matching
+        
+        self.duplicates = 0
+        self.fuzzy_matches = 0
+    
+    @staticmethod
+    def barcode_key(product: dict) -> Optional[str]:
+        """
+        Build the barcode key of a product, if it has a plausible barcode.
+        
+        Args:
+            product: Product dict from OCR
+        
+        Returns:
+            Key like "barcode:7801234567890", or None
+        """
+        digits = re.sub(r"[^0-9]", "", str(product.get("codigoBarras") or ""))
+        return f"barcode:{digits}" if len(digits) >= 8 else None
+    
+    @staticmethod
+    def name_key(product: dict) -> str:
+        """
+        Build the name key of a product.
+        
+        Spaces are dropped from detalle so "500 g" and "500g" match.
+        
+        Args:
+            product: Product dict from OCR
+        
+        Returns:
+            Key like "name:leche entera|1l|soprole"
+        """
+        nombre = normalize_text(product.get("nombre", ""))
+        detalle = normalize_text(product.get("detalle", "")).replace(" ", "")
+        proveedor = normalize_text(product.get("proveedor", ""))
+        return f"name:{nombre}|{detalle}|{proveedor}"
+    
+    def add(self, image_name: str, product: dict) -> Optional[dict]:
+        """
+        Register one product sighting.
+        
+        Args:
+            image_name: Image the product was detected in
+            product: Product dict from OCR
+        
+        Returns:
+            The product (with an "imagenes" list) if this is its first sighting,
+            None if it merged into a product already returned
+        """
+        barcode = self.barcode_key(product)
+        name = self.name_key(product)
+        
+        kept = self._products.get(barcode) if barcode else None
+        if kept is None:
+            kept = self._products.get(name)
+        if kept is None and self.fuzzy:
+            kept = self._fuzzy_lookup(name)
+        
+        if kept is not None:
+            self._merge(kept, image_name, product)
+            # Later sightings can carry the barcode the first one missed
+            if barcode and barcode not in self._products:
+                self._products[barcode] = kept
+            return None
+        
+        product = dict(product)
+        product["imagenes"] = [image_name]
+        if barcode:
+            self._products[barcode] = product
+        self._products[name] = product
+        self._name_keys.append(name)
+        return product
+    
+    def _fuzzy_lookup(self, name: str) -> Optional[dict]:
+        """Find the kept product with the most similar name key above the threshold."""
+        matcher = difflib.SequenceMatcher(None, "", name, autojunk=False)
+        best_ratio = self.fuzzy_threshold
+        best_key = None
+        
+        for key in self._name_keys:
+            matcher.set_seq1(key)
+            # Cheap upper bounds first; ratio() is only computed for close candidates
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best_ratio = ratio
+                best_key = key
+        
+        if best_key is None:
+            return None
+        
+        self.fuzzy_matches += 1
+        logger.debug("Coincidencia aproximada (%.2f): %s ~ %s", best_ratio, name, best_key)
+        return self._products[best_key]
+    
+    def _merge(self, kept: dict, image_name: str, product: dict):
+        """Add a duplicate sighting to the kept product."""
+        self.duplicates += 1
+        if image_name not in kept["imagenes"]:
+            kept["imagenes"].append(image_name)
+        for field in MERGE_FIELDS:
+            if not kept.get(field) and product.get(field):
+                kept[field] = product[field]
+        if not kept.get("codigoBarras") and product.get("codigoBarras"):
+            kept["codigoBarras"] = product["codigoBarras"]
+    
+    def __len__(self) -> int:
+        return len(self._name_keys)
+    
+    def stats(self) -> dict:
+        """
+        Get deduplication statistics.
+        
+        Returns:
+            Dictionary with unique product and merged sighting counts
+        """
+        return {
+            "unicos": len(self),
+            "duplicados": self.duplicates,
+            "aproximados": self.fuzzy_matches,
+        }
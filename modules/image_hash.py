@@ -0,0 +1,167 @@
+"""
+Food Scanner - Image Hash Module
+Perceptual hashing (dHash) to spot burst shots and repeated photos before OCR
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Hashable, Optional, Union
+
+from PIL import Image, ImageOps
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def dhash(source: Union[Path, bytes], hash_size: Optional[int] = None) -> int:
+    """
+    Compute the difference hash of an image.
+    
+    The image is shrunk to (hash_size + 1) x hash_size grayscale pixels and
+    each bit records whether a pixel is brighter than its right neighbour.
+    JPEGs are decoded in draft mode, so only a small DCT scale is ever
+    decompressed.
+    
+    Args:
+        source: Image file path or raw image bytes
+        hash_size: Hash grid side; the hash has hash_size ** 2 bits
+            (default: config.NEAR_DUP_HASH_SIZE)
+    
+    Returns:
+        Hash as an integer
+    """
+    hash_size = hash_size or config.NEAR_DUP_HASH_SIZE
+    width, height = hash_size + 1, hash_size
+    
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    if image.format == "JPEG":
+        # Smallest scale (down to 1/8) that still covers a generous thumbnail
+        image.draft("L", (width * 8, height * 8))
+    image = ImageOps.exif_transpose(image)
+    pixels = list(image.convert("L").resize((width, height), Image.Resampling.BILINEAR).getdata())
+    
+    value = 0
+    for row in range(height):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+class ImageHashIndex:
+    """
+    Perceptual-hash index over a set of input images.
+    
+    Images are added in processing order; an image within the Hamming
+    threshold of an earlier one is recorded as its near duplicate, so it can
+    reuse that image's OCR result instead of being sent to Gemini.
+    """
+    
+    def __init__(
+        self,
+        threshold: Optional[int] = None,
+        hash_size: Optional[int] = None,
+        max_workers: Optional[int] = None
+    ):
+        """
+        Initialize the index.
+        
+        Args:
+            threshold: Maximum Hamming distance for a near duplicate
+                (default: config.NEAR_DUP_THRESHOLD)
+            hash_size: Hash grid side (default: config.NEAR_DUP_HASH_SIZE)
+            max_workers: Threads used to hash images (default: config.OCR_MAX_WORKERS)
+        """
+        self.threshold = threshold if threshold is not None else config.NEAR_DUP_THRESHOLD
+        self.hash_size = hash_size or config.NEAR_DUP_HASH_SIZE
+        self.max_workers = max_workers or config.OCR_MAX_WORKERS
+        
+        self.hashes = {}  # key -> hash
+        self.duplicates = {}  # near-duplicate key -> representative key
+        self._representatives = []  # (key, hash) of images that will be processed
+        self.elapsed_ms = 0.0
+    
+    def add_images(self, images: list[tuple[Hashable, Union[Path, bytes]]]):
+        """
+        Hash a set of images in parallel and index them in the given order.
+        
+        Images that cannot be decoded are indexed as unique, so OCR still
+        reports the problem for them.
+        
+        Args:
+            images: (key, source) pairs; source is a file path or image bytes
+        """
+        start = time.perf_counter()
+        
+        def compute(item):
+            key, source = item
+            try:
+                return dhash(source, self.hash_size)
+            except Exception as e:
+                logger.warning("No se pudo calcular el hash de %s: %s", key, str(e))
+                return None
+        
+        # PIL releases the GIL while decoding, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            hashes = list(executor.map(compute, images))
+        
+        for (key, _), value in zip(images, hashes):
+            self.add(key, value)
+        
+        self.elapsed_ms += (time.perf_counter() - start) * 1000
+    
+    def add(self, key: Hashable, value: Optional[int]) -> Optional[Hashable]:
+        """
+        Index one already-hashed image.
+        
+        Args:
+            key: Image identifier (path or name)
+            value: Its dHash, or None if it could not be hashed
+        
+        Returns:
+            Key of the earlier image it duplicates, or None if it is new
+        """
+        if value is None:
+            return None
+        
+        self.hashes[key] = value
+        if self.threshold > 0:
+            for representative, representative_hash in self._representatives:
+                if hamming_distance(value, representative_hash) <= self.threshold:
+                    self.duplicates[key] = representative
+                    return representative
+        
+        self._representatives.append((key, value))
+        return None
+    
+    def representative(self, key: Hashable) -> Optional[Hashable]:
+        """
+        Get the image whose OCR result a near duplicate should reuse.
+        
+        Args:
+            key: Image identifier
+        
+        Returns:
+            Representative key, or None if the image is not a near duplicate
+        """
+        return self.duplicates.get(key)
+    
+    def report(self) -> dict:
+        """
+        Group collapsed images by the image that stands in for them.
+        
+        Returns:
+            Dictionary mapping each representative key to its near duplicates
+        """
+        groups = {}
+        for key, representative in self.duplicates.items():
+            groups.setdefault(representative, []).append(key)
+        return groups
@@ -0,0 +1,276 @@
+"""
+Food Scanner - Image Store Module
+Keeps a session's uploaded photos as small previews in memory and originals on disk
+"""
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Directories of the stores alive in this process; never swept
+_live_directories = set()
+_live_lock = threading.Lock()
+
+
+def make_preview(image_bytes: bytes, max_dimension: Optional[int] = None, quality: Optional[int] = None) -> bytes:
+    """
+    Build a small upright JPEG preview of an image.
+    
+    JPEGs are decoded in draft mode, so only the DCT scale needed for the
+    preview is decompressed.
+    
+    Args:
+        image_bytes: Raw bytes of the image file
+        max_dimension: Longest preview side in pixels (default: config.IMAGE_PREVIEW_DIMENSION)
+        quality: JPEG quality (default: config.IMAGE_PREVIEW_QUALITY)
+    
+    Returns:
+        JPEG bytes of the preview
+    """
+    max_dimension = max_dimension or config.IMAGE_PREVIEW_DIMENSION
+    
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == "JPEG":
+        image.draft("RGB", (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=quality or config.IMAGE_PREVIEW_QUALITY)
+    return output.getvalue()
+
+
+def sweep_stale_sessions(directory: Optional[Path] = None, max_age: Optional[float] = None) -> int:
+    """
+    Remove session directories left behind by app processes that crashed or were killed.
+    
+    Stores normally remove their directory when closed, garbage-collected
+    or at interpreter exit, none of which happens after a crash. Directories
+    of stores alive in this process are kept, and so are directories touched
+    within max_age, which may belong to another app process.
+    
+    Args:
+        directory: Parent of the session directories (default: config.IMAGE_STORE_DIR)
+        max_age: Seconds since a directory was last modified before it is
+            considered abandoned (default: config.IMAGE_STORE_STALE_SECONDS)
+    
+    Returns:
+        Number of directories removed
+    """
+    parent = Path(directory or config.IMAGE_STORE_DIR)
+    max_age = config.IMAGE_STORE_STALE_SECONDS if max_age is None else max_age
+    cutoff = time.time() - max_age
+    
+    removed = 0
+    with _live_lock:
+        live = set(_live_directories)
+    for path in parent.glob("sesion_*"):
+        try:
+            if path in live or not path.is_dir() or path.stat().st_mtime > cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    
+    if removed:
+        logger.info("Eliminadas %d carpetas de sesiones abandonadas en %s", removed, parent)
+    return removed
+
+
+def _remove_session_directory(path: Path):
+    """Delete a store's directory and forget it (runs from the store's finalizer)."""
+    shutil.rmtree(path, ignore_errors=True)
+    with _live_lock:
+        _live_directories.discard(path)
+
+
+class SessionImageStore:
+    """
+    Uploaded photos of one app session.
+    
+    A preview of every photo stays in memory for the "Evidencia Visual"
+    panel. Originals are spilled to a private directory capped at
+    max_disk_bytes; when it is full, the least recently viewed originals are
+    deleted and only their previews remain. The directory is removed when
+    the store is closed or garbage-collected; directories left by a crash
+    are swept when a later store is created.
+    """
+    
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        max_disk_bytes: Optional[int] = None,
+        preview_dimension: Optional[int] = None
+    ):
+        """
+        Initialize the store.
+        
+        Args:
+            directory: Parent of the session directory (default: config.IMAGE_STORE_DIR)
+            max_disk_bytes: Maximum size of the originals on disk (default: config.IMAGE_STORE_MAX_BYTES)
+            preview_dimension: Longest preview side in pixels (default: config.IMAGE_PREVIEW_DIMENSION)
+        """
+        parent = Path(directory or config.IMAGE_STORE_DIR)
+        parent.mkdir(parents=True, exist_ok=True)
+        sweep_stale_sessions(parent)
+        self.directory = Path(tempfile.mkdtemp(prefix="sesion_", dir=parent))
+        with _live_lock:
+            _live_directories.add(self.directory)
+        self.max_disk_bytes = max_disk_bytes or config.IMAGE_STORE_MAX_BYTES
+        self.preview_dimension = preview_dimension or config.IMAGE_PREVIEW_DIMENSION
+        
+        self._previews = {}  # name -> preview JPEG bytes
+        self._originals = OrderedDict()  # name -> (file, size), least recently used first
+        self._disk_bytes = 0
+        self._next_file = 0
+        self._lock = threading.Lock()
+        
+        self.reads = 0
+        self.evictions = 0
+        
+        # Remove the spilled originals even if the session ends without close()
+        self._finalizer = weakref.finalize(self, _remove_session_directory, self.directory)
+    
+    def add(self, name: str, image_bytes: bytes):
+        """
+        Store an uploaded photo, replacing any earlier one with the same name.
+        
+        Args:
+            name: Image name, as shown in the "imagen" column
+            image_bytes: Raw bytes of the image file
+        """
+        try:
+            preview = make_preview(image_bytes, self.preview_dimension)
+        except Exception as e:
+            logger.warning("No se pudo generar la vista previa de %s: %s", name, str(e))
+            preview = None
+        
+        with self._lock:
+            self._remove_original_locked(name)
+            if preview is not None:
+                self._previews[name] = preview
+            else:
+                self._previews.pop(name, None)
+            
+            if len(image_bytes) > self.max_disk_bytes:
+                logger.debug("Imagen %s demasiado grande para el almacén (%d bytes)", name, len(image_bytes))
+                return
+            
+            path = self.directory / f"{self._next_file:06d}"
+            self._next_file += 1
+            path.write_bytes(image_bytes)
+            self._originals[name] = (path, len(image_bytes))
+            self._disk_bytes += len(image_bytes)
+            self._evict_locked()
+    
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._previews or name in self._originals
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._previews.keys() | self._originals.keys())
+    
+    def preview(self, name: str) -> Optional[bytes]:
+        """
+        Get the in-memory preview of a photo.
+        
+        Args:
+            name: Image name
+        
+        Returns:
+            Preview JPEG bytes, or None if the photo is unknown or could not be decoded
+        """
+        with self._lock:
+            return self._previews.get(name)
+    
+    def original(self, name: str) -> Optional[bytes]:
+        """
+        Load the original of a photo from disk and mark it as recently used.
+        
+        Args:
+            name: Image name
+        
+        Returns:
+            Raw image bytes, or None if the original was evicted or never stored
+        """
+        with self._lock:
+            entry = self._originals.get(name)
+            if entry is None:
+                return None
+            self._originals.move_to_end(name)
+            self.reads += 1
+            path = entry[0]
+        
+        try:
+            return path.read_bytes()
+        except OSError as e:
+            logger.error("No se pudo leer la imagen %s del almacén: %s", name, str(e))
+            return None
+    
+    def _remove_original_locked(self, name: str):
+        """Delete the stored original of a photo, if any."""
+        entry = self._originals.pop(name, None)
+        if entry is not None:
+            path, size = entry
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+    
+    def _evict_locked(self):
+        """Delete least recently used originals until the store fits in max_disk_bytes."""
+        while self._disk_bytes > self.max_disk_bytes and self._originals:
+            name = next(iter(self._originals))
+            self._remove_original_locked(name)
+            self.evictions += 1
+            logger.debug("Original de %s retirado del almacén de imágenes", name)
+    
+    def stats(self) -> dict:
+        """
+        Get storage statistics.
+        
+        Returns:
+            Dictionary with photo count, preview bytes in memory, originals and
+            bytes on disk, the disk budget, originals read and evicted
+        """
+        with self._lock:
+            return {
+                "imagenes": len(self._previews.keys() | self._originals.keys()),
+                "memoria_bytes": sum(len(preview) for preview in self._previews.values()),
+                "originales": len(self._originals),
+                "disco_bytes": self._disk_bytes,
+                "disco_max_bytes": self.max_disk_bytes,
+                "lecturas": self.reads,
+                "expulsadas": self.evictions,
+            }
+    
+    def clear(self):
+        """Remove all photos."""
+        with self._lock:
+            for name in list(self._originals):
+                self._remove_original_locked(name)
+            self._previews.clear()
+        logger.debug("Almacén de imágenes vaciado")
+    
+    def close(self):
+        """Remove all photos and the session directory."""
+        with self._lock:
+            self._previews.clear()
+            self._originals.clear()
+            self._disk_bytes = 0
+        self._finalizer()
+        logger.debug("Almacén de imágenes cerrado")
@@ -0,0 +1,157 @@
+"""
+Food Scanner - Run Journal Module
+Append-only JSONL journal of a scan run, used to resume after a crash
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """
+    Records OCR output and enrichment results as they are produced.
+    
+    Each line is one JSON event:
+        {"tipo": "ocr", "imagen": ..., "productos": [...]}
+        {"tipo": "producto", "imagen": ..., "indice": ..., "producto": {...}, "datos": {...}}
+        {"tipo": "imagen_completa", "imagen": ...}
+    
+    OCR and completion events are fsync'd, so an image marked complete
+    survives a crash together with all of its product events.
+    """
+    
+    def __init__(self, path: Path, resume: bool = False):
+        """
+        Open the journal.
+        
+        Args:
+            path: Journal file (JSONL)
+            resume: If True, load the existing journal and keep appending to it;
+                otherwise start a new, empty journal
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        
+        # Resume state
+        self.completed = {}  # image name -> [(product_index, product, product_data), ...]
+        self.ocr_results = {}  # image name -> products (OCR done, enrichment incomplete)
+        self.ocr_products = {}  # image name -> products, for every image with recorded OCR
+        
+        if resume and self.path.exists():
+            self._trim_torn_line()
+            self._load()
+        elif resume:
+            logger.warning("No existe diario para reanudar: %s", self.path)
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+    
+    def _trim_torn_line(self):
+        """
+        Drop a half-written last line left by a crash.
+        
+        Otherwise the first event appended on resume would be glued to it and
+        lost with it when the journal is loaded again.
+        """
+        with open(self.path, "rb+") as handle:
+            data = handle.read()
+            if data and not data.endswith(b"\n"):
+                handle.truncate(data.rfind(b"\n") + 1)
+                logger.warning("Descartada la última línea incompleta del diario: %s", self.path)
+    
+    def _load(self):
+        """Rebuild resume state from the journal file."""
+        ocr = {}
+        products = {}
+        done = set()
+        
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half-written
+                    continue
+                
+                image_name = event.get("imagen")
+                kind = event.get("tipo")
+                if kind == "ocr":
+                    # With streaming OCR, product events can precede the ocr event
+                    ocr[image_name] = event["productos"]
+                    products.setdefault(image_name, {})
+                elif kind == "producto":
+                    products.setdefault(image_name, {})[event["indice"]] = (event["producto"], event["datos"])
+                elif kind == "imagen_completa":
+                    done.add(image_name)
+        
+        self.ocr_products = ocr
+        for image_name in ocr:
+            if image_name in done:
+                self.completed[image_name] = [
+                    (index, product, product_data)
+                    for index, (product, product_data) in sorted(products[image_name].items())
+                ]
+            else:
+                self.ocr_results[image_name] = ocr[image_name]
+        
+        logger.info(
+            "Diario cargado: %d imágenes completas, %d con OCR pendiente de enriquecer",
+            len(self.completed), len(self.ocr_results)
+        )
+    
+    def _write(self, event: dict, sync: bool = False):
+        """Append one event, optionally forcing it to disk."""
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+    
+    def record_ocr(self, image_name: str, products: list):
+        """
+        Record the OCR output of an image.
+        
+        Args:
+            image_name: Source image name
+            products: Product list returned by OCR
+        """
+        self._write({"tipo": "ocr", "imagen": image_name, "productos": products}, sync=True)
+    
+    def record_product(self, image_name: str, product_index: int, product: dict, product_data: Optional[dict]):
+        """
+        Record the enrichment result of one product.
+        
+        Args:
+            image_name: Source image name
+            product_index: Position of the product in the image's OCR output
+            product: Product dict from OCR
+            product_data: Open Food Facts data, or None if not found
+        """
+        self._write({
+            "tipo": "producto",
+            "imagen": image_name,
+            "indice": product_index,
+            "producto": product,
+            "datos": product_data,
+        })
+    
+    def record_image_done(self, image_name: str):
+        """
+        Mark an image as fully processed.
+        
+        Args:
+            image_name: Source image name
+        """
+        self._write({"tipo": "imagen_completa", "imagen": image_name}, sync=True)
+    
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            self._file.close()
+        logger.debug("Diario cerrado: %s", self.path)
@@ -0,0 +1,212 @@
+"""
+Food Scanner - Key Pool Module
+Spreads Gemini requests over several API keys, each with its own quota
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import config
+from utils.concurrency import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def load_api_keys(keys_file: Optional[Path] = None) -> list[str]:
+    """
+    Collect the configured Gemini API keys, without duplicates.
+    
+    Keys come from the file (one per line, "#" starts a comment), then
+    GEMINI_API_KEYS (comma-separated), then GEMINI_API_KEY. All of them can
+    be set in .env.
+    
+    Args:
+        keys_file: Key file (default: config.GEMINI_API_KEYS_FILE)
+    
+    Returns:
+        API keys in that order
+    """
+    keys = []
+    
+    keys_file = keys_file or (Path(config.GEMINI_API_KEYS_FILE) if config.GEMINI_API_KEYS_FILE else None)
+    if keys_file is not None:
+        try:
+            for line in Path(keys_file).read_text(encoding="utf-8").splitlines():
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    keys.append(line)
+        except OSError as e:
+            logger.error("No se pudo leer el archivo de API keys %s: %s", keys_file, str(e))
+    
+    keys.extend(key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip())
+    if config.GEMINI_API_KEY:
+        keys.append(config.GEMINI_API_KEY)
+    
+    return list(dict.fromkeys(keys))
+
+
+class GeminiKey:
+    """One API key with its client, concurrency limiter and counters."""
+    
+    def __init__(self, api_key: str, index: int, client: Any, limiter: AdaptiveLimiter):
+        """
+        Initialize the key state.
+        
+        Args:
+            api_key: Gemini API key
+            index: Position in the pool, used for its label
+            client: SDK client bound to this key
+            limiter: Concurrency limiter for this key's quota
+        """
+        self.api_key = api_key
+        self.label = f"clave {index + 1} (...{api_key[-4:]})"
+        self.client = client
+        self.limiter = limiter
+        
+        self.requests = 0
+        self.throttles = 0
+        self.benches = 0
+        self.benched_until = 0.0  # Monotonic time when the key can be used again
+    
+    def ready_at(self) -> float:
+        """Monotonic time from which the key accepts new calls."""
+        return max(self.benched_until, self.limiter.paused_until)
+
+
+class GeminiKeyPool:
+    """
+    Routes each Gemini request to the least-loaded key that has quota left.
+    
+    Every key has its own AIMD limiter. With more than one key, a key that
+    gets throttled is benched for its Retry-After (or bench_seconds) so the
+    other keys take its traffic; a single key only slows down.
+    """
+    
+    def __init__(
+        self,
+        api_keys: list[str],
+        client_factory: Callable[[str], Any],
+        adaptive: bool = True,
+        concurrency: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        bench_seconds: Optional[float] = None
+    ):
+        """
+        Initialize the pool.
+        
+        Args:
+            api_keys: Gemini API keys (at least one)
+            client_factory: Builds the SDK client for a key
+            adaptive: Adapt each key's concurrency to its quota; otherwise it stays fixed
+            concurrency: Concurrent calls per key, or the starting limit when adaptive
+                (default: config.OCR_MAX_WORKERS)
+            max_concurrency: Highest adaptive limit per key (default: config.OCR_MAX_CONCURRENCY)
+            bench_seconds: Bench time for a throttled key without Retry-After
+                (default: config.GEMINI_KEY_BENCH_SECONDS)
+        """
+        if not api_keys:
+            raise ValueError("Se necesita al menos una API key de Gemini")
+        
+        concurrency = concurrency or config.OCR_MAX_WORKERS
+        if adaptive:
+            limiter_settings = {"maximum": max_concurrency or config.OCR_MAX_CONCURRENCY}
+        else:
+            # A limiter that never moves is a plain semaphore
+            limiter_settings = {"increase": 0, "decrease": 1}
+        
+        self.adaptive = adaptive
+        self.bench_seconds = bench_seconds if bench_seconds is not None else config.GEMINI_KEY_BENCH_SECONDS
+        self.keys = [
+            GeminiKey(api_key, index, client_factory(api_key), AdaptiveLimiter(concurrency, **limiter_settings))
+            for index, api_key in enumerate(api_keys)
+        ]
+        self._cond = threading.Condition()
+        self.waited = 0.0
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    @property
+    def max_concurrency(self) -> int:
+        """Calls the pool can have in flight at its highest limits."""
+        return sum(key.limiter.maximum for key in self.keys)
+    
+    def acquire(self) -> tuple[GeminiKey, int]:
+        """
+        Take a call slot on the least-loaded available key, blocking until one frees up.
+        
+        Returns:
+            (key, ticket) to pass to release()
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                available = [key for key in self.keys if key.ready_at() <= now]
+                for key in sorted(available, key=lambda key: key.limiter.load):
+                    ticket = key.limiter.try_acquire()
+                    if ticket is not None:
+                        key.requests += 1
+                        self.waited += now - start
+                        return key, ticket
+                
+                # Sleep until a slot is released or the next bench / pause ends
+                waiting = [key.ready_at() for key in self.keys if key.ready_at() > now]
+                self._cond.wait(min(waiting) - now if waiting else None)
+    
+    def release(self, key: GeminiKey, ticket: int, throttled: bool = False, retry_after: Optional[float] = None):
+        """
+        Return a call slot and update the key's quota state.
+        
+        Args:
+            key: Key returned by acquire()
+            ticket: Ticket returned by acquire()
+            throttled: True if Gemini answered 429 / 503
+            retry_after: Seconds Gemini asked to wait, if it said
+        """
+        key.limiter.release(ticket, throttled=throttled, retry_after=retry_after)
+        
+        with self._cond:
+            if throttled:
+                key.throttles += 1
+                if len(self.keys) > 1:
+                    bench = retry_after if retry_after is not None else self.bench_seconds
+                    until = time.monotonic() + bench
+                    if until > key.benched_until:
+                        if key.benched_until <= time.monotonic():
+                            key.benches += 1
+                            logger.warning("Gemini limitó la %s, en pausa %.1f s", key.label, bench)
+                        key.benched_until = until
+            self._cond.notify_all()
+    
+    def stats(self) -> dict:
+        """
+        Get pool statistics, in total and per key.
+        
+        Returns:
+            Dictionary with the summed limiter statistics and a "claves" list
+            of per-key request, throttle, bench and limit counts
+        """
+        totals = {"limite": 0, "limite_max": 0, "en_curso": 0, "exitos": 0, "limitaciones": 0, "reducciones": 0}
+        per_key = []
+        
+        for key in self.keys:
+            limiter_stats = key.limiter.stats()
+            for name in totals:
+                totals[name] += limiter_stats[name]
+            with self._cond:
+                per_key.append({
+                    "clave": key.label,
+                    "peticiones": key.requests,
+                    "limitaciones": key.throttles,
+                    "pausas": key.benches,
+                    "limite": limiter_stats["limite"],
+                    "limite_max": limiter_stats["limite_max"],
+                })
+        
+        totals["espera_s"] = self.waited
+        totals["claves"] = per_key
+        return totals
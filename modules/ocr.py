@@ -2,37 +2,166 @@
 Food Scanner - OCR Module
 Uses Gemini Flash 2.0 for text extraction from product images
 """
+import json
 import logging
+import random
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional, Union
 
 try:
     import google.genai as genai
+    from google.genai import types
     USE_NEW_PACKAGE = True
 except ImportError:
     import google.generativeai as genai
     USE_NEW_PACKAGE = False
 
+from io import BytesIO
+
 from PIL import Image
 
 import config
+from utils.concurrency import AttemptClock, HedgedCalls
+from utils.json_stream import JSONArrayStream
+from .dedup import ProductDeduplicator
+from .image_hash import ImageHashIndex
+from .key_pool import GeminiKey, GeminiKeyPool, load_api_keys
+from .ocr_cache import OCRCache
+from .preprocess import SOURCE_MIME_TYPES, preprocess_image, preprocess_settings_key
+from .tiling import crop_tiles, plan_tiles, upright_size
 
 logger = logging.getLogger(__name__)
 
+# HTTP statuses Gemini answers with when a key is over quota or the model is overloaded
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Images can come from disk or already be in memory (encoded bytes or a binary buffer)
+ImageInput = Union[Path, bytes, BinaryIO]
+
+# Server-suggested wait inside the error text ("retryDelay": "17s", "Please retry in 17.5s")
+_RETRY_DELAY_PATTERN = re.compile(r"retry(?:Delay['\"]?\s*:\s*['\"]?| in )(\d+(?:\.\d+)?)s", re.IGNORECASE)
+
 
 class OCRProcessor:
     """Processes product images using Gemini to extract product names."""
     
-    def __init__(self, api_key: Optional[str] = None, demo_mode: bool = False):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        demo_mode: bool = False,
+        cache: Optional[OCRCache] = None,
+        refresh_cache: bool = False,
+        preprocess: Optional[bool] = None,
+        max_dimension: Optional[int] = None,
+        image_format: Optional[str] = None,
+        image_quality: Optional[int] = None,
+        pack_size: Optional[int] = None,
+        stream: Optional[bool] = None,
+        adaptive: Optional[bool] = None,
+        concurrency: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        api_keys: Optional[list[str]] = None,
+        tiered: Optional[bool] = None,
+        hedge: Optional[bool] = None,
+        tile: Optional[bool] = None
+    ):
         """
         Initialize the OCR processor.
         
         Args:
-            api_key: Gemini API key. If not provided, uses config.GEMINI_API_KEY
+            api_key: Gemini API key, used on its own. If neither it nor api_keys is provided,
+                uses the keys from load_api_keys() (GEMINI_API_KEYS_FILE, GEMINI_API_KEYS, GEMINI_API_KEY)
             demo_mode: If True, uses mock data for testing
+            cache: Optional persistent cache of OCR results
+            refresh_cache: If True, ignore cached results but store fresh ones
+            preprocess: Downscale/re-encode images before upload (default: config.IMAGE_PREPROCESS)
+            max_dimension: Longest image side sent to Gemini (default: config.IMAGE_MAX_DIMENSION)
+            image_format: Upload encoding, "JPEG" or "WEBP" (default: config.IMAGE_FORMAT)
+            image_quality: Upload encoder quality (default: config.IMAGE_QUALITY)
+            pack_size: Images sent per Gemini request in batches (default: config.OCR_PACK_SIZE)
+            stream: Stream single-image answers and parse products as they arrive
+                (default: config.OCR_STREAM)
+            adaptive: Adapt concurrent Gemini calls to each key's quota (default: config.OCR_ADAPTIVE)
+            concurrency: Concurrent Gemini calls per key, or the starting limit when adaptive
+                (default: config.OCR_MAX_WORKERS)
+            max_concurrency: Highest adaptive limit per key (default: config.OCR_MAX_CONCURRENCY)
+            api_keys: Pool of Gemini API keys; requests go to the least-loaded key with quota left
+            tiered: Ask config.GEMINI_FAST_MODEL first and escalate doubtful answers to
+                config.GEMINI_MODEL (default: config.OCR_TIERED)
+            hedge: Send a duplicate of calls slower than the recent OCR_HEDGE_PERCENTILE
+                latency and keep whichever answers first (default: config.OCR_HEDGE)
+            tile: Cut wide panoramas into overlapping tiles read in parallel (default: config.OCR_TILE)
+        
+        Raises:
+            ValueError: If both api_key and api_keys are given, or no API key is configured
         """
         self.demo_mode = demo_mode
-        self.api_key = api_key or config.GEMINI_API_KEY
+        if api_key and api_keys is not None:
+            raise ValueError("Usa api_key o api_keys, no ambos")
+        if api_keys is None:
+            api_keys = [api_key] if api_key else load_api_keys()
+        self.api_keys = list(dict.fromkeys(key for key in api_keys if key))
+        self.api_key = self.api_keys[0] if self.api_keys else ""
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        
+        # Upload preprocessing settings
+        self.preprocess = config.IMAGE_PREPROCESS if preprocess is None else preprocess
+        self.max_dimension = max_dimension or config.IMAGE_MAX_DIMENSION
+        self.image_format = (image_format or config.IMAGE_FORMAT).upper()
+        self.image_quality = image_quality or config.IMAGE_QUALITY
+        # Running totals, so a long-lived processor does not keep one entry per image
+        self.preprocess_stats = {"imagenes": 0, "sin_recodificar": 0, "bytes_antes": 0, "bytes_despues": 0, "tiempo_ms": 0.0}
+        self._stats_lock = threading.Lock()
+        
+        # Multi-image packing (1 = one image per request)
+        self.pack_size = max(1, pack_size or config.OCR_PACK_SIZE)
+        
+        # Panorama tiling; tiles are sized like the uploads
+        self.tile = config.OCR_TILE if tile is None else tile
+        self.tile_stats = {"imagenes": 0, "teselas": 0, "fallidas": 0, "repetidos": 0}
+        
+        # Streaming answers; packed requests are always read whole
+        self.stream = config.OCR_STREAM if stream is None else stream
+        # Totals since start, plus a window of recent (time to first product, total) in ms
+        # for the p95; a long-lived processor must not keep one entry per image ever seen
+        self.latency_stats = {"peticiones": 0, "primer_producto_ms": 0.0, "total_ms": 0.0}
+        self._latency_window = deque(maxlen=config.OCR_STATS_WINDOW)
+        
+        # Model tiers, cheapest first; each answer is checked before trusting it
+        tiered = config.OCR_TIERED if tiered is None else tiered
+        self.tiers = [config.GEMINI_MODEL]
+        if tiered and config.GEMINI_FAST_MODEL and config.GEMINI_FAST_MODEL != config.GEMINI_MODEL:
+            self.tiers.insert(0, config.GEMINI_FAST_MODEL)
+        self.tier_stats = {
+            model: {
+                "peticiones": 0,
+                "imagenes": 0,
+                "escaladas": 0,
+                "latencia_total_ms": 0.0,
+                "latencias_ms": deque(maxlen=config.OCR_STATS_WINDOW),  # Recientes, para el p95
+                "tokens_entrada": 0,
+                "tokens_salida": 0,
+            }
+            for model in self.tiers
+        }
+        
+        # Hedged calls: recent latencies per model (and streamed or not) set the hedge delay
+        self.hedge = config.OCR_HEDGE if hedge is None else hedge
+        self.hedger = None
+        
+        # Throttled calls are retried instead of failing the image
+        self.key_pool = None
+        self.max_concurrency = concurrency or config.OCR_MAX_WORKERS  # Worker threads
+        self.retries = 0
+        self.throttle_failures = 0  # Requests still throttled after every retry
         
         if demo_mode:
             logger.info("OCR Processor inicializado en MODO DEMO")
@@ -45,114 +174,1467 @@ class OCRProcessor:
         
         # Configure Gemini
         if USE_NEW_PACKAGE:
-            self.client = genai.Client(api_key=self.api_key)
+            self.models = {model: model for model in self.tiers}
         else:
+            if len(self.api_keys) > 1:
+                # google.generativeai only holds one global key
+                logger.warning("google.generativeai no admite varias API keys; se usará solo la primera")
+                self.api_keys = self.api_keys[:1]
             genai.configure(api_key=self.api_key)
+            self.models = {model: genai.GenerativeModel(model) for model in self.tiers}
         
-        self.model = genai.GenerativeModel(config.GEMINI_MODEL)
+        # One client and one AIMD limiter per key
+        self.key_pool = GeminiKeyPool(
+            self.api_keys,
+            self._create_client,
+            adaptive=config.OCR_ADAPTIVE if adaptive is None else adaptive,
+            concurrency=concurrency,
+            max_concurrency=max_concurrency
+        )
+        # Worker threads needed to reach the highest limits
+        self.max_concurrency = self.key_pool.max_concurrency
         
-        logger.info("OCR Processor inicializado con modelo %s", config.GEMINI_MODEL)
+        # Attempts run on their own threads; a duplicate can wait on the key pool
+        self.hedger = HedgedCalls(
+            max_workers=2 * self.max_concurrency + 2,
+            percentile=config.OCR_HEDGE_PERCENTILE,
+            max_ratio=config.OCR_HEDGE_MAX_RATIO,
+            min_delay=config.OCR_HEDGE_MIN_DELAY,
+            min_samples=config.OCR_HEDGE_MIN_SAMPLES,
+            window=config.OCR_HEDGE_WINDOW,
+            deadline=config.OCR_CALL_DEADLINE or None
+        )
+        
+        logger.info(
+            "OCR Processor inicializado con modelo %s y %d API key(s)",
+            " -> ".join(self.tiers), len(self.key_pool)
+        )
     
-    def process_image(self, image_path: Path) -> list:
+    @staticmethod
+    def _create_client(api_key: str):
+        """Build the SDK client for one API key (google.generativeai uses its global client)."""
+        if USE_NEW_PACKAGE:
+            return genai.Client(api_key=api_key)
+        return None
+    
+    def process_image(self, image: ImageInput, image_name: Optional[str] = None) -> list:
         """
         Process a single image and extract ALL product names.
         
         Args:
-            image_path: Path to the image file
-            
+            image: Path to the image file, or its encoded bytes / a binary buffer
+                (such as a Streamlit upload) already in memory
+            image_name: Name used for logging and stats (default: the file or buffer name)
+        
         Returns:
             List of extracted product names or ["NO_DETECTADO"] if extraction fails
         """
+        image_name = image_name or self.image_name(image)
+        
         # Demo mode - return mock data
         if self.demo_mode:
-            logger.info("Procesando imagen (DEMO): %s", image_path.name)
+            logger.info("Procesando imagen (DEMO): %s", image_name)
             mock_products = ["Leche Entera", "Galletas Maria", "Jugo de Naranja", "Yogur Natural", "Pasta de Dientes"]
-            import random
             # Return 3-5 random products for demo
             num_products = random.randint(3, 5)
             selected = random.sample(mock_products, min(num_products, len(mock_products)))
             logger.info("Productos detectados (DEMO): %s", selected)
             return selected
         
+        if self.stream:
+            return list(self._stream_products(image, image_name))
+        
         try:
-            logger.info("Procesando imagen: %s", image_path.name)
+            image_bytes = self._read_image(image)
+            boxes = self._plan_tiles(image_bytes, image_name)
             
-            # Load and validate image
-            image = Image.open(image_path)
+            # Check the persistent cache before calling Gemini
+            cache_key, cached = self._cache_lookup(image_bytes, image_name, tiles=len(boxes))
+            if cached is not None:
+                return cached
             
-            # Convert to RGB if necessary
-            if image.mode != "RGB":
-                image = image.convert("RGB")
+            if boxes:
+                return list(self._iter_tiles(image_bytes, image_name, boxes, cache_key))
             
-            # Generate content with Gemini
-            if USE_NEW_PACKAGE:
-                from google.genai import types
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=[config.OCR_PROMPT, image],
-                    config=types.GenerateContentConfig(
-                        temperature=config.GEMINI_TEMPERATURE,
-                        max_output_tokens=config.GEMINI_MAX_TOKENS,
-                        response_mime_type="application/json"
-                    )
-                )
-            else:
-                response = self.model.generate_content(
-                    [
-                        config.OCR_PROMPT,
-                        image
-                    ],
-                    generation_config={
-                        "max_output_tokens": config.GEMINI_MAX_TOKENS,
-                        "temperature": config.GEMINI_TEMPERATURE,
-                        "response_mime_type": "application/json"
-                    }
-                )
+            logger.info("Procesando imagen: %s", image_name)
             
-            # Extract text from response
-            text_response = response.text.strip()
+            image_part, _ = self._prepare_image(image_bytes, image_name)
+            start = time.perf_counter()
+            products = self._extract([config.OCR_PROMPT, image_part], image_name)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record_latency(image_name, elapsed_ms, elapsed_ms)
             
-            # Parse JSON
-            import json
-            try:
-                products = json.loads(text_response)
+            self._cache_store(cache_key, products)
+            return products
+            
+        except Exception as e:
+            logger.error("Error procesando imagen %s: %s", image_name, str(e))
+            return ["ERROR"]
+    
+    def iter_products(self, image: ImageInput, image_name: Optional[str] = None) -> Iterator:
+        """
+        Process a single image, yielding each product as soon as it is available.
+        
+        With streaming enabled, products are parsed from the answer while Gemini
+        is still writing it. Otherwise this yields the items of process_image.
+        
+        Args:
+            image: Path to the image file, or its encoded bytes / a binary buffer
+            image_name: Name used for logging and stats (default: the file or buffer name)
+        
+        Yields:
+            Product dicts, or a single ERROR / NO_DETECTADO entry
+        """
+        if self.stream and not self.demo_mode:
+            yield from self._stream_products(image, image_name or self.image_name(image))
+        else:
+            yield from self.process_image(image, image_name)
+    
+    def _stream_products(self, image: ImageInput, image_name: str) -> Iterator:
+        """
+        Stream one image's answer through an incremental JSON array parser.
+        
+        Products are yielded as they arrive, translated from the compact
+        response keys; entries without a name are never yielded. With model
+        tiers, a doubtful answer goes to the next tier only if none of its
+        products were yielded yet: products already passed on cannot be taken
+        back, so a second answer could only pile more on top of them.
+        
+        If the stream breaks after some products were yielded, those are kept
+        and the image is not cached.
+        
+        Args:
+            image: Path to the image file, or its encoded bytes / a binary buffer
+            image_name: Name used for logging and stats
+        
+        Yields:
+            Product dicts, or a single ERROR / NO_DETECTADO entry
+        """
+        products = []
+        try:
+            image_bytes = self._read_image(image)
+            boxes = self._plan_tiles(image_bytes, image_name)
+            
+            # Check the persistent cache before calling Gemini
+            cache_key, cached = self._cache_lookup(image_bytes, image_name, tiles=len(boxes))
+            if cached is not None:
+                yield from cached
+                return
+            
+            if boxes:
+                yield from self._iter_tiles(image_bytes, image_name, boxes, cache_key)
+                return
+            
+            logger.info("Procesando imagen (streaming): %s", image_name)
+            
+            image_part, _ = self._prepare_image(image_bytes, image_name)
+            contents = [config.OCR_PROMPT, image_part]
+            start = time.perf_counter()
+            first_ms = None
+            
+            for tier, model in enumerate(self.tiers):
+                last = tier == len(self.tiers) - 1
+                parser = JSONArrayStream()
+                chunks = []
+                answer = []  # This tier's complete answer, including held-back products
+                tier_start = time.perf_counter()
                 
-                if not isinstance(products, list):
-                    logger.warning("Gemini no devolvió una lista JSON: %s", text_response)
-                    return [{"nombre": "ERROR", "error": "Formato inválido"}]
+                try:
+                    for chunk in self._call_stream(contents, model):
+                        chunks.append(chunk)
+                        for item in parser.feed(chunk):
+                            product = self._expand_product(item)
+                            answer.append(product)
+                            if not self._has_name(product):
+                                continue
+                            if first_ms is None:
+                                first_ms = (time.perf_counter() - start) * 1000
+                            products.append(product)
+                            yield product
+                except Exception as e:
+                    self._record_tier(model, (time.perf_counter() - tier_start) * 1000)
+                    if last or products:
+                        raise
+                    self._record_escalation(model, image_name, self.tiers[tier + 1], f"error: {e}")
+                    continue
                 
-                if not products:
-                    logger.warning("No se detectaron productos en: %s", image_path.name)
-                    return [{"nombre": "NO_DETECTADO"}]
+                self._record_tier(model, (time.perf_counter() - tier_start) * 1000)
                 
-                logger.info("Productos detectados: %d", len(products))
-                return products
+                if not parser.started:
+                    # Not a JSON array: let the regular parser report what came back
+                    answer = self._parse_response("".join(chunks).strip(), image_name)
+                    reason = self._escalation_reason(answer)
+                elif not parser.closed:
+                    reason = "respuesta incompleta"
+                elif not answer:
+                    reason = "sin productos"
+                else:
+                    reason = self._escalation_reason(answer)
                 
-            except json.JSONDecodeError as e:
-                logger.error("Error parseando JSON de Gemini: %s\nText: %s", str(e), text_response)
-                return [{"nombre": "ERROR", "error": "JSON inválido"}]
+                if reason is not None and not last:
+                    if products:
+                        logger.info(
+                            "No se escala %s (%s): ya se entregaron %d productos",
+                            image_name, reason, len(products)
+                        )
+                        break
+                    self._record_escalation(model, image_name, self.tiers[tier + 1], reason)
+                    continue
+                break
+            
+            total_ms = (time.perf_counter() - start) * 1000
+            self._record_latency(image_name, first_ms if first_ms is not None else total_ms, total_ms)
             
+            if not parser.started:
+                if products:
+                    return
+                products = self._drop_nameless(answer)
+                yield from products
+            elif not parser.closed:
+                logger.warning(
+                    "Respuesta incompleta de Gemini para %s: %d productos recibidos",
+                    image_name, len(products)
+                )
+                if not products:
+                    yield {"nombre": "ERROR", "error": "Respuesta incompleta"}
+                return
+            elif not answer:
+                logger.warning("No se detectaron productos en: %s", image_name)
+                products = [{"nombre": "NO_DETECTADO"}]
+                yield products[0]
+            elif not products:
+                # Every entry lacked a name: an ERROR, as in the non-streamed path
+                products = self._drop_nameless(answer)
+                yield from products
+            else:
+                logger.info("Productos detectados: %d", len(products))
+            
+            self._cache_store(cache_key, products)
+        
         except Exception as e:
-            logger.error("Error procesando imagen %s: %s", image_path.name, str(e))
-            return ["ERROR"]
+            logger.error("Error procesando imagen %s: %s", image_name, str(e))
+            if not products:
+                yield "ERROR"
     
-    def process_batch(self, image_paths: list[Path]) -> dict[Path, str]:
+    @staticmethod
+    def image_name(image: ImageInput) -> str:
         """
-        Process multiple images and return a dictionary of results.
+        Name of an image input, for logs, stats and the "imagen" column.
+        
+        Args:
+            image: Path, buffer with a name attribute, or raw bytes
+        
+        Returns:
+            File or buffer name, or "imagen" for anonymous bytes
+        """
+        if isinstance(image, (str, Path)):
+            return Path(image).name
+        name = getattr(image, "name", None)
+        return Path(name).name if isinstance(name, str) and name else "imagen"
+    
+    @staticmethod
+    def _read_image(image: ImageInput) -> bytes:
+        """
+        Get the encoded bytes of an image input.
+        
+        In-memory inputs are used as they are: bytes are not copied, and
+        BytesIO-based buffers (such as Streamlit uploads) hand over their
+        contents without a copy while they are not written to.
+        
+        Args:
+            image: Path to the image file, encoded bytes, or a binary buffer
+        
+        Returns:
+            Encoded image bytes
+        """
+        if isinstance(image, bytes):
+            return image
+        if isinstance(image, (bytearray, memoryview)):
+            return bytes(image)
+        if isinstance(image, (str, Path)):
+            return Path(image).read_bytes()
+        if hasattr(image, "getvalue"):
+            return image.getvalue()
+        image.seek(0)
+        return image.read()
+    
+    def process_pack(self, image_paths: list[Path]) -> dict[Path, list]:
+        """
+        Process several images with as few Gemini requests as possible.
+        
+        Images are grouped up to pack_size per request and pack_max_bytes of
+        upload payload. Each product is tagged by Gemini with the index of its
+        source image so results can be attributed per file.
         
         Args:
             image_paths: List of paths to image files
             
         Returns:
-            Dictionary mapping image paths to extracted product names
+            Dictionary mapping image paths to extracted products, in input order
         """
+        if self.demo_mode or len(image_paths) == 1:
+            return {image_path: self.process_image(image_path) for image_path in image_paths}
+        
         results = {}
+        pending = []  # (image_path, cache_key, image_part, payload_bytes)
         
         for image_path in image_paths:
-            results[image_path] = self.process_image(image_path)
+            try:
+                image_bytes = image_path.read_bytes()
+                if self._plan_tiles(image_bytes, image_path.name):
+                    # Panoramas already take one request per tile
+                    results[image_path] = self.process_image(image_path)
+                    continue
+                
+                cache_key, cached = self._cache_lookup(image_bytes, image_path.name)
+                if cached is not None:
+                    results[image_path] = cached
+                    continue
+                
+                image_part, payload_bytes = self._prepare_image(image_bytes, image_path.name)
+                pending.append((image_path, cache_key, image_part, payload_bytes))
+            except Exception as e:
+                logger.error("Error procesando imagen %s: %s", image_path.name, str(e))
+                results[image_path] = ["ERROR"]
+        
+        for group in self._split_pack(pending):
+            results.update(self._process_pack_request(group))
+        
+        return {image_path: results[image_path] for image_path in image_paths}
+    
+    def _split_pack(self, pending: list) -> list[list]:
+        """
+        Split prepared images into request groups bounded by count and payload size.
+        
+        Args:
+            pending: List of (image_path, cache_key, image_part, payload_bytes)
+            
+        Returns:
+            List of groups, each sent as one Gemini request
+        """
+        groups = []
+        current = []
+        current_bytes = 0
+        
+        for item in pending:
+            payload_bytes = item[3]
+            if current and (
+                len(current) >= self.pack_size
+                or current_bytes + payload_bytes > config.OCR_PACK_MAX_BYTES
+            ):
+                groups.append(current)
+                current = []
+                current_bytes = 0
+            current.append(item)
+            current_bytes += payload_bytes
+        
+        if current:
+            groups.append(current)
+        return groups
+    
+    def _process_pack_request(self, group: list) -> dict[Path, list]:
+        """
+        Send one group of images in a single Gemini request.
+        
+        Falls back to one request per image (cached on their own) if the packed
+        answer cannot be parsed or attributed to every image.
+        
+        Args:
+            group: List of (image_path, cache_key, image_part, payload_bytes)
+            
+        Returns:
+            Dictionary mapping each image path in the group to its products
+        """
+        if len(group) == 1:
+            image_path, cache_key, image_part, _ = group[0]
+            logger.info("Procesando imagen: %s", image_path.name)
+            start = time.perf_counter()
+            products = self._extract([config.OCR_PROMPT, image_part], image_path.name)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record_latency(image_path.name, elapsed_ms, elapsed_ms)
+            self._cache_store(cache_key, products)
+            return {image_path: products}
+        
+        names = [image_path.name for image_path, _, _, _ in group]
+        logger.info("Procesando %d imágenes en una petición: %s", len(group), ", ".join(names))
+        
+        prompt = config.OCR_PROMPT + config.OCR_PACK_PROMPT.format(count=len(group), last=len(group) - 1)
+        contents = [prompt]
+        for index, (_, _, image_part, _) in enumerate(group):
+            contents.extend([f"Imagen {index}:", image_part])
+        
+        per_image = None
+        model = self.tiers[0]
+        start = time.perf_counter()
+        try:
+            # Packed answers are much slower than single ones, so they are not hedged
+            text_response = self._generate(contents, model, schema=config.OCR_PACK_RESPONSE_SCHEMA)
+            per_image = self._parse_packed_response(text_response, names)
+        except Exception as e:
+            logger.error("Error en petición agrupada (%s): %s", ", ".join(names), str(e))
+        self._record_tier(model, (time.perf_counter() - start) * 1000, images=len(group))
+        
+        if per_image is None:
+            logger.warning("Reintentando %d imágenes por separado", len(group))
+            return {image_path: self.process_image(image_path) for image_path, _, _, _ in group}
         
+        results = {}
+        for (image_path, cache_key, image_part, _), products in zip(group, per_image):
+            # The packed answer came from the first tier; doubtful images go up alone
+            reason = self._escalation_reason(products) if len(self.tiers) > 1 else None
+            if reason is not None:
+                self._record_escalation(model, image_path.name, self.tiers[1], reason)
+                try:
+                    products = self._extract([config.OCR_PROMPT, image_part], image_path.name, self.tiers[1:])
+                except Exception as e:
+                    logger.error("Error procesando imagen %s: %s", image_path.name, str(e))
+            products = self._drop_nameless(products)
+            self._cache_store(cache_key, products)
+            results[image_path] = products
         return results
     
+    def _parse_packed_response(self, text_response: str, image_names: list[str]) -> Optional[list[list]]:
+        """
+        Parse a packed JSON answer and split products by source image index.
+        
+        Args:
+            text_response: Raw response text
+            image_names: Names of the images in request order
+            
+        Returns:
+            One product list per image, or None if the answer is unusable, has a
+            product that cannot be attributed, or leaves an image without products
+        """
+        try:
+            products = json.loads(text_response)
+        except json.JSONDecodeError as e:
+            logger.error("Error parseando JSON de Gemini: %s\nText: %s", str(e), text_response)
+            return None
+        
+        if not isinstance(products, list):
+            logger.warning("Gemini no devolvió una lista JSON: %s", text_response)
+            return None
+        
+        per_image = [[] for _ in image_names]
+        for item in products:
+            product = self._expand_product(item)
+            if not self._has_name(product):
+                continue
+            
+            index = product.pop("imagen", None)
+            try:
+                index = int(index)
+            except (TypeError, ValueError):
+                index = -1
+            
+            if not 0 <= index < len(image_names):
+                logger.warning("Producto sin índice de imagen válido: %s", product.get("nombre", ""))
+                return None
+            per_image[index].append(product)
+        
+        # An image left empty may have had its products filed under a neighbour
+        empty = [image_name for index, image_name in enumerate(image_names) if not per_image[index]]
+        if empty:
+            logger.warning("Respuesta agrupada sin productos para: %s", ", ".join(empty))
+            return None
+        
+        for index, image_name in enumerate(image_names):
+            logger.info("Productos detectados en %s: %d", image_name, len(per_image[index]))
+        
+        return per_image
+    
+    def _cache_lookup(self, image_bytes: bytes, image_name: str, tiles: int = 0) -> tuple[Optional[str], Optional[list]]:
+        """
+        Look up an image in the persistent cache.
+        
+        Args:
+            image_bytes: Raw bytes of the image file
+            image_name: Name used for logging
+            tiles: Number of tiles the image is cut into (0 = read whole)
+            
+        Returns:
+            Tuple of (cache key or None if caching is off, cached products or None)
+        """
+        if self.cache is None:
+            return None, None
+        
+        variant = self._cache_variant()
+        if tiles:
+            variant += f"|teselas:{tiles}:{config.OCR_TILE_OVERLAP}"
+        cache_key = OCRCache.make_key(image_bytes, model=" -> ".join(self.tiers), variant=variant)
+        if self.refresh_cache:
+            return cache_key, None
+        
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info("Imagen en caché: %s (%d productos)", image_name, len(cached))
+        return cache_key, cached
+    
+    def _cache_store(self, cache_key: Optional[str], products: list):
+        """Store a successful OCR result in the persistent cache."""
+        if cache_key is not None and not self.is_error(products):
+            self.cache.put(cache_key, products)
+    
+    def _plan_tiles(self, image_bytes: bytes, image_name: str) -> list:
+        """
+        Decide whether an image is a panorama to read in tiles.
+        
+        Args:
+            image_bytes: Raw bytes of the image file
+            image_name: Name used for logging
+        
+        Returns:
+            Crop boxes from plan_tiles, or an empty list to read the image whole
+        """
+        if not self.tile:
+            return []
+        try:
+            return plan_tiles(upright_size(image_bytes), tile_size=self.max_dimension)
+        except Exception as e:
+            # Unreadable images are reported by the regular path
+            logger.debug("No se pudo leer el tamaño de %s: %s", image_name, str(e))
+            return []
+    
+    def _iter_tiles(
+        self,
+        image_bytes: bytes,
+        image_name: str,
+        boxes: list,
+        cache_key: Optional[str]
+    ) -> Iterator:
+        """
+        Read a panorama tile by tile and merge the products of all tiles.
+        
+        Tiles are sent to Gemini concurrently (the key pool bounds the calls).
+        A product seen in the overlap of two tiles is merged by barcode or
+        normalized name (fuzzy matching would also merge sizes and flavours
+        of one line) and filed under the original image. Products are
+        yielded in reading order once every tile has answered, so a later
+        tile can still fill in fields and streamed consumers get the same
+        products as process_image and the cache. If some tiles fail, the
+        products of the others are kept and the image is not cached.
+        
+        Args:
+            image_bytes: Raw bytes of the image file
+            image_name: Name of the original image
+            boxes: Crop boxes from plan_tiles
+            cache_key: Key to store the merged result under, or None
+        
+        Yields:
+            Product dicts, or a single ERROR / NO_DETECTADO entry
+        """
+        logger.info("Procesando imagen en %d teselas: %s", len(boxes), image_name)
+        start = time.perf_counter()
+        # Tiles that fit the upload size are sent as cropped, so crop them at the upload quality
+        tiles = crop_tiles(image_bytes, boxes, quality=self.image_quality if self.preprocess else None)
+        
+        def read_tile(index, tile_bytes):
+            tile_name = f"{image_name}#t{index + 1}"
+            image_part, _ = self._prepare_image(tile_bytes, tile_name)
+            return self._extract([config.OCR_PROMPT, image_part], tile_name)
+        
+        merger = ProductDeduplicator()
+        kept = []  # (tile index, product)
+        failed = 0
+        
+        executor = ThreadPoolExecutor(max_workers=len(tiles), thread_name_prefix="tile")
+        try:
+            futures = {executor.submit(read_tile, index, tile_bytes): index for index, tile_bytes in enumerate(tiles)}
+            for future in as_completed(futures):
+                try:
+                    tile_products = future.result()
+                except Exception as e:
+                    logger.error("Error procesando tesela %d de %s: %s", futures[future] + 1, image_name, str(e))
+                    tile_products = ["ERROR"]
+                if self.is_error(tile_products):
+                    failed += 1
+                    continue
+                
+                for product in tile_products:
+                    if not self._has_name(product):
+                        continue
+                    product = merger.add(image_name, product)
+                    if product is not None:
+                        kept.append((futures[future], product))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        total_ms = (time.perf_counter() - start) * 1000
+        self._record_latency(image_name, total_ms, total_ms)
+        with self._stats_lock:
+            self.tile_stats["imagenes"] += 1
+            self.tile_stats["teselas"] += len(tiles)
+            self.tile_stats["fallidas"] += failed
+            self.tile_stats["repetidos"] += merger.duplicates
+        
+        if failed == len(tiles):
+            yield {"nombre": "ERROR", "error": "Fallaron todas las teselas"}
+            return
+        
+        # Merged entries in reading order, with the fields later tiles filled in
+        kept.sort(key=lambda entry: entry[0])
+        products = [{key: value for key, value in product.items() if key != "imagenes"} for _, product in kept]
+        if not products:
+            logger.warning("No se detectaron productos en: %s", image_name)
+            products = [{"nombre": "NO_DETECTADO"}]
+        else:
+            logger.info(
+                "Productos detectados en %s: %d (%d repetidos entre teselas)",
+                image_name, len(products), merger.duplicates
+            )
+        yield from products
+        
+        if failed:
+            logger.warning("%d de %d teselas fallaron en %s; resultado parcial sin guardar en caché", failed, len(tiles), image_name)
+        else:
+            self._cache_store(cache_key, products)
+    
+    def _prepare_image(self, image_bytes: bytes, image_name: str):
+        """
+        Turn raw image bytes into a content part for Gemini.
+        
+        Args:
+            image_bytes: Raw bytes of the image file
+            image_name: Name used for logging and stats
+            
+        Returns:
+            Tuple of (content part accepted by the installed Gemini SDK, payload size in bytes)
+        """
+        if not self.preprocess:
+            image = Image.open(BytesIO(image_bytes))
+            
+            # Formats Gemini decodes itself go up as they are, without decoding them here
+            mime_type = SOURCE_MIME_TYPES.get(image.format)
+            if mime_type is not None:
+                return self._image_part(image_bytes, mime_type), len(image_bytes)
+            
+            # Convert to RGB if necessary
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            return image, len(image_bytes)
+        
+        result = preprocess_image(
+            image_bytes,
+            max_dimension=self.max_dimension,
+            image_format=self.image_format,
+            quality=self.image_quality
+        )
+        
+        stats = {key: value for key, value in result.items() if key != "data"}
+        with self._stats_lock:
+            totals = self.preprocess_stats
+            totals["imagenes"] += 1
+            totals["sin_recodificar"] += 1 if stats.get("passthrough") else 0
+            totals["bytes_antes"] += stats["bytes_before"]
+            totals["bytes_despues"] += stats["bytes_after"]
+            totals["tiempo_ms"] += stats["elapsed_ms"]
+        
+        logger.debug(
+            "Imagen %s preprocesada: %d KB -> %d KB (%dx%d) en %.0f ms",
+            image_name,
+            result["bytes_before"] // 1024,
+            result["bytes_after"] // 1024,
+            result["size"][0],
+            result["size"][1],
+            result["elapsed_ms"]
+        )
+        
+        return self._image_part(result["data"], result["mime_type"]), result["bytes_after"]
+    
+    @staticmethod
+    def _image_part(data: bytes, mime_type: str):
+        """Wrap encoded image bytes in the content part type of the installed Gemini SDK."""
+        if USE_NEW_PACKAGE:
+            return types.Part.from_bytes(data=data, mime_type=mime_type)
+        return {"mime_type": mime_type, "data": data}
+    
+    def _generate(
+        self,
+        contents: list,
+        model: Optional[str] = None,
+        schema: Optional[dict] = None,
+        clock: Optional[AttemptClock] = None
+    ) -> str:
+        """
+        Call Gemini and return the raw response text, retrying throttled calls.
+        
+        Args:
+            contents: Prompt and image parts
+            model: Model name (default: config.GEMINI_MODEL)
+            schema: Response schema (default: config.OCR_RESPONSE_SCHEMA)
+            clock: Hedged attempt to report sends and backoffs to; once it is
+                abandoned, no further request is sent
+        
+        Returns:
+            Response text, stripped
+        
+        Raises:
+            CancelledError: If the hedged attempt was abandoned before its request was sent
+            Exception: The Gemini error, if it is not a throttle or retries ran out
+        """
+        for attempt in range(config.OCR_MAX_RETRIES + 1):
+            key, ticket = self._acquire_for(clock)
+            try:
+                text = self._request(contents, key, model or config.GEMINI_MODEL, schema or config.OCR_RESPONSE_SCHEMA)
+            except Exception as e:
+                if clock is not None:
+                    clock.pause()
+                if not self._retry_throttled(key, ticket, e, attempt, clock=clock):
+                    raise
+                continue
+            self.key_pool.release(key, ticket)
+            return text
+    
+    def _generate_stream(
+        self,
+        contents: list,
+        model: Optional[str] = None,
+        clock: Optional[AttemptClock] = None
+    ) -> Iterator[str]:
+        """
+        Call Gemini with a streamed answer, retrying throttled calls.
+        
+        A call is only retried if it failed before any text arrived, so
+        callers never see the same chunk twice.
+        
+        Args:
+            contents: Prompt and image parts
+            model: Model name (default: config.GEMINI_MODEL)
+            clock: Hedged attempt to report sends and backoffs to; once it is
+                abandoned, no further request is sent
+        
+        Yields:
+            Response text chunks as they arrive
+        
+        Raises:
+            CancelledError: If the hedged attempt was abandoned before its request was sent
+            Exception: The Gemini error, if it cannot be retried
+        """
+        for attempt in range(config.OCR_MAX_RETRIES + 1):
+            key, ticket = self._acquire_for(clock)
+            released = False
+            received = False
+            try:
+                for chunk in self._request_stream(contents, key, model or config.GEMINI_MODEL, config.OCR_RESPONSE_SCHEMA):
+                    received = True
+                    yield chunk
+            except Exception as e:
+                released = True
+                if clock is not None and not received:
+                    clock.pause()
+                if not self._retry_throttled(key, ticket, e, attempt, can_retry=not received, clock=clock):
+                    raise
+                continue
+            finally:
+                # Also runs when the consumer stops reading early
+                if not released:
+                    self.key_pool.release(key, ticket)
+            return
+    
+    def _acquire_for(self, clock: Optional[AttemptClock]) -> tuple[GeminiKey, int]:
+        """
+        Take a key pool slot for a request, starting a hedged attempt's clock once it has one.
+        
+        Raises:
+            CancelledError: If the attempt was abandoned while it waited for the slot
+        """
+        if clock is not None and clock.abandoned.is_set():
+            raise CancelledError()
+        key, ticket = self.key_pool.acquire()
+        if clock is not None:
+            if clock.abandoned.is_set():
+                self.key_pool.release(key, ticket)
+                raise CancelledError()
+            clock.start()
+        return key, ticket
+    
+    def _call(self, contents: list, model: str) -> str:
+        """
+        Call Gemini for one image, hedging slow calls when enabled.
+        
+        Once a request has been in flight longer than the hedge delay, a
+        duplicate is sent and the first answer wins (see HedgedCalls.call).
+        Time spent waiting for a key pool slot or backing off after a
+        throttle does not count. A losing request that already reached
+        Gemini cannot be interrupted; its answer is discarded and the SDK
+        timeout (OCR_CALL_DEADLINE) bounds it.
+        
+        Args:
+            contents: Prompt and image parts
+            model: Model name
+        
+        Returns:
+            Response text, stripped
+        
+        Raises:
+            TimeoutError: If no sent request answered within OCR_CALL_DEADLINE
+            Exception: The Gemini error, if every attempt failed
+        """
+        if not self.hedge:
+            return self._generate(contents, model)
+        return self.hedger.call(lambda clock: self._generate(contents, model, clock=clock), model)
+    
+    def _call_stream(self, contents: list, model: str) -> Iterator[str]:
+        """
+        Stream a Gemini answer for one image, hedging a slow start when enabled.
+        
+        If no text has arrived after the hedge delay, counted from when the
+        request was sent, a duplicate stream is opened and the first stream
+        to produce text wins (see HedgedCalls.stream). The other one is
+        closed at its next chunk, which frees its key pool slot, or gives up
+        before sending if it is still waiting for one.
+        
+        Args:
+            contents: Prompt and image parts
+            model: Model name
+        
+        Yields:
+            Response text chunks of the winning stream
+        
+        Raises:
+            TimeoutError: If the answer did not finish within OCR_CALL_DEADLINE of being sent
+            Exception: The Gemini error, if every attempt failed
+        """
+        if not self.hedge:
+            yield from self._generate_stream(contents, model)
+            return
+        yield from self.hedger.stream(
+            lambda clock: self._generate_stream(contents, model, clock=clock), f"{model} (streaming)"
+        )
+    
+    def _retry_throttled(
+        self,
+        key: GeminiKey,
+        ticket: int,
+        error: Exception,
+        attempt: int,
+        can_retry: bool = True,
+        clock: Optional[AttemptClock] = None
+    ) -> bool:
+        """
+        Release a failed call's slot and wait before retrying it if Gemini throttled it.
+        
+        With several keys the retry goes straight to another key; the
+        throttled one is benched by the pool.
+        
+        Args:
+            key: Key the failed call used
+            ticket: Limiter ticket of the failed call
+            error: Exception raised by the call
+            attempt: Retries already made for this request
+            can_retry: False if the call cannot be repeated safely
+            clock: Hedged attempt making the call; the backoff ends early if it is abandoned
+        
+        Returns:
+            True if the caller should retry, False if it should raise the error
+        """
+        throttled = self._is_throttled(error)
+        delay = self._retry_after(error) if throttled else None
+        self.key_pool.release(key, ticket, throttled=throttled, retry_after=delay)
+        
+        if not throttled:
+            return False
+        if not can_retry or attempt >= config.OCR_MAX_RETRIES:
+            with self._stats_lock:
+                self.throttle_failures += 1
+            return False
+        
+        if len(self.key_pool) > 1:
+            delay = 0.0
+        elif delay is None:
+            # Full jitter: random delay up to the exponential cap, unless Gemini says otherwise
+            delay = random.uniform(0, min(config.OCR_BACKOFF_MAX, config.OCR_BACKOFF_BASE * 2 ** attempt))
+        
+        with self._stats_lock:
+            self.retries += 1
+        logger.warning(
+            "Gemini limitó la petición en la %s (%s), reintento %d/%d en %.1f s, concurrencia %d",
+            key.label, self._status_code(error) or "sin código", attempt + 1, config.OCR_MAX_RETRIES,
+            delay, key.limiter.limit
+        )
+        if clock is not None:
+            clock.abandoned.wait(delay)
+        else:
+            time.sleep(delay)
+        return True
+    
+    @staticmethod
+    def _status_code(error: Exception) -> Optional[int]:
+        """
+        Get the HTTP status of a Gemini SDK error.
+        
+        Args:
+            error: Exception raised by the SDK
+        
+        Returns:
+            Status code, or None if the error does not carry one
+        """
+        for attr in ("code", "status_code"):
+            value = getattr(error, attr, None)
+            if isinstance(value, int):
+                return int(value)
+        
+        value = getattr(getattr(error, "response", None), "status_code", None)
+        return int(value) if isinstance(value, int) else None
+    
+    @staticmethod
+    def _is_throttled(error: Exception) -> bool:
+        """
+        Check whether a Gemini error means "over quota" or "overloaded".
+        
+        Args:
+            error: Exception raised by the SDK
+        
+        Returns:
+            True for 429 / 503 (RESOURCE_EXHAUSTED / UNAVAILABLE) errors
+        """
+        code = OCRProcessor._status_code(error)
+        if code is not None:
+            return code in THROTTLE_STATUS_CODES
+        
+        text = str(error)
+        return (
+            "RESOURCE_EXHAUSTED" in text
+            or "UNAVAILABLE" in text
+            or re.search(r"\b(429|503)\b", text) is not None
+        )
+    
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """
+        Read the wait Gemini asked for, from the Retry-After header or the error's retry delay.
+        
+        Args:
+            error: Throttled SDK error
+        
+        Returns:
+            Seconds to wait, or None if the error does not say
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        value = headers.get("Retry-After") if headers is not None else None
+        if value:
+            try:
+                return min(max(float(value), 0.0), config.OCR_BACKOFF_MAX)
+            except ValueError:
+                pass
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+                return min(max(delay, 0.0), config.OCR_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+        
+        match = _RETRY_DELAY_PATTERN.search(str(error))
+        if match:
+            return min(float(match.group(1)), config.OCR_BACKOFF_MAX)
+        return None
+    
+    def _request(self, contents: list, key: GeminiKey, model: str, schema: dict) -> str:
+        """
+        Send one Gemini request and return the raw response text.
+        
+        Args:
+            contents: Prompt and image parts
+            key: Pool key to send it with
+            model: Model name
+            schema: Response schema the answer must follow
+        
+        Returns:
+            Response text, stripped
+        """
+        if USE_NEW_PACKAGE:
+            response = key.client.models.generate_content(
+                model=self.models[model],
+                contents=contents,
+                config=self._generation_config(schema)
+            )
+        else:
+            response = self.models[model].generate_content(
+                contents,
+                generation_config=self._generation_config(schema),
+                request_options=self._request_options()
+            )
+        
+        self._record_tokens(model, getattr(response, "usage_metadata", None))
+        return response.text.strip()
+    
+    def _request_stream(self, contents: list, key: GeminiKey, model: str, schema: dict) -> Iterator[str]:
+        """
+        Send one streamed Gemini request.
+        
+        Args:
+            contents: Prompt and image parts
+            key: Pool key to send it with
+            model: Model name
+            schema: Response schema the answer must follow
+        
+        Yields:
+            Response text chunks as they arrive
+        """
+        if USE_NEW_PACKAGE:
+            response = key.client.models.generate_content_stream(
+                model=self.models[model],
+                contents=contents,
+                config=self._generation_config(schema)
+            )
+        else:
+            response = self.models[model].generate_content(
+                contents,
+                generation_config=self._generation_config(schema),
+                request_options=self._request_options(),
+                stream=True
+            )
+        
+        usage = None
+        for chunk in response:
+            # Every chunk carries the running totals; the last one has the final count
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                yield chunk.text
+        self._record_tokens(model, usage)
+    
+    @staticmethod
+    def _generation_config(schema: dict):
+        """Generation settings, with the response schema, in the form the installed Gemini SDK expects."""
+        if USE_NEW_PACKAGE:
+            return types.GenerateContentConfig(
+                temperature=config.GEMINI_TEMPERATURE,
+                max_output_tokens=config.GEMINI_MAX_TOKENS,
+                response_mime_type="application/json",
+                response_schema=schema,
+                # Per-call deadline, in milliseconds; the SDK cancels the HTTP request
+                http_options=types.HttpOptions(timeout=int(config.OCR_CALL_DEADLINE * 1000))
+                if config.OCR_CALL_DEADLINE else None
+            )
+        return {
+            "max_output_tokens": config.GEMINI_MAX_TOKENS,
+            "temperature": config.GEMINI_TEMPERATURE,
+            "response_mime_type": "application/json",
+            # google.generativeai's schema type has no property ordering
+            "response_schema": OCRProcessor._without_ordering(schema)
+        }
+    
+    @staticmethod
+    def _without_ordering(schema):
+        """Copy of a response schema without "propertyOrdering" keys."""
+        if isinstance(schema, dict):
+            return {
+                key: OCRProcessor._without_ordering(value)
+                for key, value in schema.items() if key != "propertyOrdering"
+            }
+        if isinstance(schema, list):
+            return [OCRProcessor._without_ordering(value) for value in schema]
+        return schema
+    
+    @staticmethod
+    def _request_options() -> dict:
+        """Per-call deadline for google.generativeai, in seconds."""
+        return {"timeout": config.OCR_CALL_DEADLINE} if config.OCR_CALL_DEADLINE else {}
+    
+    def _record_latency(self, image_name: str, first_product_ms: float, total_ms: float):
+        """Record how long a Gemini call took to produce its first product and to finish."""
+        with self._stats_lock:
+            self.latency_stats["peticiones"] += 1
+            self.latency_stats["primer_producto_ms"] += first_product_ms
+            self.latency_stats["total_ms"] += total_ms
+            self._latency_window.append((first_product_ms, total_ms))
+    
+    def _extract(self, contents: list, image_name: str, tiers: Optional[list[str]] = None) -> list:
+        """
+        Ask each model tier in turn until one gives a plausible answer.
+        
+        Args:
+            contents: Prompt and image parts for one image
+            image_name: Name used for logging
+            tiers: Models to try, cheapest first (default: self.tiers)
+        
+        Returns:
+            Parsed product list from the first tier that was not escalated
+        
+        Raises:
+            Exception: The Gemini error of the last tier
+        """
+        tiers = tiers or self.tiers
+        for tier, model in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            start = time.perf_counter()
+            try:
+                text_response = self._call(contents, model)
+            except Exception as e:
+                self._record_tier(model, (time.perf_counter() - start) * 1000)
+                if last:
+                    raise
+                self._record_escalation(model, image_name, tiers[tier + 1], f"error: {e}")
+                continue
+            self._record_tier(model, (time.perf_counter() - start) * 1000)
+            
+            products = self._parse_response(text_response, image_name)
+            reason = None if last else self._escalation_reason(products)
+            if reason is None:
+                return self._drop_nameless(products)
+            self._record_escalation(model, image_name, tiers[tier + 1], reason)
+    
+    @staticmethod
+    def _expand_product(item) -> dict:
+        """
+        Translate one answer entry from the compact response keys and validate it.
+        
+        Long field names are accepted too, so cached and older answers
+        pass through unchanged. Every field becomes a stripped string,
+        unknown categories become "" and unknown keys are dropped; an entry
+        without a name keeps "nombre": "" so tiering can still escalate it.
+        
+        Args:
+            item: Parsed JSON element
+        
+        Returns:
+            Product dict with nombre, detalle, proveedor and categoria
+            (plus imagen for packed answers)
+        """
+        if isinstance(item, str):
+            item = {"nombre": item}
+        elif not isinstance(item, dict):
+            item = {}
+        
+        product = {}
+        for key, field in config.OCR_FIELDS.items():
+            value = item.get(key, item.get(field))
+            product[field] = value.strip() if isinstance(value, str) else ("" if value is None else str(value))
+        if product["categoria"] not in config.OCR_CATEGORIES:
+            product["categoria"] = ""
+        
+        index = item.get("i", item.get("imagen"))
+        if index is not None:
+            product["imagen"] = index
+        return product
+    
+    @staticmethod
+    def _drop_nameless(products: list) -> list:
+        """
+        Remove entries that failed validation for lack of a name.
+        
+        Args:
+            products: Parsed product list
+        
+        Returns:
+            The named products, the list itself if it is an ERROR / NO_DETECTADO
+            marker, or an ERROR entry if no product had a name
+        """
+        if not products or not isinstance(products[0], dict) or products[0].get("nombre") in ("ERROR", "NO_DETECTADO"):
+            return products
+        
+        named = [product for product in products if OCRProcessor._has_name(product)]
+        if len(named) < len(products):
+            logger.warning("%d productos descartados por no tener nombre", len(products) - len(named))
+        return named or [{"nombre": "ERROR", "error": "Formato inválido"}]
+    
+    @staticmethod
+    def _has_name(product) -> bool:
+        """Check whether an OCR entry is a product dict with a usable name."""
+        if not isinstance(product, dict):
+            return False
+        name = product.get("nombre")
+        return isinstance(name, str) and bool(name.strip()) and name not in ("ERROR", "NO_DETECTADO")
+    
+    @staticmethod
+    def _escalation_reason(products: list) -> Optional[str]:
+        """
+        Decide whether a cheaper model's answer should be redone by the next tier.
+        
+        Args:
+            products: Parsed product list
+        
+        Returns:
+            Reason to escalate, or None if the answer looks plausible
+        """
+        if OCRProcessor.is_error(products):
+            return "respuesta inválida"
+        first = products[0]
+        if isinstance(first, dict) and first.get("nombre") == "NO_DETECTADO":
+            return "sin productos"
+        
+        nameless = sum(1 for product in products if not OCRProcessor._has_name(product))
+        if nameless:
+            return f"{nameless} productos sin nombre"
+        
+        # The prompt forbids repeats, so many of them mean the model lost track
+        keys = [ProductDeduplicator.name_key(product) for product in products]
+        repeated = len(keys) - len(set(keys))
+        if repeated and repeated >= config.OCR_ESCALATE_DUPLICATE_RATIO * len(keys):
+            return f"{repeated} duplicados sospechosos"
+        return None
+    
+    def _record_tier(self, model: str, elapsed_ms: float, images: int = 1):
+        """Record one request answered by a model tier."""
+        with self._stats_lock:
+            stats = self.tier_stats[model]
+            stats["peticiones"] += 1
+            stats["imagenes"] += images
+            stats["latencia_total_ms"] += elapsed_ms
+            stats["latencias_ms"].append(elapsed_ms)
+    
+    def _record_escalation(self, model: str, image_name: str, next_model: str, reason: str):
+        """Record and log an image sent up to the next model tier."""
+        with self._stats_lock:
+            self.tier_stats[model]["escaladas"] += 1
+        logger.info("Escalando %s de %s a %s: %s", image_name, model, next_model, reason)
+    
+    def _record_tokens(self, model: str, usage):
+        """Add a response's token usage to its tier."""
+        if usage is None or model not in self.tier_stats:
+            return
+        with self._stats_lock:
+            stats = self.tier_stats[model]
+            stats["tokens_entrada"] += getattr(usage, "prompt_token_count", 0) or 0
+            stats["tokens_salida"] += getattr(usage, "candidates_token_count", 0) or 0
+    
+    def _parse_response(self, text_response: str, image_name: str) -> list:
+        """
+        Parse Gemini's JSON answer into a product list.
+        
+        Args:
+            text_response: Raw response text
+            image_name: Name used for logging
+            
+        Returns:
+            List of product dicts (with result field names), [{"nombre": "NO_DETECTADO"}]
+            or an ERROR entry
+        """
+        try:
+            products = json.loads(text_response)
+        except json.JSONDecodeError as e:
+            logger.error("Error parseando JSON de Gemini: %s\nText: %s", str(e), text_response)
+            return [{"nombre": "ERROR", "error": "JSON inválido"}]
+        
+        if not isinstance(products, list):
+            logger.warning("Gemini no devolvió una lista JSON: %s", text_response)
+            return [{"nombre": "ERROR", "error": "Formato inválido"}]
+        
+        products = [self._expand_product(product) for product in products]
+        if not products:
+            logger.warning("No se detectaron productos en: %s", image_name)
+            return [{"nombre": "NO_DETECTADO"}]
+        
+        logger.info("Productos detectados: %d", len(products))
+        return products
+    
+    @staticmethod
+    def is_error(products: list) -> bool:
+        """
+        Check whether a product list is an OCR error marker.
+        
+        Args:
+            products: Result of process_image
+            
+        Returns:
+            True for empty results and ERROR entries
+        """
+        if not products:
+            return True
+        first = products[0]
+        name = first.get("nombre", "") if isinstance(first, dict) else first
+        return name == "ERROR"
+    
+    def _cache_variant(self) -> str:
+        """Describe the settings that change what Gemini sees, for cache keys."""
+        if not self.preprocess:
+            return "original"
+        return preprocess_settings_key(self.max_dimension, self.image_format, self.image_quality)
+    
+    def get_preprocess_summary(self) -> dict:
+        """
+        Get aggregate upload preprocessing statistics.
+        
+        Returns:
+            Dictionary with image count, images sent without re-encoding,
+            bytes before/after and time spent
+        """
+        with self._stats_lock:
+            summary = dict(self.preprocess_stats)
+        
+        bytes_before = summary["bytes_antes"]
+        summary["reduccion"] = (1 - summary["bytes_despues"] / bytes_before) * 100 if bytes_before > 0 else 0
+        return summary
+    
+    def get_latency_summary(self) -> dict:
+        """
+        Get Gemini latency statistics for single-image requests.
+        
+        Without streaming the first product is only available when the whole
+        answer is, so both figures are equal.
+        
+        Returns:
+            Dictionary with request count and mean/p95 time to first product and total, in ms
+            (the p95 covers the last OCR_STATS_WINDOW requests)
+        """
+        with self._stats_lock:
+            totals = dict(self.latency_stats)
+            window = list(self._latency_window)
+        
+        requests = totals["peticiones"]
+        return {
+            "peticiones": requests,
+            "primer_producto_ms": totals["primer_producto_ms"] / requests if requests else 0,
+            "primer_producto_p95_ms": self._p95([s[0] for s in window]),
+            "total_ms": totals["total_ms"] / requests if requests else 0,
+            "total_p95_ms": self._p95([s[1] for s in window]),
+        }
+    
+    @staticmethod
+    def _p95(values: list) -> float:
+        """95th percentile of a list of latencies (0 if empty)."""
+        if len(values) < 2:
+            return values[0] if values else 0
+        return statistics.quantiles(values, n=20)[18]
+    
+    def get_tier_summary(self) -> dict:
+        """
+        Get per-model-tier statistics.
+        
+        Returns:
+            Dictionary mapping each model (cheapest first) to its request and image
+            counts, escalation rate, mean/p95 latency in ms (the p95 over the last
+            OCR_STATS_WINDOW requests) and token usage
+        """
+        with self._stats_lock:
+            tiers = {model: dict(stats, latencias_ms=list(stats["latencias_ms"])) for model, stats in self.tier_stats.items()}
+        
+        summary = {}
+        for model, stats in tiers.items():
+            latencies = stats.pop("latencias_ms")
+            total_ms = stats.pop("latencia_total_ms")
+            stats["tasa_escalado"] = stats["escaladas"] / stats["imagenes"] * 100 if stats["imagenes"] else 0
+            stats["latencia_ms"] = total_ms / stats["peticiones"] if stats["peticiones"] else 0
+            stats["latencia_p95_ms"] = self._p95(latencies)
+            summary[model] = stats
+        return summary
+    
+    def get_hedge_summary(self) -> dict:
+        """
+        Get hedged request statistics.
+        
+        Returns:
+            Dictionary with answered calls, duplicates sent, duplicates that won,
+            and calls abandoned at their deadline
+        """
+        if self.hedger is None:
+            return {"llamadas": 0, "duplicadas": 0, "ganadas": 0, "plazos_vencidos": 0}
+        return self.hedger.stats()
+    
+    def get_tile_summary(self) -> dict:
+        """
+        Get panorama tiling statistics.
+        
+        Returns:
+            Dictionary with tiled images, tiles sent, tiles that failed and
+            products merged across tile overlaps
+        """
+        with self._stats_lock:
+            return dict(self.tile_stats)
+    
+    def get_concurrency_summary(self) -> dict:
+        """
+        Get Gemini concurrency and throttling statistics.
+        
+        Returns:
+            Dictionary with the key pool statistics (summed limits, throttles,
+            per-key counters under "claves"), retries made and requests that
+            stayed throttled
+        """
+        summary = self.key_pool.stats() if self.key_pool is not None else {}
+        with self._stats_lock:
+            summary["reintentos"] = self.retries
+            summary["abandonadas"] = self.throttle_failures
+        return summary
+    
+    def process_batch(self, image_paths: list[Path], max_workers: Optional[int] = None) -> dict[Path, list]:
+        """
+        Process multiple images and return a dictionary of results.
+        
+        Args:
+            image_paths: List of paths to image files
+            max_workers: Worker threads (default: max_concurrency)
+            
+        Returns:
+            Dictionary mapping image paths to extracted products, in input order
+        """
+        return dict(self.iter_batch(image_paths, max_workers=max_workers, ordered=True))
+    
+    def iter_batch(
+        self,
+        image_paths: list[Path],
+        max_workers: Optional[int] = None,
+        ordered: bool = True
+    ) -> Iterator[tuple[Path, list]]:
+        """
+        Process multiple images concurrently, yielding results as they become available.
+        
+        When pack_size > 1, consecutive images are grouped into packed requests.
+        
+        Args:
+            image_paths: List of paths to image files
+            max_workers: Worker threads; the key pool decides how many
+                call Gemini at once (default: max_concurrency)
+            ordered: If True, yield in input order; otherwise yield as each image finishes
+            
+        Yields:
+            Tuples of (image_path, product_list)
+        """
+        # Each job is one Gemini request: a single image, or a pack of them
+        step = self.pack_size if self.pack_size > 1 else 1
+        jobs = [image_paths[i:i + step] for i in range(0, len(image_paths), step)]
+        workers = max(1, min(max_workers or self.max_concurrency, len(jobs)))
+        
+        if workers <= 1:
+            for job in jobs:
+                yield from self._process_job_safe(job).items()
+            return
+        
+        logger.info("Procesando %d imágenes con %d workers", len(image_paths), workers)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+        try:
+            futures = [executor.submit(self._process_job_safe, job) for job in jobs]
+            pending = futures if ordered else as_completed(futures)
+            for future in pending:
+                yield from future.result().items()
+        finally:
+            # Stop queued images if the consumer stops iterating early
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _process_job_safe(self, image_paths: list[Path]) -> dict[Path, list]:
+        """
+        Process one batch job (a single image or a pack), isolating failures.
+        
+        Args:
+            image_paths: Images handled by this job
+            
+        Returns:
+            Dictionary mapping image paths to extracted products
+        """
+        if len(image_paths) == 1:
+            return {image_paths[0]: self._process_image_safe(image_paths[0])}
+        
+        try:
+            return self.process_pack(image_paths)
+        except Exception as e:
+            logger.error("Error procesando grupo de imágenes: %s", str(e))
+            return {image_path: self._process_image_safe(image_path) for image_path in image_paths}
+    
+    def _process_image_safe(self, image_path: Path) -> list:
+        """
+        Process an image, isolating any failure to that image.
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            Product list, or an ERROR entry if processing raised
+        """
+        try:
+            return self.process_image(image_path)
+        except Exception as e:
+            logger.error("Error procesando imagen %s: %s", image_path.name, str(e))
+            return [{"nombre": "ERROR", "error": str(e)}]
+    
     @staticmethod
     def is_valid_image(file_path: Path) -> bool:
         """
@@ -170,12 +1652,14 @@ class OCRProcessor:
         return file_path.suffix.lower() in config.SUPPORTED_IMAGE_EXTENSIONS
     
     @staticmethod
-    def get_images_from_folder(folder_path: Path) -> list[Path]:
+    def get_images_from_folder(folder_path: Path, hash_index: Optional[ImageHashIndex] = None) -> list[Path]:
         """
         Get all valid images from a folder.
         
         Args:
             folder_path: Path to the folder containing images
+            hash_index: Optional ImageHashIndex; the images found are hashed into
+                it (in sorted order) to detect near-duplicate photos
             
         Returns:
             List of paths to valid image files
@@ -189,5 +1673,14 @@ class OCRProcessor:
             if file_path.is_file() and OCRProcessor.is_valid_image(file_path):
                 images.append(file_path)
         
+        images.sort()
         logger.info("Encontradas %d imágenes en %s", len(images), folder_path)
-        return sorted(images)
+        
+        if hash_index is not None:
+            hash_index.add_images([(image_path, image_path) for image_path in images])
+            logger.info(
+                "Hash perceptual de %d imágenes en %.0f ms: %d casi duplicadas",
+                len(images), hash_index.elapsed_ms, len(hash_index.duplicates)
+            )
+        
+        return images
@@ -0,0 +1,185 @@
+"""
+Food Scanner - OCR Cache Module
+Persistent, content-addressed cache of Gemini OCR results
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class OCRCache:
+    """SQLite-backed cache of parsed OCR product lists with size-bounded LRU eviction."""
+    
+    def __init__(self, path: Optional[Path] = None, max_bytes: Optional[int] = None):
+        """
+        Initialize the cache.
+        
+        Args:
+            path: SQLite database file. If not provided, uses config.OCR_CACHE_PATH
+            max_bytes: Maximum total size of stored results (default: config.OCR_CACHE_MAX_BYTES)
+        """
+        self.path = Path(path or config.OCR_CACHE_PATH)
+        self.max_bytes = max_bytes or config.OCR_CACHE_MAX_BYTES
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            "key TEXT PRIMARY KEY, "
+            "products TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache (last_access)"
+        )
+        self._conn.commit()
+        
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+        self._total_bytes = row[0]
+        
+        logger.info("Caché OCR: %s (%.1f MB usados)", self.path, self._total_bytes / 1024 / 1024)
+    
+    @staticmethod
+    def make_key(
+        image_bytes: bytes,
+        model: Optional[str] = None,
+        prompt: Optional[str] = None,
+        variant: str = ""
+    ) -> str:
+        """
+        Build the cache key for an image.
+        
+        Args:
+            image_bytes: Raw bytes of the image file
+            model: Gemini model name (default: config.GEMINI_MODEL)
+            prompt: OCR prompt (default: config.OCR_PROMPT)
+            variant: Extra settings that change the request (e.g. upload preprocessing)
+        
+        Returns:
+            Hex digest identifying image content, model, prompt and variant
+        """
+        model = model or config.GEMINI_MODEL
+        prompt = prompt or config.OCR_PROMPT
+        
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{image_hash}:{model}:{prompt_hash}:{variant}".encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[list]:
+        """
+        Look up a cached product list.
+        
+        Args:
+            key: Cache key from make_key
+        
+        Returns:
+            Cached product list or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT products FROM ocr_cache WHERE key = ?", (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self._conn.execute(
+                "UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        
+        return json.loads(row[0])
+    
+    def put(self, key: str, products: list):
+        """
+        Store a product list, evicting least recently used entries if over budget.
+        
+        Args:
+            key: Cache key from make_key
+            products: Parsed product list from OCR
+        """
+        payload = json.dumps(products, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        
+        if size > self.max_bytes:
+            logger.debug("Resultado OCR demasiado grande para la caché (%d bytes)", size)
+            return
+        
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM ocr_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, products, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time())
+            )
+            self._total_bytes += size
+            self._evict_locked()
+            self._conn.commit()
+    
+    def _evict_locked(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        while self._total_bytes > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT key, size FROM ocr_cache ORDER BY last_access ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self._total_bytes = 0
+                break
+            
+            self._conn.execute("DELETE FROM ocr_cache WHERE key = ?", (row[0],))
+            self._total_bytes -= row[1]
+            self.evictions += 1
+    
+    def stats(self) -> dict:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with hit/miss counters and storage usage
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "tasa_aciertos": (self.hits / lookups * 100) if lookups > 0 else 0
+            }
+    
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self._conn.execute("DELETE FROM ocr_cache")
+            self._conn.commit()
+            self._total_bytes = 0
+        logger.debug("Caché OCR vaciada")
+    
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+        logger.debug("Caché OCR cerrada")
@@ -0,0 +1,205 @@
+"""
+Food Scanner - Open Food Facts Cache Module
+Persistent SQLite cache of Open Food Facts lookups with TTL and negative caching
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import config
+from utils.text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class OpenFoodFactsCache:
+    """Caches parsed search/barcode results, including "not found" answers."""
+    
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        ttl_hit: Optional[int] = None,
+        ttl_miss: Optional[int] = None,
+        max_entries: Optional[int] = None
+    ):
+        """
+        Initialize the cache.
+        
+        Args:
+            path: SQLite database file. If not provided, uses config.OFF_CACHE_PATH
+            ttl_hit: Seconds a found product stays valid (default: config.OFF_CACHE_TTL_HIT)
+            ttl_miss: Seconds a "not found" answer stays valid (default: config.OFF_CACHE_TTL_MISS)
+            max_entries: Maximum cached lookups before LRU eviction (default: config.OFF_CACHE_MAX_ENTRIES)
+        """
+        self.path = Path(path or config.OFF_CACHE_PATH)
+        self.ttl_hit = ttl_hit if ttl_hit is not None else config.OFF_CACHE_TTL_HIT
+        self.ttl_miss = ttl_miss if ttl_miss is not None else config.OFF_CACHE_TTL_MISS
+        self.max_entries = max_entries or config.OFF_CACHE_MAX_ENTRIES
+        
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS off_cache ("
+            "key TEXT PRIMARY KEY, "
+            "data TEXT, "
+            "created REAL NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_off_cache_last_access ON off_cache (last_access)"
+        )
+        self._conn.commit()
+        
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM off_cache").fetchone()[0]
+        
+        logger.info("Caché Open Food Facts: %s (%d entradas)", self.path, self._entries)
+    
+    @staticmethod
+    def make_key(kind: str, query: str) -> str:
+        """
+        Build the cache key for a lookup.
+        
+        Args:
+            kind: "search" for name searches, "barcode" for product codes
+            query: Product name or barcode
+        
+        Returns:
+            Normalized key, e.g. "search:leche entera" or "barcode:7801234567890"
+        """
+        if kind == "barcode":
+            return f"barcode:{re.sub(r'[^0-9]', '', str(query))}"
+        return f"{kind}:{normalize_text(query)}"
+    
+    def get(self, kind: str, query: str) -> tuple[bool, Optional[dict]]:
+        """
+        Look up a cached result.
+        
+        Args:
+            kind: "search" or "barcode"
+            query: Product name or barcode
+        
+        Returns:
+            Tuple of (cached, product data). (True, None) is a cached "not found".
+        """
+        key = self.make_key(kind, query)
+        now = time.time()
+        
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, created FROM off_cache WHERE key = ?", (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.misses += 1
+                return False, None
+            
+            data, created = row
+            ttl = self.ttl_hit if data is not None else self.ttl_miss
+            if now - created > ttl:
+                self._conn.execute("DELETE FROM off_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._entries -= 1
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            
+            self._conn.execute(
+                "UPDATE off_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            
+            if data is None:
+                self.negative_hits += 1
+                return True, None
+            
+            self.hits += 1
+        
+        return True, json.loads(data)
+    
+    def put(self, kind: str, query: str, product: Optional[dict]):
+        """
+        Store a lookup result. None records that the product was not found.
+        
+        Args:
+            kind: "search" or "barcode"
+            query: Product name or barcode
+            product: Parsed product data, or None
+        """
+        key = self.make_key(kind, query)
+        data = json.dumps(product, ensure_ascii=False) if product is not None else None
+        now = time.time()
+        
+        with self._lock:
+            exists = self._conn.execute(
+                "SELECT 1 FROM off_cache WHERE key = ?", (key,)
+            ).fetchone()
+            
+            self._conn.execute(
+                "INSERT OR REPLACE INTO off_cache (key, data, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, now, now)
+            )
+            if exists is None:
+                self._entries += 1
+            
+            self._evict_locked()
+            self._conn.commit()
+    
+    def _evict_locked(self):
+        """Remove least recently used entries beyond max_entries."""
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return
+        
+        self._conn.execute(
+            "DELETE FROM off_cache WHERE key IN ("
+            "SELECT key FROM off_cache ORDER BY last_access ASC LIMIT ?)",
+            (excess,)
+        )
+        self._entries -= excess
+        self.evictions += excess
+    
+    def stats(self) -> dict:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with hit/miss counters and hit rate
+        """
+        with self._lock:
+            served = self.hits + self.negative_hits
+            lookups = served + self.misses
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "entries": self._entries,
+                "tasa_aciertos": (served / lookups * 100) if lookups > 0 else 0
+            }
+    
+    def clear(self):
+        """Remove all cached lookups."""
+        with self._lock:
+            self._conn.execute("DELETE FROM off_cache")
+            self._conn.commit()
+            self._entries = 0
+        logger.debug("Caché Open Food Facts vaciada")
+    
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+        logger.debug("Caché Open Food Facts cerrada")
@@ -0,0 +1,283 @@
+"""
+Food Scanner - Open Food Facts Local Index Module
+Offline full-text index built from an Open Food Facts data dump (SQLite FTS5)
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator, Optional
+
+import config
+from utils.text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Nutriment keys read by OpenFoodFactsClient._parse_product_data
+NUTRIMENT_KEYS = [
+    "energy-kcal_100g",
+    "energy-kj_100g",
+    "fat_100g",
+    "saturated-fat_100g",
+    "carbohydrates_100g",
+    "sugars_100g",
+    "fiber_100g",
+    "proteins_100g",
+    "salt_100g",
+    "sodium_100g",
+]
+
+# Rows inserted per transaction while building
+BATCH_SIZE = 10000
+
+
+class OpenFoodFactsIndex:
+    """Local, search_product-compatible lookup backend over an Open Food Facts dump."""
+    
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Initialize the index.
+        
+        Args:
+            path: SQLite database file. If not provided, uses config.OFF_INDEX_PATH
+        """
+        self.path = Path(path or config.OFF_INDEX_PATH)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+    
+    @property
+    def exists(self) -> bool:
+        """True if the index file has been built."""
+        return self.path.exists()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's read-only connection (lookups run from several workers)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def build(self, source_path: Path) -> int:
+        """
+        Build the index from a JSONL or CSV export, streaming it row by row.
+        
+        Supports the official dumps: openfoodfacts-products.jsonl(.gz) and the
+        tab-separated en.openfoodfacts.org.products.csv(.gz). The previous index
+        is replaced only once the new one is complete.
+        
+        Args:
+            source_path: Path to the dump file
+        
+        Returns:
+            Number of products indexed
+        """
+        source_path = Path(source_path)
+        tmp_path = self.path.with_suffix(".building")
+        tmp_path.unlink(missing_ok=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        
+        logger.info("Construyendo índice local desde %s", source_path)
+        
+        conn = sqlite3.connect(str(tmp_path))
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(
+                "CREATE TABLE products ("
+                "code TEXT PRIMARY KEY, "
+                "product_name TEXT, "
+                "brands TEXT, "
+                "categories TEXT, "
+                "quantity TEXT, "
+                "serving_size TEXT, "
+                "nutrition_grade TEXT, "
+                "nutriments TEXT)"
+            )
+            
+            count = 0
+            batch = []
+            for product in self._iter_source(source_path):
+                batch.append(product)
+                if len(batch) >= BATCH_SIZE:
+                    count += self._insert_batch(conn, batch)
+                    batch = []
+                    if count % (BATCH_SIZE * 10) == 0:
+                        logger.info("  %d productos indexados...", count)
+            if batch:
+                count += self._insert_batch(conn, batch)
+            
+            # Full-text index over the fields search_product matches on
+            conn.execute(
+                "CREATE VIRTUAL TABLE products_fts USING fts5("
+                "product_name, brands, "
+                "content='products', content_rowid='rowid', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+            conn.commit()
+        finally:
+            conn.close()
+        
+        tmp_path.replace(self.path)
+        logger.info("Índice local listo: %d productos en %s", count, self.path)
+        return count
+    
+    @staticmethod
+    def _insert_batch(conn: sqlite3.Connection, batch: list[tuple]) -> int:
+        """Insert one batch of product rows in a single transaction."""
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch
+            )
+        return len(batch)
+    
+    def _iter_source(self, source_path: Path) -> Iterator[tuple]:
+        """
+        Stream product rows from a dump file.
+        
+        Args:
+            source_path: JSONL or CSV export, optionally gzip-compressed
+        
+        Yields:
+            Row tuples ready for the products table
+        """
+        suffixes = [s.lower() for s in source_path.suffixes]
+        opener = gzip.open if suffixes and suffixes[-1] == ".gz" else open
+        
+        with opener(source_path, "rt", encoding="utf-8", errors="replace", newline="") as handle:
+            if ".jsonl" in suffixes or ".json" in suffixes:
+                rows = self._iter_jsonl(handle)
+            else:
+                rows = self._iter_csv(handle)
+            
+            for row in rows:
+                if row[0] and row[1]:  # code and product_name are required
+                    yield row
+    
+    @staticmethod
+    def _iter_jsonl(handle: io.TextIOBase) -> Iterator[tuple]:
+        """Parse one JSON product per line."""
+        for line in handle:
+            try:
+                product = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            
+            nutriments = product.get("nutriments") or {}
+            yield (
+                str(product.get("code") or ""),
+                product.get("product_name") or "",
+                product.get("brands") or "",
+                product.get("categories") or "",
+                product.get("quantity") or "",
+                product.get("serving_size") or "",
+                product.get("nutrition_grades") or "",
+                json.dumps({key: nutriments[key] for key in NUTRIMENT_KEYS if key in nutriments}),
+            )
+    
+    @staticmethod
+    def _iter_csv(handle: io.TextIOBase) -> Iterator[tuple]:
+        """Parse the CSV export (tab- or comma-separated, with a header row)."""
+        csv.field_size_limit(sys.maxsize)
+        
+        header = handle.readline()
+        delimiter = "\t" if "\t" in header else ","
+        fieldnames = next(csv.reader([header], delimiter=delimiter))
+        
+        # The official dump is tab-separated without quoting
+        quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+        
+        for record in csv.DictReader(handle, fieldnames=fieldnames, delimiter=delimiter, quoting=quoting):
+            nutriments = {}
+            for key in NUTRIMENT_KEYS:
+                value = record.get(key)
+                if value:
+                    try:
+                        nutriments[key] = float(value)
+                    except ValueError:
+                        pass
+            
+            yield (
+                record.get("code") or "",
+                record.get("product_name") or "",
+                record.get("brands") or "",
+                record.get("categories") or "",
+                record.get("quantity") or "",
+                record.get("serving_size") or "",
+                record.get("nutrition_grade_fr") or record.get("nutriscore_grade") or "",
+                json.dumps(nutriments),
+            )
+    
+    def search(self, product_name: str) -> Optional[dict]:
+        """
+        Find the best match for a product name.
+        
+        Args:
+            product_name: Name of the product to search for
+        
+        Returns:
+            Raw product dict in the API's format, or None if nothing matched
+        """
+        tokens = normalize_text(product_name).replace('"', " ").split()
+        if not tokens:
+            return None
+        
+        match = " ".join(f'"{token}"' for token in tokens)
+        row = self._connection().execute(
+            "SELECT p.* FROM products_fts "
+            "JOIN products p ON p.rowid = products_fts.rowid "
+            "WHERE products_fts MATCH ? "
+            "ORDER BY bm25(products_fts) LIMIT 1",
+            (match,)
+        ).fetchone()
+        
+        return self._row_to_product(row) if row is not None else None
+    
+    def get_by_barcode(self, barcode: str) -> Optional[dict]:
+        """
+        Look up a product by barcode.
+        
+        Args:
+            barcode: Product barcode (EAN-13, UPC, etc.)
+        
+        Returns:
+            Raw product dict in the API's format, or None if unknown
+        """
+        row = self._connection().execute(
+            "SELECT * FROM products WHERE code = ?", (str(barcode).strip(),)
+        ).fetchone()
+        
+        return self._row_to_product(row) if row is not None else None
+    
+    @staticmethod
+    def _row_to_product(row: sqlite3.Row) -> dict:
+        """Convert an index row back to the API's product layout."""
+        return {
+            "code": row["code"],
+            "product_name": row["product_name"],
+            "brands": row["brands"],
+            "categories": row["categories"],
+            "quantity": row["quantity"],
+            "serving_size": row["serving_size"],
+            "nutrition-grades": row["nutrition_grade"],
+            "nutriments": json.loads(row["nutriments"] or "{}"),
+        }
+    
+    def close(self):
+        """Close all open connections."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        logger.debug("Índice local cerrado")
@@ -0,0 +1,360 @@
+"""
+Food Scanner - Pipeline Module
+Streams OCR output into concurrent Open Food Facts enrichment
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Optional
+
+import config
+from .dedup import ProductDeduplicator
+from .journal import RunJournal
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the enrichment queue for each worker
+_STOP = object()
+
+
+class ScanPipeline:
+    """
+    Producer/consumer pipeline: OCR workers feed a bounded queue that
+    Open Food Facts workers drain, so both network stages overlap.
+    """
+    
+    def __init__(
+        self,
+        ocr_processor,
+        api_client,
+        ocr_workers: Optional[int] = None,
+        off_workers: Optional[int] = None,
+        queue_size: Optional[int] = None
+    ):
+        """
+        Initialize the pipeline.
+        
+        Args:
+            ocr_processor: OCRProcessor used for the extraction stage
+            api_client: OpenFoodFactsClient used for the enrichment stage
+            ocr_workers: OCR worker threads; the processor's key pool decides how many
+                call Gemini at once (default: ocr_processor.max_concurrency)
+            off_workers: Concurrent Open Food Facts lookups (default: config.OFF_MAX_WORKERS)
+            queue_size: Maximum products waiting for enrichment (default: config.PIPELINE_QUEUE_SIZE)
+        """
+        self.ocr_processor = ocr_processor
+        self.api_client = api_client
+        self.ocr_workers = ocr_workers or ocr_processor.max_concurrency
+        self.off_workers = max(1, off_workers or config.OFF_MAX_WORKERS)
+        self.queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+    
+    def run(
+        self,
+        image_paths: list[Path],
+        on_image: Optional[Callable[[Path, list], None]] = None,
+        on_product: Optional[Callable[[str, dict, Optional[dict]], None]] = None,
+        journal: Optional[RunJournal] = None,
+        deduplicator: Optional[ProductDeduplicator] = None,
+        near_duplicates: Optional[dict[Path, Path]] = None
+    ) -> list[tuple[str, dict, Optional[dict]]]:
+        """
+        Run OCR and enrichment for a set of images.
+        
+        Images that fail OCR or contain no products are reported through
+        on_image but produce no result rows. When the OCR processor streams its
+        answers, products are queued for enrichment while Gemini is still
+        writing the rest of the image's answer; on_image is called once the
+        answer is complete.
+        
+        Args:
+            image_paths: Images to process
+            on_image: Called with (image_path, product_list) as each image finishes OCR
+            on_product: Called with (image_name, product_dict, product_data) as each lookup finishes
+            journal: Optional run journal. Progress is recorded to it, and images it
+                already has are not sent to Gemini again.
+            deduplicator: Optional ProductDeduplicator. Products already seen in
+                another image are merged into the first sighting instead of
+                being looked up again.
+            near_duplicates: Optional map of near-duplicate photo -> the photo it
+                duplicates (ImageHashIndex.duplicates). Near duplicates are not sent
+                to Gemini; they reuse the OCR result of their representative, or
+                are analyzed on their own if the representative fails.
+        
+        Returns:
+            List of (image_name, product_dict, product_data) in image order, then
+            product order within each image. With a deduplicator, each product
+            appears once, under the first of its images.
+        """
+        work_queue = queue.Queue(maxsize=self.queue_size)
+        results = {}
+        results_lock = threading.Lock()
+        pending_products = {}  # image name -> products still being enriched
+        dedup_lock = threading.Lock()
+        
+        def product_finished(image_name):
+            # Called with results_lock held
+            pending_products[image_name] -= 1
+            if pending_products[image_name] == 0 and journal is not None:
+                try:
+                    journal.record_image_done(image_name)
+                except Exception as e:
+                    # The image is simply redone on resume
+                    logger.error("Error registrando %s en el diario: %s", image_name, str(e))
+        
+        def enrich_worker():
+            while True:
+                item = work_queue.get()
+                if item is _STOP:
+                    return
+                
+                order_key, image_name, product = item
+                try:
+                    product_data = self.api_client.search_product(product.get("nombre", ""))
+                except Exception as e:
+                    logger.error("Error enriqueciendo %s: %s", product.get("nombre", ""), str(e))
+                    product_data = None
+                
+                snapshot = product_snapshot(product)
+                try:
+                    if journal is not None:
+                        journal.record_product(image_name, order_key[1], snapshot, product_data)
+                    if on_product is not None:
+                        on_product(image_name, snapshot, product_data)
+                except Exception as e:
+                    logger.error("Error registrando %s: %s", product.get("nombre", ""), str(e))
+                finally:
+                    # A worker that stopped here would leave the producer blocked on a full queue
+                    with results_lock:
+                        results[order_key] = (image_name, product, product_data)
+                        product_finished(image_name)
+        
+        def product_snapshot(product):
+            # OCR threads keep merging later sightings into a kept product under
+            # dedup_lock; the journal and callbacks get a copy taken under it.
+            # The final rows use the live dict, so they list every image.
+            if deduplicator is None:
+                return product
+            with dedup_lock:
+                return dict(product, imagenes=list(product["imagenes"]))
+        
+        def dedup(image_name, product):
+            # Returns None for products already queued from another image
+            if deduplicator is None:
+                return product
+            with dedup_lock:
+                return deduplicator.add(image_name, product)
+        
+        def enqueue_products(image_index, image_name, product_list, known_data=None):
+            # known_data: product index -> lookup result from a completed previous run
+            queued = []
+            for product_index, product in enumerate(product_list):
+                product = self.as_product_dict(product)
+                if not product.get("nombre"):
+                    continue
+                product = dedup(image_name, product)
+                if product is None:
+                    continue
+                if known_data is not None and product_index in known_data:
+                    results[(image_index, product_index)] = (image_name, product, known_data[product_index])
+                else:
+                    queued.append((product_index, product))
+            
+            with results_lock:
+                pending_products[image_name] = len(queued)
+            if not queued and journal is not None and known_data is None:
+                journal.record_image_done(image_name)
+            
+            for product_index, product in queued:
+                # Blocks while the queue is full, throttling OCR to enrichment speed
+                work_queue.put(((image_index, product_index), image_name, product))
+        
+        def handle_ocr(image_path, product_list):
+            # Returns False if OCR failed for the image
+            if on_image is not None:
+                on_image(image_path, product_list)
+            
+            if self.ocr_processor.is_error(product_list):
+                return False
+            
+            if journal is not None:
+                journal.record_ocr(image_path.name, product_list)
+            
+            if not self.has_products(product_list):
+                if journal is not None:
+                    journal.record_image_done(image_path.name)
+                return True
+            
+            enqueue_products(image_index[image_path], image_path.name, product_list)
+            return True
+        
+        def stream_image(image_path):
+            # Runs on an OCR worker: products are queued as soon as they are parsed
+            image_name = image_path.name
+            with results_lock:
+                # Held by the OCR stage, so the image is not marked done mid-answer
+                pending_products[image_name] = 1
+            
+            product_list = []
+            for product in self.ocr_processor.iter_products(image_path):
+                product_list.append(product)
+                product = self.as_product_dict(product)
+                if product.get("nombre") in (None, "", "ERROR", "NO_DETECTADO"):
+                    continue
+                product = dedup(image_name, product)
+                if product is None:
+                    continue
+                with results_lock:
+                    pending_products[image_name] += 1
+                work_queue.put(((image_index[image_path], len(product_list) - 1), image_name, product))
+            
+            return image_path, product_list
+        
+        def finish_stream(image_path, product_list):
+            # Returns False if OCR failed for the image
+            if on_image is not None:
+                on_image(image_path, product_list)
+            
+            if self.ocr_processor.is_error(product_list):
+                with results_lock:
+                    pending_products.pop(image_path.name, None)
+                return False
+            
+            if journal is not None:
+                journal.record_ocr(image_path.name, product_list)
+            with results_lock:
+                product_finished(image_path.name)
+            return True
+        
+        def ocr_results(image_paths):
+            # Yields (image_path, OCR succeeded, product_list) as images finish
+            if not (self.ocr_processor.stream and self.ocr_processor.pack_size == 1):
+                for image_path, product_list in self.ocr_processor.iter_batch(
+                    image_paths, max_workers=self.ocr_workers, ordered=False
+                ):
+                    yield image_path, handle_ocr(image_path, product_list), product_list
+                return
+            
+            executor = ThreadPoolExecutor(max_workers=self.ocr_workers, thread_name_prefix="ocr")
+            try:
+                futures = [executor.submit(stream_image, image_path) for image_path in image_paths]
+                for future in as_completed(futures):
+                    image_path, product_list = future.result()
+                    yield image_path, finish_stream(image_path, product_list), product_list
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        
+        workers = [
+            threading.Thread(target=enrich_worker, name=f"off-{i}", daemon=True)
+            for i in range(self.off_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        
+        try:
+            image_index = {image_path: index for index, image_path in enumerate(image_paths)}
+            near_duplicates = near_duplicates or {}
+            to_ocr = []
+            reuse = {}  # representative path -> near duplicates waiting for its OCR
+            
+            for image_path in image_paths:
+                representative = near_duplicates.get(image_path)
+                if (journal is not None and image_path.name in journal.completed and deduplicator is not None
+                        and self.has_products(journal.ocr_products[image_path.name])):
+                    # Finished in a previous run: replay its OCR through the deduplicator,
+                    # reusing lookups it already has
+                    known_data = {
+                        product_index: product_data
+                        for product_index, _, product_data in journal.completed[image_path.name]
+                    }
+                    enqueue_products(
+                        image_index[image_path], image_path.name,
+                        journal.ocr_products[image_path.name], known_data
+                    )
+                elif journal is not None and image_path.name in journal.completed:
+                    # Finished in a previous run: reuse its rows as they are
+                    for product_index, product, product_data in journal.completed[image_path.name]:
+                        results[(image_index[image_path], product_index)] = (image_path.name, product, product_data)
+                elif journal is not None and image_path.name in journal.ocr_results:
+                    # OCR finished in a previous run: only the enrichment is redone
+                    enqueue_products(image_index[image_path], image_path.name, journal.ocr_results[image_path.name])
+                elif journal is not None and representative is not None and representative.name in journal.ocr_products:
+                    # Near duplicate of a photo analyzed in a previous run
+                    handle_ocr(image_path, journal.ocr_products[representative.name])
+                elif representative is not None:
+                    reuse.setdefault(representative, []).append(image_path)
+                else:
+                    to_ocr.append(image_path)
+            
+            if journal is not None:
+                resumed = sum(1 for image_path in image_paths if image_path.name in journal.ocr_products)
+                if resumed:
+                    logger.info("Reanudando: %d de %d imágenes ya analizadas", resumed, len(image_paths))
+            
+            # Producer: images arrive in completion order; their products are queued right away
+            retry = []
+            for image_path, ok, product_list in ocr_results(to_ocr):
+                for duplicate_path in reuse.pop(image_path, []):
+                    if ok:
+                        handle_ocr(duplicate_path, product_list)
+                    else:
+                        retry.append(duplicate_path)
+            
+            # Near duplicates whose representative failed (or was not in image_paths) get their own OCR
+            for duplicate_paths in reuse.values():
+                retry.extend(duplicate_paths)
+            for _ in ocr_results(retry):
+                pass
+        finally:
+            # Even if OCR or a callback raised, stop the enrichment workers so a
+            # long-lived process (the web app) does not keep them blocked forever
+            for _ in workers:
+                work_queue.put(_STOP)
+            for worker in workers:
+                worker.join()
+        
+        rows = [results[key] for key in sorted(results)]
+        
+        if deduplicator is not None:
+            # Images finish OCR out of order: list sources in input order and
+            # file each product under the first of them
+            order = {image_path.name: index for index, image_path in enumerate(image_paths)}
+            for _, product, _ in rows:
+                product["imagenes"].sort(key=lambda name: order.get(name, len(order)))
+            rows = [(product["imagenes"][0], product, product_data) for _, product, product_data in rows]
+            rows.sort(key=lambda row: order.get(row[0], len(order)))
+        
+        return rows
+    
+    @staticmethod
+    def as_product_dict(product) -> dict:
+        """
+        Normalize an OCR product entry to a dict (demo mode returns plain names).
+        
+        Args:
+            product: Product dict or product name
+        
+        Returns:
+            Product dictionary with at least a "nombre" key
+        """
+        if isinstance(product, dict):
+            return product
+        return {"nombre": str(product)}
+    
+    @staticmethod
+    def has_products(product_list: list) -> bool:
+        """
+        Check whether an OCR result contains real products.
+        
+        Args:
+            product_list: Result of OCRProcessor.process_image
+        
+        Returns:
+            False for empty results and ERROR / NO_DETECTADO markers
+        """
+        if not product_list:
+            return False
+        
+        first = ScanPipeline.as_product_dict(product_list[0])
+        return first.get("nombre") not in ("ERROR", "NO_DETECTADO")
@@ -0,0 +1,135 @@
+"""
+Food Scanner - Image Preprocessing Module
+Downscales and re-encodes photos before they are uploaded to Gemini
+"""
+import logging
+import time
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# MIME types for the supported output encodings
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+# Source encodings Gemini reads directly, so files in them can be uploaded untouched
+SOURCE_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    max_dimension: Optional[int] = None,
+    image_format: Optional[str] = None,
+    quality: Optional[int] = None
+) -> dict:
+    """
+    Downscale and re-encode an image for upload.
+    
+    Images that are already in the output encoding, upright and within
+    max_dimension are returned as they are, without decoding them. Other
+    JPEG sources are opened in draft mode so the decoder only produces the
+    smallest DCT scale that still covers max_dimension.
+    
+    Args:
+        image_bytes: Raw bytes of the original image file
+        max_dimension: Longest side in pixels after resizing (default: config.IMAGE_MAX_DIMENSION)
+        image_format: Output encoding, "JPEG" or "WEBP" (default: config.IMAGE_FORMAT)
+        quality: Encoder quality 1-100 (default: config.IMAGE_QUALITY)
+    
+    Returns:
+        Dictionary with the encoded data, its MIME type, size/timing stats and
+        whether the original bytes were passed through
+    """
+    max_dimension = max_dimension or config.IMAGE_MAX_DIMENSION
+    image_format = (image_format or config.IMAGE_FORMAT).upper()
+    quality = quality or config.IMAGE_QUALITY
+    
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Formato de imagen no soportado: {image_format}")
+    
+    start = time.perf_counter()
+    
+    image = Image.open(BytesIO(image_bytes))
+    original_size = image.size
+    
+    # Nothing to shrink, rotate or convert: re-encoding would only cost time and quality
+    if (
+        image.format == image_format
+        and max(original_size) <= max_dimension
+        and image.mode in ("RGB", "L")
+        and image.getexif().get(0x0112, 1) == 1
+    ):
+        return {
+            "data": image_bytes,
+            "mime_type": MIME_TYPES[image_format],
+            "original_size": original_size,
+            "size": original_size,
+            "bytes_before": len(image_bytes),
+            "bytes_after": len(image_bytes),
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+            "passthrough": True,
+        }
+    
+    # Let the JPEG decoder skip detail we would throw away anyway
+    if image.format == "JPEG":
+        image.draft("RGB", (max_dimension, max_dimension))
+    
+    # Apply EXIF orientation so Gemini sees the photo upright
+    image = ImageOps.exif_transpose(image)
+    
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    data = output.getvalue()
+    
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    return {
+        "data": data,
+        "mime_type": MIME_TYPES[image_format],
+        "original_size": original_size,
+        "size": image.size,
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(data),
+        "elapsed_ms": elapsed_ms,
+        "passthrough": False,
+    }
+
+
+def preprocess_settings_key(
+    max_dimension: Optional[int] = None,
+    image_format: Optional[str] = None,
+    quality: Optional[int] = None
+) -> str:
+    """
+    Describe preprocessing settings as a short string (used in cache keys).
+    
+    Args:
+        max_dimension: Longest side in pixels after resizing
+        image_format: Output encoding
+        quality: Encoder quality
+    
+    Returns:
+        String such as "JPEG:2048:85"
+    """
+    return "{}:{}:{}".format(
+        (image_format or config.IMAGE_FORMAT).upper(),
+        max_dimension or config.IMAGE_MAX_DIMENSION,
+        quality or config.IMAGE_QUALITY,
+    )
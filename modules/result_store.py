@@ -0,0 +1,242 @@
+"""
+Food Scanner - Result Store Module
+Compact columnar storage for scan results
+"""
+import hashlib
+import logging
+import sys
+from array import array
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Result columns, in export order
+RESULT_COLUMNS = [
+    "nombre",
+    "codigoBarras",
+    "detalle",
+    "cantidad",
+    "imagen",
+    "precioCompra",
+    "precioVenta",
+    "stock",
+    "stockMinimo",
+    "proveedor",
+    "categoria",
+    "fechaVencimiento",
+    "estado",
+    "imagenes",
+]
+
+# Columns written to the Excel export: the ERP import layout. imagenes is kept in
+# memory for the app's "Evidencia Visual" panel but not exported, so the file has
+# the same columns with or without deduplication
+EXPORT_COLUMNS = [column for column in RESULT_COLUMNS if column != "imagenes"]
+
+# Separator between image names in the imagenes column
+IMAGES_SEPARATOR = "; "
+
+# Free-text columns, stored as lists of str
+TEXT_COLUMNS = ["nombre", "codigoBarras", "detalle", "proveedor", "imagenes"]
+
+# Low-cardinality columns whose values are interned (one str object per distinct value)
+INTERNED_COLUMNS = ["imagen", "categoria"]
+
+# Result states, stored as one byte per row
+ESTADOS = ["ENCONTRADO", "NO_ENCONTRADO", "ERROR_OCR"]
+
+
+class ResultStore:
+    """
+    Column-oriented result table.
+    
+    Text columns are plain lists (repeated values interned), cantidad is an
+    int64 array and estado a byte array of codes into ESTADOS. Summary counts,
+    column widths and a content fingerprint are updated on append, and the
+    DataFrame is built once and cached until the next change.
+    """
+    
+    def __init__(self):
+        """Initialize an empty store."""
+        self._text = {column: [] for column in TEXT_COLUMNS + INTERNED_COLUMNS}
+        self._cantidad = array("q")
+        self._cantidad_other = {}  # row -> non-integer cantidad from OCR (e.g. "6 unidades")
+        self._estado = array("b")
+        self._estado_codes = {estado: code for code, estado in enumerate(ESTADOS)}
+        self._estado_counts = [0] * len(ESTADOS)
+        self._frame = None
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._reset_column_widths()
+    
+    def _reset_column_widths(self):
+        """Start column sizing from the header lengths."""
+        self.column_widths = {column: len(column) for column in RESULT_COLUMNS}
+    
+    def __len__(self) -> int:
+        return len(self._estado)
+    
+    def append(self, result: dict):
+        """
+        Add one result row.
+        
+        Args:
+            result: Row dictionary keyed by RESULT_COLUMNS
+        """
+        for column in TEXT_COLUMNS:
+            self._text[column].append(self._as_text(result.get(column)))
+        for column in INTERNED_COLUMNS:
+            self._text[column].append(sys.intern(self._as_text(result.get(column))))
+        
+        cantidad = result.get("cantidad")
+        if isinstance(cantidad, int) and not isinstance(cantidad, bool):
+            self._cantidad.append(cantidad)
+        else:
+            self._cantidad_other[len(self._cantidad)] = cantidad
+            self._cantidad.append(0)
+        
+        code = self._estado_codes[result.get("estado", "ENCONTRADO")]
+        self._estado.append(code)
+        self._estado_counts[code] += 1
+        
+        widths = self.column_widths
+        for column, value in result.items():
+            if value is None:
+                continue
+            length = len(str(value))
+            if length > widths.get(column, 0):
+                widths[column] = length
+        
+        self._digest.update(repr([result.get(column) for column in RESULT_COLUMNS]).encode("utf-8"))
+        self._frame = None
+    
+    @property
+    def fingerprint(self) -> str:
+        """Digest of every row appended so far; equal contents give equal fingerprints."""
+        return self._digest.hexdigest()
+    
+    @staticmethod
+    def _as_text(value) -> str:
+        """Store missing text as an empty string, anything else as str."""
+        if value is None:
+            return ""
+        return value if isinstance(value, str) else str(value)
+    
+    def _cantidad_at(self, index: int):
+        """Get the original cantidad value of a row."""
+        if index in self._cantidad_other:
+            return self._cantidad_other[index]
+        return self._cantidad[index]
+    
+    def row(self, index: int) -> dict:
+        """
+        Get one row as a dictionary.
+        
+        Args:
+            index: Row position
+        
+        Returns:
+            Row dictionary keyed by RESULT_COLUMNS
+        """
+        result = {}
+        for column in RESULT_COLUMNS:
+            if column in self._text:
+                result[column] = self._text[column][index]
+            elif column == "cantidad":
+                result[column] = self._cantidad_at(index)
+            elif column == "estado":
+                result[column] = ESTADOS[self._estado[index]]
+            else:
+                result[column] = None  # Left empty for the user to fill; never stored
+        return result
+    
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self.row(index)
+    
+    def iter_rows(self, columns: Optional[list[str]] = None) -> Iterator[list]:
+        """
+        Stream rows as value lists, without building dictionaries.
+        
+        Args:
+            columns: Columns to emit, in order (default: RESULT_COLUMNS)
+        
+        Yields:
+            One list of values per row
+        """
+        columns = columns or RESULT_COLUMNS
+        getters = []
+        for column in columns:
+            if column in self._text:
+                getters.append(self._text[column].__getitem__)
+            elif column == "cantidad":
+                getters.append(self._cantidad_at)
+            elif column == "estado":
+                getters.append(lambda index: ESTADOS[self._estado[index]])
+            else:
+                getters.append(lambda index: None)
+        
+        for index in range(len(self)):
+            yield [getter(index) for getter in getters]
+    
+    def summary(self) -> dict:
+        """
+        Get the running result counts.
+        
+        Returns:
+            Dictionary with total, per-state counts and success rate
+        """
+        total = len(self)
+        found, not_found, errors = self._estado_counts
+        return {
+            "total": total,
+            "encontrados": found,
+            "no_encontrados": not_found,
+            "errores_ocr": errors,
+            "tasa_exito": (found / total * 100) if total > 0 else 0
+        }
+    
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Get the results as a DataFrame, built straight from the columns.
+        
+        The frame is cached until the store changes; callers get a copy they
+        are free to modify.
+        
+        Returns:
+            DataFrame with RESULT_COLUMNS
+        """
+        if self._frame is None:
+            size = len(self)
+            data = {}
+            for column in RESULT_COLUMNS:
+                if column in self._text:
+                    data[column] = self._text[column]
+                elif column == "cantidad":
+                    if self._cantidad_other:
+                        data[column] = [self._cantidad_at(index) for index in range(size)]
+                    else:
+                        data[column] = np.frombuffer(self._cantidad, dtype=np.int64).copy()
+                elif column == "estado":
+                    data[column] = pd.Categorical.from_codes(
+                        np.frombuffer(self._estado, dtype=np.int8).copy(), categories=ESTADOS
+                    )
+                else:
+                    data[column] = np.full(size, None, dtype=object)
+            self._frame = pd.DataFrame(data, columns=RESULT_COLUMNS)
+        
+        return self._frame.copy()
+    
+    def clear(self):
+        """Remove all rows."""
+        for values in self._text.values():
+            values.clear()
+        self._cantidad = array("q")
+        self._cantidad_other.clear()
+        self._estado = array("b")
+        self._estado_counts = [0] * len(ESTADOS)
+        self._frame = None
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._reset_column_widths()
@@ -0,0 +1,124 @@
+"""
+Food Scanner - Tiling Module
+Cuts wide shelf panoramas into overlapping tiles that Gemini can read at full detail
+"""
+import math
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+import config
+
+# Default tile quality: tiles larger than the upload size are re-encoded once more
+TILE_QUALITY = 95
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def upright_size(image_bytes: bytes) -> tuple[int, int]:
+    """
+    Read the size of an image as it is displayed, from its header only.
+    
+    Args:
+        image_bytes: Raw bytes of the image file
+    
+    Returns:
+        (width, height) after applying the EXIF orientation
+    """
+    image = Image.open(BytesIO(image_bytes))
+    width, height = image.size
+    if image.getexif().get(0x0112, 1) in _TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def _axis_starts(length: int, tile: int, overlap: int) -> list[int]:
+    """Evenly spaced tile offsets along one axis, neighbours sharing at least `overlap` pixels."""
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [round(index * step) for index in range(count)]
+
+
+def plan_tiles(
+    size: tuple[int, int],
+    tile_size: Optional[int] = None,
+    overlap: Optional[float] = None,
+    max_tiles: Optional[int] = None,
+    min_aspect: Optional[float] = None
+) -> list[tuple[int, int, int, int]]:
+    """
+    Plan the overlapping tiles of a panorama.
+    
+    Only images wider (or taller) than min_aspect whose long side spans at
+    least two overlapping tiles are tiled: those are the ones Gemini would
+    shrink the most. An image just over tile_size is read whole, since its
+    tiles would be nearly identical. Tiles are squares of tile_size pixels,
+    grown as needed to stay within max_tiles.
+    
+    Args:
+        size: (width, height) of the upright image
+        tile_size: Tile side in pixels (default: config.IMAGE_MAX_DIMENSION)
+        overlap: Fraction of a tile shared with each neighbour (default: config.OCR_TILE_OVERLAP)
+        max_tiles: Maximum number of tiles (default: config.OCR_TILE_MAX)
+        min_aspect: Minimum long side / short side ratio to tile (default: config.OCR_TILE_MIN_ASPECT)
+    
+    Returns:
+        Crop boxes (left, upper, right, lower) in reading order, or an empty
+        list if the image is not tiled
+    """
+    tile_size = tile_size or config.IMAGE_MAX_DIMENSION
+    overlap = config.OCR_TILE_OVERLAP if overlap is None else overlap
+    max_tiles = max_tiles or config.OCR_TILE_MAX
+    min_aspect = min_aspect or config.OCR_TILE_MIN_ASPECT
+    
+    width, height = size
+    # Two tiles of tile_size sharing the minimum overlap
+    two_tiles = 2 * tile_size - int(tile_size * overlap)
+    if max(width, height) < two_tiles or max(width, height) < min(width, height) * min_aspect:
+        return []
+    
+    tile = tile_size
+    while True:
+        overlap_px = int(tile * overlap)
+        xs = _axis_starts(width, tile, overlap_px)
+        ys = _axis_starts(height, tile, overlap_px)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile = math.ceil(tile * 1.25)
+    
+    if len(xs) * len(ys) < 2:
+        return []
+    
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in ys for x in xs]
+
+
+def crop_tiles(
+    image_bytes: bytes,
+    boxes: list[tuple[int, int, int, int]],
+    quality: Optional[int] = None
+) -> list[bytes]:
+    """
+    Cut an image into tiles.
+    
+    Args:
+        image_bytes: Raw bytes of the image file
+        boxes: Crop boxes from plan_tiles, in upright coordinates
+        quality: JPEG quality of the tiles (default: TILE_QUALITY)
+    
+    Returns:
+        JPEG bytes of each tile, in the order of boxes
+    """
+    image = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes)))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    tiles = []
+    for box in boxes:
+        output = BytesIO()
+        image.crop(box).save(output, format="JPEG", quality=quality or TILE_QUALITY)
+        tiles.append(output.getvalue())
+    return tiles
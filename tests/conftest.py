@@ -0,0 +1,21 @@
+"""
+Food Scanner - Test configuration
+Run from the project root with: python -m pytest
+"""
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+@pytest.fixture
+def image_bytes() -> bytes:
+    """A small JPEG, as uploaded by a phone."""
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
@@ -0,0 +1,473 @@
+"""
+Tests for the concurrency primitives in utils.concurrency
+"""
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from utils import concurrency
+from utils.concurrency import AdaptiveLimiter, HedgedCalls, SingleFlight, TokenBucket
+
+
+class FakeTime:
+    """Stand-in for the time module whose clock only moves when told to."""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    def sleep(self, seconds: float):
+        self.now += seconds
+    
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeTime:
+    fake = FakeTime()
+    monkeypatch.setattr(concurrency, "time", fake)
+    return fake
+
+
+def start(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def succeed(limiter: AdaptiveLimiter, calls: int):
+    for _ in range(calls):
+        limiter.release(limiter.acquire())
+
+
+def test_additive_increase_adds_one_slot_per_window_of_successes(clock):
+    limiter = AdaptiveLimiter(4, maximum=100)
+    
+    succeed(limiter, 4)
+    assert limiter.limit == 4
+    succeed(limiter, 1)
+    assert limiter.limit == 5
+    succeed(limiter, 5)
+    assert limiter.limit == 6
+    assert limiter.peak_limit == 6
+
+
+def test_multiplicative_decrease_on_throttle(clock):
+    limiter = AdaptiveLimiter(8)
+    
+    limiter.release(limiter.acquire(), throttled=True)
+    
+    assert limiter.limit == 4
+    assert limiter.stats()["reducciones"] == 1
+
+
+def test_calls_started_before_a_decrease_do_not_decrease_again(clock):
+    limiter = AdaptiveLimiter(8)
+    tickets = [limiter.acquire() for _ in range(4)]
+    
+    for ticket in tickets:
+        limiter.release(ticket, throttled=True)
+    
+    assert limiter.limit == 4
+    assert limiter.throttles == 4
+    assert limiter.decreases == 1
+
+
+def test_limit_never_drops_below_the_floor(clock):
+    limiter = AdaptiveLimiter(4)
+    
+    for _ in range(10):
+        limiter.release(limiter.acquire(), throttled=True)
+    
+    assert limiter.limit == 1
+    assert limiter.load == 0
+
+
+def test_minimum_is_at_least_one(clock):
+    assert AdaptiveLimiter(3, minimum=0).minimum == 1
+
+
+def test_limit_never_grows_past_the_ceiling(clock):
+    limiter = AdaptiveLimiter(2, maximum=5)
+    
+    succeed(limiter, 200)
+    
+    assert limiter.limit == 5
+    assert limiter.peak_limit == 5
+
+
+def test_maximum_defaults_to_the_initial_limit(clock):
+    limiter = AdaptiveLimiter(3)
+    
+    succeed(limiter, 50)
+    
+    assert limiter.limit == 3
+
+
+def test_try_acquire_respects_the_limit(clock):
+    limiter = AdaptiveLimiter(2)
+    
+    first, second = limiter.try_acquire(), limiter.try_acquire()
+    assert None not in (first, second)
+    assert limiter.try_acquire() is None
+    
+    limiter.release(first)
+    assert limiter.try_acquire() is not None
+
+
+def test_retry_after_pauses_new_calls(clock):
+    limiter = AdaptiveLimiter(4)
+    
+    limiter.release(limiter.acquire(), throttled=True, retry_after=5)
+    
+    assert limiter.paused_until == clock.now + 5
+    assert limiter.try_acquire() is None
+    clock.advance(4.9)
+    assert limiter.try_acquire() is None
+    clock.advance(0.2)
+    assert limiter.try_acquire() is not None
+
+
+def test_retry_after_never_shortens_an_active_pause(clock):
+    limiter = AdaptiveLimiter(4)
+    first, second = limiter.acquire(), limiter.acquire()
+    
+    limiter.release(first, throttled=True, retry_after=10)
+    limiter.release(second, throttled=True, retry_after=1)
+    
+    assert limiter.paused_until == clock.now + 10
+
+
+def test_blocked_acquire_waits_out_the_pause(clock):
+    # A short pause, so the limiter's real-time wait rechecks the fake clock quickly
+    limiter = AdaptiveLimiter(4)
+    limiter.release(limiter.acquire(), throttled=True, retry_after=0.05)
+    acquired = threading.Event()
+    
+    thread = start(lambda: (limiter.acquire(), acquired.set()))
+    
+    assert not acquired.wait(0.2)
+    clock.advance(0.05)
+    assert acquired.wait(2)
+    thread.join(2)
+
+
+def test_blocked_acquirers_wake_when_a_slot_is_released(clock):
+    limiter = AdaptiveLimiter(2)
+    tickets = [limiter.acquire(), limiter.acquire()]
+    acquired = []
+    
+    threads = [start(lambda: acquired.append(limiter.acquire())) for _ in range(2)]
+    time.sleep(0.05)
+    assert acquired == []
+    
+    limiter.release(tickets[0])
+    limiter.release(tickets[1])
+    for thread in threads:
+        thread.join(2)
+    
+    assert len(acquired) == 2
+    assert limiter.stats()["en_curso"] == 2
+
+
+def test_blocked_acquirers_wake_when_the_limit_grows(clock):
+    limiter = AdaptiveLimiter(1, maximum=4)
+    held = limiter.acquire()
+    acquired = threading.Event()
+    
+    thread = start(lambda: (limiter.acquire(), acquired.set()))
+    assert not acquired.wait(0.05)
+    
+    # The release both frees the slot and grows the limit from 1 to 2
+    limiter.release(held)
+    assert acquired.wait(2)
+    thread.join(2)
+
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+    
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return "resultado"
+    
+    results = []
+    threads = [start(lambda: results.append(flight.do("clave", slow))) for _ in range(5)]
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    
+    assert calls == [1]
+    assert results == ["resultado"] * 5
+    assert flight.saved == 4
+
+
+def test_single_flight_forgets_failed_calls():
+    flight = SingleFlight()
+    
+    with pytest.raises(ValueError):
+        flight.do("clave", lambda: (_ for _ in ()).throw(ValueError("fallo")))
+    
+    assert flight.do("clave", lambda: "reintento") == "reintento"
+
+
+def test_token_bucket_waits_for_the_next_token(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+    
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+    clock.advance(10)
+    assert bucket.acquire() == 0
+
+
+class Attempts:
+    """
+    Scripted attempts for HedgedCalls: the n-th attempt of a call runs the n-th script.
+    
+    Each script takes the attempt's clock and plays the service: it calls
+    clock.start() when it "sends" its request.
+    """
+    
+    def __init__(self, *scripts):
+        self.scripts = list(scripts)
+        self.clocks = []
+        self._lock = threading.Lock()
+    
+    def __call__(self, clock):
+        with self._lock:
+            index = len(self.clocks)
+            self.clocks.append(clock)
+        return self.scripts[index](clock)
+
+
+def answer(result, after=0.0, queued=0.0):
+    """Script that waits `queued` s for a slot, sends, and answers after `after` s unless abandoned."""
+    def script(clock):
+        if clock.abandoned.wait(queued):
+            raise CancelledError()
+        clock.start()
+        clock.abandoned.wait(after)
+        return result
+    return script
+
+
+def fail(error):
+    def script(clock):
+        clock.start()
+        raise error
+    return script
+
+
+def stream(*items, after=0.0, queued=0.0):
+    """Streamed version of answer(): yields items once `after` s have passed since sending."""
+    def script(clock):
+        if clock.abandoned.wait(queued):
+            raise CancelledError()
+        clock.start()
+        clock.abandoned.wait(after)
+        yield from items
+    return script
+
+
+def warmed_up(calls: int = 4, **options) -> HedgedCalls:
+    """Hedger that has seen `calls` fast calls, so its hedge delay is min_delay."""
+    options = {"max_workers": 4, "percentile": 50, "max_ratio": 1.0, "min_delay": 0.05, "min_samples": 2, **options}
+    hedger = HedgedCalls(**options)
+    for _ in range(calls):
+        hedger.call(answer("calentamiento"), "gemini")
+    return hedger
+
+
+def test_fast_call_is_not_hedged():
+    hedger = warmed_up()
+    attempts = Attempts(answer("rápida"))
+    
+    assert hedger.call(attempts, "gemini") == "rápida"
+    assert len(attempts.clocks) == 1
+    assert hedger.stats()["duplicadas"] == 0
+
+
+def test_no_hedge_before_enough_samples():
+    hedger = HedgedCalls(max_workers=4, min_delay=0.01, min_samples=10)
+    attempts = Attempts(answer("lenta", after=0.2))
+    
+    assert hedger.delay("gemini") is None
+    assert hedger.call(attempts, "gemini") == "lenta"
+    assert len(attempts.clocks) == 1
+
+
+def test_kinds_keep_separate_latency_histories():
+    hedger = warmed_up()
+    
+    assert hedger.delay("gemini") == pytest.approx(0.05)
+    assert hedger.delay("gemini (streaming)") is None
+
+
+def test_slow_call_is_hedged_and_first_finisher_wins():
+    hedger = warmed_up()
+    attempts = Attempts(answer("lenta", after=2), answer("duplicada"))
+    
+    started = time.monotonic()
+    assert hedger.call(attempts, "gemini") == "duplicada"
+    
+    assert time.monotonic() - started < 1
+    assert hedger.stats() == {"llamadas": 5, "duplicadas": 1, "ganadas": 1, "plazos_vencidos": 0}
+
+
+def test_original_can_still_win_after_the_hedge():
+    hedger = warmed_up()
+    attempts = Attempts(answer("original", after=0.1), answer("duplicada", after=2))
+    
+    assert hedger.call(attempts, "gemini") == "original"
+    assert hedger.stats()["duplicadas"] == 1
+    assert hedger.stats()["ganadas"] == 0
+
+
+def test_loser_is_abandoned():
+    hedger = warmed_up()
+    attempts = Attempts(answer("lenta", after=2), answer("duplicada"))
+    
+    hedger.call(attempts, "gemini")
+    
+    assert all(clock.abandoned.is_set() for clock in attempts.clocks)
+
+
+def test_unsent_duplicate_gives_up_without_sending():
+    hedger = warmed_up()
+    # The duplicate waits for a slot longer than the original takes to answer
+    attempts = Attempts(answer("original", after=0.15), answer("duplicada", queued=2))
+    
+    assert hedger.call(attempts, "gemini") == "original"
+    
+    time.sleep(0.05)
+    assert attempts.clocks[1].abandoned.is_set()
+    assert attempts.clocks[1].sent_at is None
+
+
+def test_a_failed_attempt_leaves_the_other_to_answer():
+    hedger = warmed_up()
+    attempts = Attempts(answer("original", after=0.2), fail(ConnectionError("corte")))
+    
+    assert hedger.call(attempts, "gemini") == "original"
+
+
+def test_first_error_is_raised_when_every_attempt_fails():
+    hedger = warmed_up()
+    
+    def slow_failure(clock):
+        clock.start()
+        time.sleep(0.1)
+        raise ValueError("primera")
+    
+    with pytest.raises(ValueError, match="primera"):
+        hedger.call(Attempts(slow_failure, fail(ValueError("segunda"))), "gemini")
+
+
+def test_hedges_are_capped_by_max_ratio():
+    hedger = warmed_up(calls=2, max_ratio=0.25, percentile=10)
+    
+    for _ in range(10):
+        hedger.call(Attempts(answer("lenta", after=0.3), answer("duplicada")), "gemini")
+    
+    stats = hedger.stats()
+    assert stats["llamadas"] == 12
+    assert 1 <= stats["duplicadas"] <= 0.25 * stats["llamadas"]
+
+
+def test_delay_is_none_once_the_cap_is_used_up():
+    hedger = warmed_up(calls=9, max_ratio=0.1)
+    
+    assert hedger.delay("gemini") is not None
+    hedger.call(Attempts(answer("lenta", after=2), answer("duplicada")), "gemini")
+    
+    assert hedger.stats()["duplicadas"] == 1
+    assert hedger.delay("gemini") is None
+
+
+def test_deadline_counts_from_sending_not_queueing():
+    hedger = HedgedCalls(max_workers=2, min_samples=100, deadline=0.2)
+    
+    # 0.3 s waiting for a slot + 0.1 s in flight: longer than the deadline, but not once sent
+    assert hedger.call(Attempts(answer("a tiempo", queued=0.3, after=0.1)), "gemini") == "a tiempo"
+    assert hedger.stats()["plazos_vencidos"] == 0
+
+
+def test_deadline_expires_for_a_slow_sent_request():
+    hedger = HedgedCalls(max_workers=2, min_samples=100, deadline=0.2)
+    attempts = Attempts(answer("tarde", after=2))
+    
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        hedger.call(attempts, "gemini")
+    
+    assert time.monotonic() - started < 1
+    assert hedger.stats()["plazos_vencidos"] == 1
+    assert attempts.clocks[0].abandoned.is_set()
+
+
+def test_backoff_does_not_count_toward_the_deadline():
+    hedger = HedgedCalls(max_workers=2, min_samples=100, deadline=0.2)
+    
+    def throttled_then_answers(clock):
+        clock.start()
+        time.sleep(0.1)
+        clock.pause()  # Throttled: backs off before retrying
+        time.sleep(0.3)
+        clock.start()
+        time.sleep(0.1)
+        return "reintento"
+    
+    assert hedger.call(throttled_then_answers, "gemini") == "reintento"
+
+
+def test_stream_is_passed_through_without_hedging():
+    hedger = HedgedCalls(max_workers=2, min_samples=100)
+    
+    assert list(hedger.stream(Attempts(stream("a", "b", "c")), "gemini")) == ["a", "b", "c"]
+
+
+def test_slow_stream_is_hedged_and_first_to_produce_wins():
+    hedger = warmed_up()
+    for _ in range(4):
+        list(hedger.stream(stream("x"), "gemini (streaming)"))
+    attempts = Attempts(stream("lenta", after=2), stream("a", "b"))
+    
+    started = time.monotonic()
+    assert list(hedger.stream(attempts, "gemini (streaming)")) == ["a", "b"]
+    
+    assert time.monotonic() - started < 1
+    assert all(clock.abandoned.is_set() for clock in attempts.clocks)
+    assert hedger.stats()["ganadas"] == 1
+
+
+def test_stream_deadline_counts_from_sending():
+    hedger = HedgedCalls(max_workers=2, min_samples=100, deadline=0.2)
+    
+    assert list(hedger.stream(Attempts(stream("a", queued=0.3, after=0.1)), "gemini")) == ["a"]
+    with pytest.raises(TimeoutError):
+        list(hedger.stream(Attempts(stream("a", after=2)), "gemini"))
+
+
+def test_error_of_the_winning_stream_is_raised():
+    hedger = HedgedCalls(max_workers=2, min_samples=100)
+    
+    def breaks(clock):
+        clock.start()
+        yield "a"
+        raise ConnectionError("corte")
+    
+    received = []
+    with pytest.raises(ConnectionError):
+        for item in hedger.stream(Attempts(breaks), "gemini"):
+            received.append(item)
+    assert received == ["a"]
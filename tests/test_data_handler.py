@@ -0,0 +1,22 @@
+"""
+Tests for DataHandler
+"""
+from openpyxl import load_workbook
+
+from modules.data_handler import DataHandler
+from modules.result_store import IMAGES_SEPARATOR
+
+
+def test_excel_export_keeps_the_erp_columns(tmp_path):
+    handler = DataHandler()
+    handler.add_result("a.jpg", {"nombre": "Leche", "imagenes": ["a.jpg", "b.jpg"]})
+    output_path = tmp_path / "resultados.xlsx"
+    
+    assert handler.export_to_excel(output_path)
+    
+    header, row = load_workbook(output_path).active.iter_rows(values_only=True)
+    assert "imagenes" not in header
+    assert len(header) == 13
+    assert row[header.index("imagen")] == "a.jpg"
+    # Still available to the app's "Evidencia Visual" panel
+    assert handler.get_dataframe().at[0, "imagenes"] == IMAGES_SEPARATOR.join(["a.jpg", "b.jpg"])
@@ -0,0 +1,109 @@
+"""
+Tests for ProductDeduplicator
+"""
+import difflib
+
+import pytest
+
+from modules.dedup import ProductDeduplicator
+
+LECHE = {"nombre": "Leche Entera", "detalle": "1L", "proveedor": "Soprole"}
+
+
+def test_barcode_key_needs_a_plausible_barcode():
+    assert ProductDeduplicator.barcode_key({"codigoBarras": "780 1234-5678"}) == "barcode:78012345678"
+    assert ProductDeduplicator.barcode_key({"codigoBarras": "1234567"}) is None
+    assert ProductDeduplicator.barcode_key({"nombre": "Leche"}) is None
+
+
+def test_same_barcode_merges_despite_different_names():
+    deduplicator = ProductDeduplicator()
+    
+    first = deduplicator.add("a.jpg", {"nombre": "Leche Entera", "codigoBarras": "7801234567890"})
+    assert deduplicator.add("b.jpg", {"nombre": "Leche Ent. Soprole", "codigoBarras": "7801234567890"}) is None
+    
+    assert first["imagenes"] == ["a.jpg", "b.jpg"]
+    assert len(deduplicator) == 1
+
+
+def test_later_barcode_is_learned_from_a_name_match():
+    deduplicator = ProductDeduplicator()
+    
+    first = deduplicator.add("a.jpg", dict(LECHE))
+    assert deduplicator.add("b.jpg", dict(LECHE, codigoBarras="7801234567890")) is None
+    assert deduplicator.add("c.jpg", {"nombre": "Otra lectura", "codigoBarras": "7801234567890"}) is None
+    
+    assert first["codigoBarras"] == "7801234567890"
+    assert first["imagenes"] == ["a.jpg", "b.jpg", "c.jpg"]
+
+
+def test_name_key_ignores_case_accents_and_detail_spaces():
+    assert ProductDeduplicator.name_key({"nombre": "Léche  ENTERA", "detalle": "1 L", "proveedor": "soprole"}) == \
+        ProductDeduplicator.name_key(LECHE)
+
+
+def test_different_detail_is_a_different_product():
+    deduplicator = ProductDeduplicator()
+    
+    assert deduplicator.add("a.jpg", dict(LECHE)) is not None
+    assert deduplicator.add("a.jpg", dict(LECHE, detalle="2L")) is not None
+    assert len(deduplicator) == 2
+
+
+def test_duplicate_fills_missing_fields_and_accumulates_images():
+    deduplicator = ProductDeduplicator()
+    
+    first = deduplicator.add("a.jpg", {"nombre": "Leche Entera", "detalle": "1L", "proveedor": "Soprole"})
+    deduplicator.add("b.jpg", dict(LECHE, categoria="lacteo"))
+    deduplicator.add("b.jpg", dict(LECHE, categoria="comida"))
+    deduplicator.add("c.jpg", dict(LECHE))
+    
+    assert first["imagenes"] == ["a.jpg", "b.jpg", "c.jpg"]
+    assert first["categoria"] == "lacteo"
+    assert deduplicator.stats() == {"unicos": 1, "duplicados": 3, "aproximados": 0}
+
+
+def test_first_sighting_is_copied():
+    product = dict(LECHE)
+    
+    kept = ProductDeduplicator().add("a.jpg", product)
+    
+    assert kept is not product
+    assert "imagenes" not in product
+
+
+def test_exact_matching_ignores_similar_names():
+    deduplicator = ProductDeduplicator()
+    
+    deduplicator.add("a.jpg", dict(LECHE))
+    assert deduplicator.add("b.jpg", dict(LECHE, nombre="Leche Enteru")) is not None
+
+
+def similarity(first: dict, second: dict) -> float:
+    return difflib.SequenceMatcher(
+        None, ProductDeduplicator.name_key(first), ProductDeduplicator.name_key(second), autojunk=False
+    ).ratio()
+
+
+@pytest.mark.parametrize("offset, merged", [(-0.01, True), (0.0, True), (0.01, False)])
+def test_fuzzy_threshold(offset, merged):
+    misread = dict(LECHE, nombre="Leche Enteru")
+    deduplicator = ProductDeduplicator(fuzzy=True, fuzzy_threshold=similarity(LECHE, misread) + offset)
+    
+    first = deduplicator.add("a.jpg", dict(LECHE))
+    result = deduplicator.add("b.jpg", misread)
+    
+    assert (result is None) == merged
+    assert first["imagenes"] == (["a.jpg", "b.jpg"] if merged else ["a.jpg"])
+    assert deduplicator.fuzzy_matches == (1 if merged else 0)
+
+
+def test_fuzzy_match_picks_the_most_similar_product():
+    deduplicator = ProductDeduplicator(fuzzy_threshold=0.8)
+    enterb = deduplicator.add("a.jpg", dict(LECHE, nombre="Leche Enterb"))
+    entera = deduplicator.add("a.jpg", dict(LECHE))
+    deduplicator.fuzzy = True
+    
+    assert deduplicator.add("b.jpg", dict(LECHE, nombre="Leche Entera.")) is None
+    assert entera["imagenes"] == ["a.jpg", "b.jpg"]
+    assert enterb["imagenes"] == ["a.jpg"]
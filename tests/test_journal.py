@@ -0,0 +1,180 @@
+"""
+Tests for RunJournal
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+from modules.journal import RunJournal
+from modules.ocr import OCRProcessor
+from modules.pipeline import ScanPipeline
+
+LECHE = {"nombre": "Leche"}
+PAN = {"nombre": "Pan"}
+DATOS = {"codigoBarras": "780"}
+
+
+@pytest.fixture
+def path(tmp_path) -> Path:
+    return tmp_path / "corrida.journal.jsonl"
+
+
+def write_events(path: Path, *events, tail: str = ""):
+    with open(path, "w", encoding="utf-8") as handle:
+        for event in events:
+            handle.write(json.dumps(event, ensure_ascii=False) + "\n")
+        handle.write(tail)
+
+
+def ocr(image, products):
+    return {"tipo": "ocr", "imagen": image, "productos": products}
+
+
+def product(image, index, product_dict, data):
+    return {"tipo": "producto", "imagen": image, "indice": index, "producto": product_dict, "datos": data}
+
+
+def done(image):
+    return {"tipo": "imagen_completa", "imagen": image}
+
+
+def test_new_journal_starts_empty(path):
+    write_events(path, ocr("a.jpg", [LECHE]), done("a.jpg"))
+    
+    journal = RunJournal(path)
+    journal.close()
+    
+    assert path.read_text(encoding="utf-8") == ""
+    assert journal.completed == {} and journal.ocr_products == {}
+
+
+def test_partial_runs_rebuild_resume_state(path):
+    write_events(
+        path,
+        # Complete image, product events written out of order
+        ocr("a.jpg", [LECHE, PAN]),
+        product("a.jpg", 1, PAN, None),
+        product("a.jpg", 0, LECHE, DATOS),
+        done("a.jpg"),
+        # OCR done, one of two products enriched
+        ocr("b.jpg", [LECHE, PAN]),
+        product("b.jpg", 0, LECHE, DATOS),
+        # Nothing found in the image
+        ocr("c.jpg", [{"nombre": "NO_DETECTADO"}]),
+        done("c.jpg"),
+    )
+    
+    journal = RunJournal(path, resume=True)
+    journal.close()
+    
+    assert journal.completed == {
+        "a.jpg": [(0, LECHE, DATOS), (1, PAN, None)],
+        "c.jpg": [],
+    }
+    assert journal.ocr_results == {"b.jpg": [LECHE, PAN]}
+    assert journal.ocr_products == {
+        "a.jpg": [LECHE, PAN],
+        "b.jpg": [LECHE, PAN],
+        "c.jpg": [{"nombre": "NO_DETECTADO"}],
+    }
+
+
+@pytest.mark.parametrize("tail", ['{"tipo": "imagen_completa", "imag', "\x00\x00\x00", "basura sin cerrar"])
+def test_torn_last_line_is_ignored(path, tail):
+    write_events(path, ocr("a.jpg", [LECHE]), product("a.jpg", 0, LECHE, DATOS), tail=tail)
+    
+    journal = RunJournal(path, resume=True)
+    journal.close()
+    
+    assert journal.completed == {}
+    assert journal.ocr_results == {"a.jpg": [LECHE]}
+
+
+def test_garbage_line_in_the_middle_is_skipped(path):
+    write_events(path, ocr("a.jpg", [LECHE]))
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write("{no es json\n")
+        handle.write(json.dumps(done("a.jpg")) + "\n")
+    
+    journal = RunJournal(path, resume=True)
+    journal.close()
+    
+    assert journal.completed == {"a.jpg": []}
+
+
+def test_events_appended_after_a_torn_line_survive(path):
+    write_events(path, ocr("a.jpg", [LECHE]), tail='{"tipo": "producto", "imag')
+    
+    journal = RunJournal(path, resume=True)
+    journal.record_product("a.jpg", 0, LECHE, DATOS)
+    journal.record_image_done("a.jpg")
+    journal.close()
+    
+    journal = RunJournal(path, resume=True)
+    journal.close()
+    
+    assert journal.completed == {"a.jpg": [(0, LECHE, DATOS)]}
+
+
+def test_products_without_ocr_event_are_not_resumed(path):
+    # Streaming OCR journals products before the image's ocr event
+    write_events(path, product("a.jpg", 0, LECHE, DATOS), product("a.jpg", 1, PAN, None))
+    
+    journal = RunJournal(path, resume=True)
+    journal.close()
+    
+    assert "a.jpg" not in journal.completed
+    assert "a.jpg" not in journal.ocr_results
+    assert "a.jpg" not in journal.ocr_products
+
+
+class RecordingOCR:
+    """OCR stage that records which images were sent to it."""
+    
+    is_error = staticmethod(OCRProcessor.is_error)
+    stream = False
+    pack_size = 1
+    max_concurrency = 1
+    
+    def __init__(self, answers: dict):
+        self.answers = answers
+        self.analyzed = []
+    
+    def iter_batch(self, image_paths, max_workers=None, ordered=True):
+        for image_path in image_paths:
+            self.analyzed.append(image_path.name)
+            yield image_path, self.answers[image_path.name]
+
+
+class FakeClient:
+    def search_product(self, name):
+        return {"nombre": name}
+
+
+def test_resumed_run_only_reprocesses_unfinished_images(path):
+    write_events(
+        path,
+        ocr("a.jpg", [LECHE]),
+        product("a.jpg", 0, LECHE, DATOS),
+        done("a.jpg"),
+        # Crashed before the ocr event of b.jpg was written
+        product("b.jpg", 0, PAN, DATOS),
+    )
+    ocr_stage = RecordingOCR({"a.jpg": [LECHE], "b.jpg": [PAN]})
+    
+    journal = RunJournal(path, resume=True)
+    rows = ScanPipeline(ocr_stage, FakeClient(), off_workers=1).run(
+        [Path("a.jpg"), Path("b.jpg")], journal=journal
+    )
+    journal.close()
+    
+    assert ocr_stage.analyzed == ["b.jpg"]
+    assert [(image, item["nombre"], data) for image, item, data in rows] == [
+        ("a.jpg", "Leche", DATOS),
+        ("b.jpg", "Pan", {"nombre": "Pan"}),
+    ]
+    
+    resumed = RunJournal(path, resume=True)
+    resumed.close()
+    assert set(resumed.completed) == {"a.jpg", "b.jpg"}
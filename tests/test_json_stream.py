@@ -0,0 +1,135 @@
+"""
+Tests for JSONArrayStream
+"""
+import json
+
+import pytest
+
+from utils.json_stream import JSONArrayStream
+
+PRODUCTS = [
+    {"n": "Leche Entera", "d": "1L", "p": "Soprole", "c": "lacteo"},
+    {"n": 'Galletas "Tritón"', "d": "126 g", "p": "McKay", "c": "comida"},
+    {"n": "Jugo {naranja} [light]", "p": "Watt's\\Andina"},
+]
+
+
+def parse(*chunks) -> tuple[list, JSONArrayStream]:
+    parser = JSONArrayStream()
+    elements = []
+    for chunk in chunks:
+        elements.extend(parser.feed(chunk))
+    return elements, parser
+
+
+def test_whole_answer():
+    elements, parser = parse(json.dumps(PRODUCTS))
+    
+    assert elements == PRODUCTS
+    assert parser.started and parser.closed
+
+
+def test_elements_are_emitted_as_soon_as_they_close():
+    parser = JSONArrayStream()
+    
+    assert parser.feed('[{"n": "Leche"}, {"n": "Pa') == [{"n": "Leche"}]
+    assert parser.feed('n"}') == [{"n": "Pan"}]
+    assert parser.feed("]") == []
+    assert parser.closed
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_split_at_every_offset(indent):
+    text = json.dumps(PRODUCTS, ensure_ascii=False, indent=indent)
+    
+    for offset in range(len(text) + 1):
+        elements, parser = parse(text[:offset], text[offset:])
+        assert elements == PRODUCTS, offset
+        assert parser.closed
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(PRODUCTS, ensure_ascii=False)
+    
+    elements, parser = parse(*text)
+    
+    assert elements == PRODUCTS
+    assert parser.closed
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    products = [
+        {"n": 'Dice "hola]" y \\"no\\"'},
+        {"n": "llaves } { y corchetes ] [", "d": "\\\\"},
+        {"n": "barra final \\"},
+    ]
+    text = json.dumps(products)
+    
+    for offset in range(len(text) + 1):
+        assert parse(text[:offset], text[offset:])[0] == products, offset
+
+
+def test_nested_objects_and_arrays():
+    items = [
+        {"n": "Pack", "contenido": [{"n": "Lata", "d": ["350 ml", {"x": [1, [2, 3]]}]}]},
+        [1, 2, {"a": []}],
+        {},
+    ]
+    text = json.dumps(items)
+    
+    for offset in range(len(text) + 1):
+        assert parse(text[:offset], text[offset:])[0] == items, offset
+
+
+def test_scalar_elements():
+    assert parse("[1, -2.5e3, true, false, null, \"x\"]")[0] == [1, -2500.0, True, False, None, "x"]
+
+
+def test_text_before_the_array_is_ignored():
+    text = 'Aquí está la lista {"no": "esto"}:\n```json\n' + json.dumps(PRODUCTS) + "\n```"
+    
+    elements, parser = parse(text[:20], text[20:])
+    
+    assert elements == PRODUCTS
+    assert parser.closed
+
+
+def test_text_after_the_array_is_ignored():
+    elements, parser = parse('[{"n": "Leche"}]\n```', '\n[{"n": "otra"}]')
+    
+    assert elements == [{"n": "Leche"}]
+    assert parser.feed('[{"n": "más"}]') == []
+
+
+def test_truncated_array_stays_open():
+    text = json.dumps(PRODUCTS)
+    
+    elements, parser = parse(text[:text.index("Galletas")])
+    
+    assert elements == PRODUCTS[:1]
+    assert parser.started
+    assert not parser.closed
+
+
+def test_text_without_array():
+    elements, parser = parse("No se ve ningún producto.")
+    
+    assert elements == []
+    assert not parser.started and not parser.closed
+
+
+@pytest.mark.parametrize("text", ["[]", "[ ]", "```json\n[\n]\n```"])
+def test_empty_array(text):
+    elements, parser = parse(text)
+    
+    assert elements == []
+    assert parser.closed
+
+
+def test_trailing_comma_is_tolerated():
+    assert parse('[{"n": "Leche"},\n]')[0] == [{"n": "Leche"}]
+
+
+def test_invalid_element_raises():
+    with pytest.raises(ValueError):
+        parse("[{n: Leche}]")
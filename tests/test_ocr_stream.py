@@ -0,0 +1,150 @@
+"""
+Tests for OCRProcessor._stream_products, with Gemini replaced by canned answer chunks
+"""
+import pytest
+
+from modules.ocr import OCRProcessor
+
+LECHE = {"nombre": "Leche", "detalle": "1L", "proveedor": "Soprole", "categoria": "lacteo"}
+PAN = {"nombre": "Pan", "detalle": "", "proveedor": "", "categoria": ""}
+
+
+class FakeCache:
+    """OCR cache that records what is stored."""
+    
+    def __init__(self):
+        self.stored = {}
+    
+    def get(self, key):
+        return self.stored.get(key)
+    
+    def put(self, key, products):
+        self.stored[key] = products
+
+
+def make_processor(answers: dict, tiered: bool = False) -> OCRProcessor:
+    """
+    Build a processor whose Gemini stream answers from canned chunks.
+    
+    Args:
+        answers: Model tier index -> list of chunks, or an exception to raise
+            after yielding the chunks before it
+        tiered: Whether to use the fast model first
+    """
+    processor = OCRProcessor(
+        api_key="clave-de-prueba", cache=FakeCache(), tiered=tiered, tile=False, stream=True, hedge=False
+    )
+    processor.calls = []
+    
+    def call_stream(contents, model):
+        tier = processor.tiers.index(model)
+        processor.calls.append(tier)
+        for chunk in answers[tier]:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    
+    processor._call_stream = call_stream
+    return processor
+
+
+def stream(processor: OCRProcessor, image_bytes: bytes) -> list:
+    return list(processor._stream_products(image_bytes, "gondola.jpg"))
+
+
+def test_products_are_translated_and_cached(image_bytes):
+    processor = make_processor({0: ['```json\n[{"n": "Leche", "d": "1L", "p": "Sop', 'role", "c": "lacteo"}, {"n": "Pan"}]\n```']})
+    
+    assert stream(processor, image_bytes) == [LECHE, PAN]
+    assert list(processor.cache.stored.values()) == [[LECHE, PAN]]
+    assert processor.get_latency_summary()["peticiones"] == 1
+
+
+def test_incomplete_answer_keeps_products_without_caching(image_bytes):
+    processor = make_processor({0: ['[{"n": "Leche", "d": "1L", "p": "Soprole", "c": "lacteo"}, {"n": "Pa']})
+    
+    assert stream(processor, image_bytes) == [LECHE]
+    assert processor.cache.stored == {}
+
+
+def test_incomplete_answer_without_products_is_an_error(image_bytes):
+    processor = make_processor({0: ['[{"n": "Le']})
+    
+    assert stream(processor, image_bytes) == [{"nombre": "ERROR", "error": "Respuesta incompleta"}]
+    assert processor.cache.stored == {}
+
+
+def test_incomplete_fast_answer_escalates_before_any_product(image_bytes):
+    processor = make_processor({0: ['[{"n": "Le'], 1: ['[{"n": "Pan"}]']}, tiered=True)
+    
+    assert stream(processor, image_bytes) == [PAN]
+    assert processor.calls == [0, 1]
+    assert processor.get_tier_summary()[processor.tiers[0]]["escaladas"] == 1
+
+
+def test_incomplete_fast_answer_is_not_escalated_after_a_product(image_bytes):
+    processor = make_processor({0: ['[{"n": "Pan"}, {"n": "Le'], 1: ['[{"n": "Leche"}]']}, tiered=True)
+    
+    assert stream(processor, image_bytes) == [PAN]
+    assert processor.calls == [0]
+    assert processor.cache.stored == {}
+
+
+@pytest.mark.parametrize("chunks", [["[]"], ["```json\n[", "\n]\n```"]])
+def test_empty_answer_is_no_detectado(image_bytes, chunks):
+    processor = make_processor({0: chunks})
+    
+    assert stream(processor, image_bytes) == [{"nombre": "NO_DETECTADO"}]
+    assert list(processor.cache.stored.values()) == [[{"nombre": "NO_DETECTADO"}]]
+
+
+def test_empty_fast_answer_escalates(image_bytes):
+    processor = make_processor({0: ["[]"], 1: ["[]"]}, tiered=True)
+    
+    assert stream(processor, image_bytes) == [{"nombre": "NO_DETECTADO"}]
+    assert processor.calls == [0, 1]
+
+
+def test_all_nameless_answer_is_an_error(image_bytes):
+    processor = make_processor({0: ['[{"n": ""}, {"d": "1L"}, {"n": "  ", "p": "Soprole"}]']})
+    
+    assert stream(processor, image_bytes) == [{"nombre": "ERROR", "error": "Formato inválido"}]
+    assert processor.cache.stored == {}
+
+
+def test_all_nameless_fast_answer_escalates(image_bytes):
+    processor = make_processor({0: ['[{"n": ""}, {"d": "1L"}]'], 1: ['[{"n": "Pan"}]']}, tiered=True)
+    
+    assert stream(processor, image_bytes) == [PAN]
+    assert processor.calls == [0, 1]
+
+
+def test_nameless_entries_are_skipped(image_bytes):
+    processor = make_processor({0: ['[{"n": ""}, {"n": "Pan"}]']})
+    
+    assert stream(processor, image_bytes) == [PAN]
+
+
+def test_answer_that_is_not_an_array_goes_through_the_regular_parser(image_bytes):
+    processor = make_processor({0: ['{"n": "Pan"}']})
+    
+    assert OCRProcessor.is_error(stream(processor, image_bytes))
+
+
+def test_failed_fast_stream_escalates(image_bytes):
+    processor = make_processor({0: [ConnectionError("corte")], 1: ['[{"n": "Pan"}]']}, tiered=True)
+    
+    assert stream(processor, image_bytes) == [PAN]
+
+
+def test_broken_stream_keeps_yielded_products(image_bytes):
+    processor = make_processor({0: ['[{"n": "Pan"}, ', ConnectionError("corte")]})
+    
+    assert stream(processor, image_bytes) == [PAN]
+    assert processor.cache.stored == {}
+
+
+def test_broken_stream_without_products_is_an_error(image_bytes):
+    processor = make_processor({0: [ConnectionError("corte")]})
+    
+    assert stream(processor, image_bytes) == ["ERROR"]
@@ -0,0 +1,177 @@
+"""
+Tests for how OCRProcessor recognizes and retries throttled Gemini calls
+"""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+import config
+from modules.ocr import OCRProcessor
+
+PAN = {"nombre": "Pan", "detalle": "", "proveedor": "", "categoria": ""}
+
+
+class FakeAPIError(Exception):
+    """Gemini SDK error with an HTTP status and optional Retry-After header."""
+    
+    def __init__(self, code, message="", retry_after=None):
+        super().__init__(message or f"{code} error")
+        self.code = code
+        self.response = SimpleNamespace(headers={"Retry-After": retry_after} if retry_after is not None else {})
+
+
+@pytest.fixture
+def processor(monkeypatch) -> OCRProcessor:
+    """Single-key processor whose Gemini requests are scripted by the test."""
+    monkeypatch.setattr(config, "OCR_MAX_RETRIES", 3)
+    processor = OCRProcessor(
+        api_key="clave-de-prueba", tiered=False, tile=False, stream=False, hedge=False, adaptive=True, concurrency=4
+    )
+    processor.outcomes = []
+    processor.requests = 0
+    
+    def next_outcome():
+        processor.requests += 1
+        outcome = processor.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    
+    def request(contents, key, model, schema):
+        return next_outcome()
+    
+    def request_stream(contents, key, model, schema):
+        for chunk in next_outcome():
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    
+    processor._request = request
+    processor._request_stream = request_stream
+    return processor
+
+
+@pytest.mark.parametrize("error, throttled", [
+    (FakeAPIError(429), True),
+    (FakeAPIError(503), True),
+    (FakeAPIError(400), False),
+    (FakeAPIError(500), False),
+    (Exception("429 RESOURCE_EXHAUSTED. Quota exceeded"), True),
+    (Exception("503 UNAVAILABLE. The model is overloaded"), True),
+    (Exception("HTTP 429"), True),
+    (Exception("Producto 4290 no encontrado"), False),
+    (Exception("400 INVALID_ARGUMENT"), False),
+])
+def test_is_throttled(error, throttled):
+    assert OCRProcessor._is_throttled(error) == throttled
+
+
+def test_status_code_wins_over_the_message():
+    assert not OCRProcessor._is_throttled(FakeAPIError(400, "mentions 429 in passing"))
+
+
+def test_retry_after_seconds_header():
+    assert OCRProcessor._retry_after(FakeAPIError(429, retry_after="7")) == 7.0
+
+
+def test_retry_after_date_header():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    
+    assert OCRProcessor._retry_after(FakeAPIError(429, retry_after=format_datetime(when, usegmt=True))) == \
+        pytest.approx(30, abs=2)
+
+
+@pytest.mark.parametrize("message, delay", [
+    ('429 RESOURCE_EXHAUSTED {"retryDelay": "17s"}', 17.0),
+    ("Please retry in 2.5s.", 2.5),
+    ("429 RESOURCE_EXHAUSTED", None),
+])
+def test_retry_after_from_the_error_text(message, delay):
+    assert OCRProcessor._retry_after(Exception(message)) == delay
+
+
+def test_retry_after_is_capped():
+    assert OCRProcessor._retry_after(FakeAPIError(429, retry_after="3600")) == config.OCR_BACKOFF_MAX
+
+
+def test_throttled_call_is_retried_not_an_error(processor, image_bytes):
+    processor.outcomes = [FakeAPIError(429, retry_after="0"), FakeAPIError(503, retry_after="0"), '[{"n": "Pan"}]']
+    
+    assert processor.process_image(image_bytes) == [PAN]
+    assert processor.requests == 3
+    summary = processor.get_concurrency_summary()
+    assert summary["reintentos"] == 2
+    assert summary["abandonadas"] == 0
+    assert summary["limitaciones"] == 2
+
+
+def test_throttle_shrinks_the_key_limit(processor, image_bytes):
+    processor.outcomes = [FakeAPIError(429, retry_after="0"), '[{"n": "Pan"}]']
+    
+    processor.process_image(image_bytes)
+    
+    assert processor.key_pool.stats()["claves"][0]["limite"] == 2
+
+
+def test_backoff_without_retry_after_is_jittered_and_bounded(processor, image_bytes, monkeypatch):
+    delays = []
+    monkeypatch.setattr("modules.ocr.time.sleep", delays.append)
+    processor.outcomes = [FakeAPIError(429), FakeAPIError(429), FakeAPIError(429), '[{"n": "Pan"}]']
+    
+    assert processor.process_image(image_bytes) == [PAN]
+    
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= config.OCR_BACKOFF_BASE * 2 ** attempt
+
+
+def test_other_errors_are_not_retried(processor, image_bytes):
+    processor.outcomes = [FakeAPIError(400, "400 INVALID_ARGUMENT"), '[{"n": "Pan"}]']
+    
+    assert OCRProcessor.is_error(processor.process_image(image_bytes))
+    assert processor.requests == 1
+    assert processor.retries == 0
+
+
+def test_throttle_after_the_last_retry_is_an_error(processor, image_bytes):
+    processor.outcomes = [FakeAPIError(429, retry_after="0")] * (config.OCR_MAX_RETRIES + 1)
+    
+    assert OCRProcessor.is_error(processor.process_image(image_bytes))
+    assert processor.requests == config.OCR_MAX_RETRIES + 1
+    assert processor.throttle_failures == 1
+
+
+def test_stream_throttled_before_any_text_is_retried(processor, image_bytes):
+    processor.stream = True
+    processor.outcomes = [[FakeAPIError(429, retry_after="0")], ['[{"n": "Pa', 'n"}]']]
+    
+    assert list(processor.iter_products(image_bytes)) == [PAN]
+    assert processor.retries == 1
+
+
+def test_stream_throttled_after_text_is_not_retried(processor, image_bytes):
+    processor.stream = True
+    processor.outcomes = [['[{"n": "Pan"}, ', FakeAPIError(429, retry_after="0")], ['[{"n": "Otro"}]']]
+    
+    assert list(processor.iter_products(image_bytes)) == [PAN]
+    assert processor.requests == 1
+    assert processor.throttle_failures == 1
+
+
+def test_several_keys_retry_on_another_key_without_waiting(monkeypatch, image_bytes):
+    monkeypatch.setattr(config, "OCR_MAX_RETRIES", 3)
+    processor = OCRProcessor(api_keys=["clave-uno-1111", "clave-dos-2222"], tiered=False, tile=False, stream=False)
+    used = []
+    
+    def request(contents, key, model, schema):
+        used.append(key.api_key)
+        if len(used) == 1:
+            raise FakeAPIError(429, retry_after="30")
+        return '[{"n": "Pan"}]'
+    
+    processor._request = request
+    
+    assert processor.process_image(image_bytes) == [PAN]
+    assert used[0] != used[1]
@@ -0,0 +1,70 @@
+"""
+Tests for ScanPipeline
+"""
+import threading
+from pathlib import Path
+
+import pytest
+
+from modules.ocr import OCRProcessor
+from modules.pipeline import ScanPipeline
+
+
+class FakeOCR:
+    """OCR stage answering from a fixed image name -> product list map."""
+    
+    is_error = staticmethod(OCRProcessor.is_error)
+    
+    def __init__(self, answers: dict, stream: bool = False):
+        self.answers = answers
+        self.stream = stream
+        self.pack_size = 1
+        self.max_concurrency = 2
+    
+    def iter_batch(self, image_paths, max_workers=None, ordered=True):
+        for image_path in image_paths:
+            yield image_path, self.answers[image_path.name]
+    
+    def iter_products(self, image_path):
+        yield from self.answers[image_path.name]
+
+
+class FakeClient:
+    """Open Food Facts client that finds every product."""
+    
+    def search_product(self, name):
+        return {"nombre": name, "codigoBarras": "000"}
+
+
+def enrichment_threads() -> list:
+    return [thread for thread in threading.enumerate() if thread.name.startswith("off-")]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_run_returns_rows_in_image_order(stream):
+    answers = {
+        "a.jpg": [{"nombre": "Leche"}, {"nombre": "Pan"}],
+        "b.jpg": [{"nombre": "Queso"}],
+    }
+    pipeline = ScanPipeline(FakeOCR(answers, stream=stream), FakeClient(), off_workers=3)
+    
+    rows = pipeline.run([Path("a.jpg"), Path("b.jpg")])
+    
+    assert [(image, product["nombre"]) for image, product, _ in rows] == [
+        ("a.jpg", "Leche"), ("a.jpg", "Pan"), ("b.jpg", "Queso")
+    ]
+    assert all(data["codigoBarras"] == "000" for _, _, data in rows)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_failing_callback_stops_enrichment_workers(stream):
+    answers = {"a.jpg": [{"nombre": "Leche"}], "b.jpg": [{"nombre": "Pan"}]}
+    pipeline = ScanPipeline(FakeOCR(answers, stream=stream), FakeClient(), off_workers=3)
+    
+    def on_image(image_path, product_list):
+        raise RuntimeError("fallo del llamador")
+    
+    with pytest.raises(RuntimeError):
+        pipeline.run([Path("a.jpg"), Path("b.jpg")], on_image=on_image)
+    
+    assert enrichment_threads() == []
@@ -0,0 +1,141 @@
+"""
+Tests for panorama tile planning
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from modules.tiling import _axis_starts, crop_tiles, plan_tiles, upright_size
+
+# Small tiles keep the numbers readable: two tiles sharing 15% span 1850 px
+TILE = 1000
+OVERLAP = 0.15
+OVERLAP_PX = 150
+TWO_TILES = 2 * TILE - OVERLAP_PX
+
+
+def plan(width, height, **options):
+    options = {"tile_size": TILE, "overlap": OVERLAP, "max_tiles": 8, "min_aspect": 2.0, **options}
+    return plan_tiles((width, height), **options)
+
+
+def jpeg(width, height, orientation=None) -> bytes:
+    buffer = BytesIO()
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    Image.new("RGB", (width, height), "white").save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def assert_covers(boxes, width, height, tile=TILE, overlap_px=OVERLAP_PX):
+    """Boxes start at 0, end flush with the edges and overlap each neighbour enough."""
+    lefts = sorted({box[0] for box in boxes})
+    uppers = sorted({box[1] for box in boxes})
+    assert lefts[0] == 0 and uppers[0] == 0
+    assert max(box[2] for box in boxes) == width
+    assert max(box[3] for box in boxes) == height
+    for box in boxes:
+        assert box[2] - box[0] == min(tile, width)
+        assert box[3] - box[1] == min(tile, height)
+    for starts in (lefts, uppers):
+        for before, after in zip(starts, starts[1:]):
+            assert 0 < after - before <= tile - overlap_px
+
+
+def test_aspect_just_below_the_minimum_is_not_tiled():
+    assert plan(1999, 1000) == []
+    assert plan(3998, 2000) == []
+
+
+@pytest.mark.parametrize("width", [2000, 2001])
+def test_aspect_at_or_above_the_minimum_is_tiled(width):
+    boxes = plan(width, 1000)
+    
+    assert len(boxes) == 3
+    assert_covers(boxes, width, 1000)
+
+
+def test_long_side_under_two_tiles_is_not_tiled():
+    # Wide enough, but the two tiles would overlap by more than half
+    assert plan(TWO_TILES - 1, 900) == []
+
+
+def test_panorama_exactly_two_tiles_wide():
+    boxes = plan(TWO_TILES, 900)
+    
+    assert boxes == [(0, 0, TILE, 900), (TWO_TILES - TILE, 0, TWO_TILES, 900)]
+    assert boxes[0][2] - boxes[1][0] == OVERLAP_PX
+
+
+def test_portrait_panorama_is_tiled_top_to_bottom():
+    boxes = plan(900, TWO_TILES)
+    
+    assert boxes == [(0, 0, 900, TILE), (0, TWO_TILES - TILE, 900, TWO_TILES)]
+
+
+@pytest.mark.parametrize("width", range(TWO_TILES, 8000, 37))
+def test_last_tile_is_flush_with_the_edge(width):
+    boxes = plan(width, 900)
+    # Past eight tiles the tile grows; measure the one actually used
+    tile = boxes[0][2] - boxes[0][0]
+    
+    assert boxes[-1][2] == width
+    assert len(boxes) <= 8
+    assert_covers(boxes, width, 900, tile=tile, overlap_px=int(tile * OVERLAP))
+
+
+def test_boxes_are_in_reading_order():
+    boxes = plan(3000, 1400, min_aspect=2.0 * 1400 / 3000)
+    
+    assert [(box[1], box[0]) for box in boxes] == sorted((box[1], box[0]) for box in boxes)
+    assert len({box[1] for box in boxes}) == 2
+    assert_covers(boxes, 3000, 1400)
+
+
+def test_tiles_grow_to_stay_within_max_tiles():
+    boxes = plan(20000, 1000, max_tiles=8)
+    
+    assert 2 <= len(boxes) <= 8
+    tile = boxes[0][2] - boxes[0][0]
+    assert tile > TILE
+    assert_covers(boxes, 20000, 1000, tile=tile, overlap_px=int(tile * OVERLAP))
+
+
+def test_defaults_come_from_config():
+    assert plan_tiles((4000, 4000)) == []
+    assert plan_tiles((2049, 1000)) == []
+
+
+@pytest.mark.parametrize("length, starts", [
+    (900, [0]),
+    (1000, [0]),
+    (1850, [0, 850]),
+    (1851, [0, 426, 851]),
+    (2700, [0, 850, 1700]),
+])
+def test_axis_starts(length, starts):
+    assert _axis_starts(length, TILE, OVERLAP_PX) == starts
+
+
+def test_upright_size_without_exif():
+    assert upright_size(jpeg(300, 100)) == (300, 100)
+
+
+@pytest.mark.parametrize("orientation, size", [(1, (300, 100)), (3, (300, 100)), (6, (100, 300)), (8, (100, 300))])
+def test_upright_size_applies_the_exif_orientation(orientation, size):
+    assert upright_size(jpeg(300, 100, orientation)) == size
+
+
+def test_rotated_panorama_is_planned_and_cut_upright():
+    # Stored as a portrait, displayed as a landscape panorama
+    image_bytes = jpeg(900, TWO_TILES, orientation=6)
+    
+    size = upright_size(image_bytes)
+    boxes = plan(*size)
+    tiles = crop_tiles(image_bytes, boxes)
+    
+    assert size == (TWO_TILES, 900)
+    assert len(boxes) == 2
+    assert [Image.open(BytesIO(tile)).size for tile in tiles] == [(TILE, 900), (TILE, 900)]
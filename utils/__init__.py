@@ -1,8 +1,11 @@
 """
 Food Scanner - Utils Package
-Contains logging and progress utilities
+Contains logging, progress, text, JSON streaming and concurrency utilities
 """
 from .logger import setup_logger
 from .progress import ProgressTracker
+from .text import normalize_text
+from .json_stream import JSONArrayStream
+from .concurrency import AdaptiveLimiter, TokenBucket, SingleFlight, HedgedCalls
 
-__all__ = ["setup_logger", "ProgressTracker"]
+__all__ = ["setup_logger", "ProgressTracker", "normalize_text", "JSONArrayStream", "AdaptiveLimiter", "TokenBucket", "SingleFlight", "HedgedCalls"]
@@ -0,0 +1,608 @@
+"""
+Food Scanner - Concurrency Module
+Thread-safe primitives shared by the API clients
+"""
+import logging
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Mark the end of a hedged stream attempt, and the moment its request is sent
+_STREAM_END = object()
+_SENT = object()
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter."""
+    
+    def __init__(self, rate_per_minute: float, capacity: int = 1):
+        """
+        Initialize the bucket (starts full).
+        
+        Args:
+            rate_per_minute: Tokens added per minute
+            capacity: Maximum tokens that can accumulate (burst size)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """
+        Take one token, blocking until it is available.
+        
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                
+                delay = (1 - self._tokens) / self.rate
+            
+            time.sleep(delay)
+            waited += delay
+
+
+class SingleFlight:
+    """
+    Collapses calls that share a key: concurrent callers wait for the one
+    in-flight call, and later callers reuse its result. Failed calls are
+    forgotten so the next caller retries.
+    """
+    
+    class _Call:
+        """State of one keyed call."""
+        
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+    
+    def __init__(self):
+        """Initialize with no recorded calls."""
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.saved = 0
+    
+    def do(self, key, fn):
+        """
+        Run fn once per key and share its result.
+        
+        Args:
+            key: Hashable deduplication key
+            fn: Zero-argument callable producing the result
+            
+        Returns:
+            Result of fn (possibly from an earlier or concurrent call)
+            
+        Raises:
+            Exception: Whatever fn raised, for the caller and any waiters
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._Call()
+                self._calls[key] = call
+            else:
+                self.saved += 1
+        
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._calls.pop(key, None)
+            raise
+        finally:
+            call.done.set()
+        
+        return call.result
+    
+    def clear(self):
+        """Forget all completed calls."""
+        with self._lock:
+            self._calls = {key: call for key, call in self._calls.items() if not call.done.is_set()}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for calls to a rate-limited service.
+    
+    The limit grows by `increase` slots per full window of successful calls
+    and is multiplied by `decrease` when a call is throttled, so concurrency
+    settles just below what the service accepts. Throttles reported by calls
+    that started before the last decrease do not shrink the limit again.
+    """
+    
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: Optional[int] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5
+    ):
+        """
+        Initialize the limiter.
+        
+        Args:
+            initial: Starting number of concurrent calls
+            minimum: Lowest limit a decrease can reach
+            maximum: Highest limit an increase can reach (default: initial)
+            increase: Slots added per window of successful calls
+            decrease: Factor applied to the limit on a throttled call
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.increase = increase
+        self.decrease = decrease
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self._in_flight = 0
+        self._generation = 0  # Bumped on every decrease
+        self._resume_at = 0.0  # Monotonic time before which no call may start
+        self._cond = threading.Condition()
+        
+        self.successes = 0
+        self.throttles = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+        self.waited = 0.0
+    
+    @property
+    def limit(self) -> int:
+        """Current number of calls allowed at once."""
+        return int(self._limit)
+    
+    @property
+    def load(self) -> float:
+        """Fraction of the current limit in use."""
+        with self._cond:
+            return self._in_flight / int(self._limit)
+    
+    @property
+    def paused_until(self) -> float:
+        """Monotonic time at which a Retry-After pause ends (in the past if none is active)."""
+        return self._resume_at
+    
+    def acquire(self) -> int:
+        """
+        Take a call slot, blocking while the limit is reached or a Retry-After pause is active.
+        
+        Returns:
+            Ticket to pass to release()
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._resume_at:
+                    self._cond.wait(self._resume_at - now)
+                elif self._in_flight >= int(self._limit):
+                    self._cond.wait()
+                else:
+                    break
+            
+            self._in_flight += 1
+            self.waited += time.monotonic() - start
+            return self._generation
+    
+    def try_acquire(self) -> Optional[int]:
+        """
+        Take a call slot only if one is free right now.
+        
+        Returns:
+            Ticket to pass to release(), or None if the limit is reached or a pause is active
+        """
+        with self._cond:
+            if time.monotonic() < self._resume_at or self._in_flight >= int(self._limit):
+                return None
+            self._in_flight += 1
+            return self._generation
+    
+    def release(self, ticket: int, throttled: bool = False, retry_after: Optional[float] = None):
+        """
+        Return a call slot and adjust the limit from its outcome.
+        
+        Args:
+            ticket: Value returned by acquire()
+            throttled: True if the service rejected the call as over quota or overloaded
+            retry_after: Seconds the service asked to wait before the next call
+        """
+        with self._cond:
+            self._in_flight -= 1
+            
+            if throttled:
+                self.throttles += 1
+                if retry_after:
+                    self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+                if ticket == self._generation:
+                    self._generation += 1
+                    self._limit = max(self.minimum, self._limit * self.decrease)
+                    self.decreases += 1
+            else:
+                self.successes += 1
+                self._limit = min(self.maximum, self._limit + self.increase / self._limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+            
+            self._cond.notify_all()
+    
+    def stats(self) -> dict:
+        """
+        Get limiter statistics.
+        
+        Returns:
+            Dictionary with current/peak limit, calls in flight, outcome counts and time spent waiting
+        """
+        with self._cond:
+            return {
+                "limite": self.limit,
+                "limite_max": self.peak_limit,
+                "en_curso": self._in_flight,
+                "exitos": self.successes,
+                "limitaciones": self.throttles,
+                "reducciones": self.decreases,
+                "espera_s": self.waited,
+            }
+
+
+class AttemptClock:
+    """
+    Timing of one hedged attempt, shared with the thread that runs it.
+    
+    The attempt calls start() when its request is sent and pause() when the
+    request fails, so the clock only runs while a request is in flight:
+    waiting for a slot or backing off after a throttle is not latency.
+    """
+    
+    def __init__(self, on_change: Callable[[], None]):
+        """
+        Initialize a stopped clock.
+        
+        Args:
+            on_change: Called (from the attempt's thread) when the clock starts or pauses
+        """
+        self.sent_at = None  # Monotonic time the current request was sent; None while not in flight
+        self.abandoned = threading.Event()  # Set once the attempt's answer is no longer wanted
+        self._on_change = on_change
+    
+    def start(self):
+        """Mark the request as sent."""
+        self.sent_at = time.monotonic()
+        self._on_change()
+    
+    def pause(self):
+        """Mark the request as answered with an error (it may be retried after a backoff)."""
+        self.sent_at = None
+        self._on_change()
+
+
+class HedgedCalls:
+    """
+    Hedged requests for a service with a long latency tail.
+    
+    Each call starts as one attempt. Once that attempt's request has been in
+    flight longer than the recent `percentile` latency of calls of the same
+    kind, a duplicate attempt is started and the first to answer wins; the
+    other is abandoned. Duplicates are capped at `max_ratio` of calls.
+    
+    Attempts are callables taking an AttemptClock. They must call its
+    start() when their request is sent and pause() when it fails, and give
+    up without sending once it is abandoned. The hedge delay and the
+    deadline both count from start(), so calls waiting for a slot are
+    neither duplicated nor timed out.
+    """
+    
+    def __init__(
+        self,
+        max_workers: int,
+        percentile: int = 95,
+        max_ratio: float = 0.1,
+        min_delay: float = 1.0,
+        min_samples: int = 10,
+        window: int = 100,
+        deadline: Optional[float] = None
+    ):
+        """
+        Initialize with no latency history.
+        
+        Args:
+            max_workers: Threads running attempts, shared by every call
+            percentile: Recent latency percentile (1-99) after which a call gets a duplicate
+            max_ratio: Highest fraction of calls that may get a duplicate
+            min_delay: Seconds a request is always given before it is duplicated
+            min_samples: Latencies of a kind observed before its calls are hedged
+            window: Recent latencies kept per kind
+            deadline: Seconds a sent request may take before the call fails (None = no limit)
+        """
+        self.max_workers = max_workers
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.deadline = deadline
+        self._recent = {}  # kind -> recent latencies in seconds
+        self._executor = None
+        self._lock = threading.Lock()
+        
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.deadlines = 0
+    
+    def delay(self, kind: str) -> Optional[float]:
+        """
+        Decide how long a request of a kind may be in flight before it gets a duplicate.
+        
+        Args:
+            kind: Call kind; each kind keeps its own latency history
+        
+        Returns:
+            Seconds after the request is sent, or None if the call should not
+            be hedged (too few latency samples yet, or the max_ratio cap is used up)
+        """
+        with self._lock:
+            recent = list(self._recent.get(kind, ()))
+            if len(recent) < max(2, self.min_samples) or self.hedges + 1 > self.max_ratio * (self.calls + 1):
+                return None
+        
+        threshold = statistics.quantiles(recent, n=100)[self.percentile - 1]
+        return max(threshold, self.min_delay)
+    
+    def call(self, attempt: Callable[[AttemptClock], object], kind: str):
+        """
+        Run a call, hedging it if its request is slow.
+        
+        A losing attempt whose request was already sent cannot be
+        interrupted; its result is discarded.
+        
+        Args:
+            attempt: Callable taking an AttemptClock and returning the result
+            kind: Call kind, for the hedge delay and logs
+        
+        Returns:
+            Result of the first attempt that succeeded
+        
+        Raises:
+            TimeoutError: If no sent request answered within the deadline
+            Exception: The first attempt's error, if every attempt failed
+        """
+        executor = self._pool()
+        changed = threading.Event()
+        hedge_delay = self.delay(kind)
+        clocks = []
+        futures = []
+        
+        def launch():
+            clock = AttemptClock(changed.set)
+            future = executor.submit(attempt, clock)
+            future.add_done_callback(lambda _: changed.set())
+            clocks.append(clock)
+            futures.append(future)
+        
+        launch()
+        running = {0}
+        errors = {}  # attempt index -> error
+        
+        try:
+            while True:
+                changed.clear()
+                for index in sorted(index for index in running if futures[index].done()):
+                    running.discard(index)
+                    try:
+                        result = futures[index].result()
+                    except Exception as e:
+                        errors[index] = e
+                        continue
+                    self._record_call(kind, clocks[index], hedge_won=index > 0)
+                    return result
+                if not running:
+                    raise errors[min(errors)]
+                
+                now = time.monotonic()
+                wake_at = []
+                deadline = self._deadline([clocks[index] for index in sorted(running)])
+                if deadline is not None:
+                    if now >= deadline:
+                        self._record_deadline()
+                        raise TimeoutError(f"Sin respuesta en {self.deadline:g} s")
+                    wake_at.append(deadline)
+                
+                sent_at = clocks[0].sent_at
+                if len(futures) == 1 and hedge_delay is not None and sent_at is not None:
+                    if now >= sent_at + hedge_delay:
+                        launch()
+                        running.add(1)
+                        self._record_hedge(kind, now - sent_at)
+                        continue
+                    wake_at.append(sent_at + hedge_delay)
+                
+                # Woken early when an attempt is sent, backs off or finishes
+                changed.wait(max(0.0, min(wake_at) - now) if wake_at else None)
+        finally:
+            for clock in clocks:
+                clock.abandoned.set()
+    
+    def stream(self, attempt: Callable[[AttemptClock], Iterator], kind: str) -> Iterator:
+        """
+        Run a streamed call, hedging it if its first item is slow.
+        
+        If no item has arrived after the hedge delay, a duplicate stream is
+        opened. The first stream to produce an item (or to finish empty)
+        wins; the other is abandoned and stops at its next item.
+        
+        Args:
+            attempt: Callable taking an AttemptClock and returning an iterator of items
+            kind: Call kind, for the hedge delay and logs
+        
+        Yields:
+            Items of the winning stream
+        
+        Raises:
+            TimeoutError: If the stream did not finish within the deadline of being sent
+            Exception: The error of the winning stream, or of the first attempt if every attempt failed
+        """
+        executor = self._pool()
+        items = queue.Queue()
+        clocks = []
+        
+        def run(index, clock):
+            try:
+                stream = attempt(clock)
+                try:
+                    for item in stream:
+                        if clock.abandoned.is_set():
+                            return
+                        items.put((index, item))
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+                items.put((index, _STREAM_END))
+            except Exception as e:
+                items.put((index, e))
+        
+        def launch():
+            index = len(clocks)
+            clocks.append(AttemptClock(lambda: items.put((index, _SENT))))
+            executor.submit(run, index, clocks[index])
+        
+        hedge_delay = self.delay(kind)
+        winner = None
+        failed = {}  # attempt index -> error
+        launch()
+        
+        try:
+            while True:
+                now = time.monotonic()
+                if winner is None:
+                    deadline = self._deadline([clock for index, clock in enumerate(clocks) if index not in failed])
+                else:
+                    deadline = self._deadline([clocks[winner]])
+                
+                sent_at = clocks[0].sent_at
+                hedge_at = None
+                if winner is None and len(clocks) == 1 and hedge_delay is not None and sent_at is not None:
+                    hedge_at = sent_at + hedge_delay
+                
+                if deadline is not None and now >= deadline:
+                    self._record_deadline()
+                    raise TimeoutError(f"Sin respuesta en {self.deadline:g} s")
+                if hedge_at is not None and now >= hedge_at:
+                    launch()
+                    self._record_hedge(kind, now - sent_at)
+                    continue
+                
+                wake_at = [t for t in (deadline, hedge_at) if t is not None]
+                try:
+                    index, item = items.get(timeout=max(0.0, min(wake_at) - now) if wake_at else None)
+                except queue.Empty:
+                    continue
+                
+                if item is _SENT or (winner is not None and index != winner):
+                    continue
+                if isinstance(item, Exception):
+                    failed[index] = item
+                    if winner is not None or len(failed) == len(clocks):
+                        raise item if winner is not None else failed[min(failed)]
+                    continue
+                
+                if winner is None:
+                    # First item (or a complete empty stream): this attempt wins
+                    winner = index
+                    for other, clock in enumerate(clocks):
+                        if other != index:
+                            clock.abandoned.set()
+                    self._record_call(kind, clocks[index], hedge_won=index > 0)
+                if item is _STREAM_END:
+                    return
+                yield item
+        finally:
+            # Also runs when the caller stops reading or the deadline passes
+            for clock in clocks:
+                clock.abandoned.set()
+    
+    def _deadline(self, clocks: list[AttemptClock]) -> Optional[float]:
+        """
+        Monotonic time at which every sent attempt has been in flight for the deadline.
+        
+        Args:
+            clocks: Attempts still running, oldest first. A duplicate still
+                waiting for a slot does not hold the deadline back.
+        
+        Returns:
+            Deadline, or None if there is none or the oldest attempt is
+            queued or backing off (it gets a full deadline once it is sent)
+        """
+        sent = [clock.sent_at for clock in clocks]
+        if not self.deadline or not sent or sent[0] is None:
+            return None
+        return max(t for t in sent if t is not None) + self.deadline
+    
+    def _pool(self) -> ThreadPoolExecutor:
+        """Threads that run attempts (created on first use)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+            return self._executor
+    
+    def _record_call(self, kind: str, clock: AttemptClock, hedge_won: bool):
+        """Record how long the winning attempt took to answer, for future hedge delays."""
+        sent_at = clock.sent_at
+        with self._lock:
+            if sent_at is not None:
+                window = self._recent.setdefault(kind, deque(maxlen=self.window))
+                window.append(time.monotonic() - sent_at)
+            self.calls += 1
+            if hedge_won:
+                self.hedges_won += 1
+    
+    def _record_hedge(self, kind: str, elapsed: float):
+        """Record and log a duplicate attempt."""
+        with self._lock:
+            self.hedges += 1
+        logger.info("Llamada %s lenta (%.1f s), enviando duplicado", kind, elapsed)
+    
+    def _record_deadline(self):
+        """Record a call abandoned at its deadline."""
+        with self._lock:
+            self.deadlines += 1
+    
+    def stats(self) -> dict:
+        """
+        Get hedging statistics.
+        
+        Returns:
+            Dictionary with answered calls, duplicates sent, duplicates that won,
+            and calls abandoned at their deadline
+        """
+        with self._lock:
+            return {
+                "llamadas": self.calls,
+                "duplicadas": self.hedges,
+                "ganadas": self.hedges_won,
+                "plazos_vencidos": self.deadlines,
+            }
@@ -0,0 +1,109 @@
+"""
+Food Scanner - JSON Stream Module
+Incremental parser for a JSON array of objects arriving in chunks
+"""
+import json
+
+
+class JSONArrayStream:
+    """
+    Emits the elements of a top-level JSON array as soon as each one closes.
+    
+    Only the brackets, braces and strings of the text are tracked; each
+    complete element is handed to json.loads on its own. Anything before the
+    opening "[" (such as a markdown fence) is ignored.
+    """
+    
+    def __init__(self):
+        """Initialize an empty parser."""
+        self._buffer = ""
+        self._pos = 0  # Next character to scan
+        self._start = None  # Start of the element being read
+        self._depth = 0  # Nesting depth; 1 = inside the top-level array
+        self._in_string = False
+        self._escape = False
+        self.started = False  # Saw the opening "["
+        self.closed = False  # Saw the closing "]"
+    
+    def feed(self, chunk: str) -> list:
+        """
+        Add text and collect the elements it completes.
+        
+        Args:
+            chunk: Next piece of the response text
+        
+        Returns:
+            Parsed elements completed by this chunk, in order
+        
+        Raises:
+            ValueError: If a completed element is not valid JSON
+        """
+        if self.closed:
+            return []
+        
+        self._buffer += chunk
+        elements = []
+        buffer = self._buffer
+        
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            
+            if not self.started:
+                if char == "[":
+                    self.started = True
+                    self._depth = 1
+                continue
+            
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._start is None:
+                    self._start = pos
+            elif char in "[{":
+                if self._depth == 1:
+                    self._start = pos
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == 1:
+                    elements.append(self._take(pos + 1))
+                elif self._depth == 0:
+                    if self._start is not None:
+                        elements.append(self._take(pos))
+                    self.closed = True
+                    break
+            elif char == "," and self._depth == 1:
+                if self._start is not None:
+                    elements.append(self._take(pos))
+            elif self._depth == 1 and self._start is None and not char.isspace():
+                # Scalar element (number, true, false, null)
+                self._start = pos
+        
+        # Drop text already consumed to keep the buffer small
+        if self._start is not None:
+            self._buffer = buffer[self._start:]
+            self._start = 0
+        else:
+            self._buffer = ""
+        self._pos = len(self._buffer)
+        
+        return elements
+    
+    def _take(self, end: int):
+        """Parse the element between the recorded start and end."""
+        text = self._buffer[self._start:end].strip()
+        self._start = None
+        if not text:
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Elemento JSON inválido: {e}") from e
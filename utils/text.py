@@ -0,0 +1,29 @@
+"""
+Food Scanner - Text Module
+Text normalization helpers shared by caches and lookups
+"""
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize free text for use as a lookup key.
+    
+    Lowercases, strips accents and collapses whitespace, so
+    "Leche  Entera" and "leche entéra" produce the same key.
+    
+    Args:
+        text: Text to normalize
+        
+    Returns:
+        Normalized text
+    """
+    if not text:
+        return ""
+    
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    without_accents = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _WHITESPACE.sub(" ", without_accents.casefold()).strip()